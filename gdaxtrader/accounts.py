@@ -1,22 +1,169 @@
 #!/usr/bin/env python
 
+import threading
+import time
+
+from candleagg import parse_time
 import common
 from common import log
 import httpapi
 
+# Seconds of clock skew allowed between fill timestamps and the local clock.
+_clock_margin = 1.0
+
 class Info(object):
-    def __init__(self):
+    """
+    Account balances per currency, served from a cache that is refreshed from
+    GDAX only when it is older than <ttl> seconds or may have drifted from the
+    exchange's state.
+
+    Between refreshes the cache is kept current locally with on_order_placed
+    and on_fill (see orders.OrderManager and ordersync.sync_fills). Events the
+    cache cannot account for exactly (e.g. cancels, market orders) call
+    invalidate(), so the next read refreshes. Fills created before the last
+    refresh are already in its balances and are not applied again.
+
+    hits and misses count reads served from the cache and reads that needed a
+    refresh.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        # OID -> unfilled size of the orders passed to on_order_placed, whose
+        # fills on_fill can apply. Removed once filled or done.
+        self._placed = {}
+
+        self._lock = threading.RLock()
         self.refresh()
 
     def refresh(self):
         log.info('refreshing ACCOUNT INFO')
+        started = time.time()
         self._resp = httpapi.get(common.api_url + 'accounts', auth=common.auth)
-        self._accounts = {}
+        finished = time.time()
+
+        accounts = {}
         for acct in self._resp.json():
-            self._accounts[acct['currency']] = {k: v for k, v in acct.items() if k != 'currency'}
+            info = {k: v for k, v in acct.items() if k != 'currency'}
+            # Parse amounts once instead of on every read.
+            for k in ('balance', 'available', 'hold'):
+                if k in info:
+                    info[k] = float(info[k])
+            accounts[acct['currency']] = info
+
+        with self._lock:
+            self._accounts = accounts
+            self._refreshed = time.monotonic()
+            # Fills created in between may or may not be in the balances.
+            self._refresh_window = (started - _clock_margin, finished + _clock_margin)
+            self._drifted = False
+
+    def _fresh(self):
+        with self._lock:
+            if self._drifted or time.monotonic() - self._refreshed > self.ttl:
+                self.misses += 1
+                self.refresh()
+            else:
+                self.hits += 1
+            return self._accounts
+
+    def invalidate(self):
+        """
+        Marks the cached balances as possibly wrong; the next read refreshes.
+        """
+        with self._lock:
+            self._drifted = True
 
     def currencies(self):
-        return self._accounts.keys()
+        return self._fresh().keys()
 
     def available(self, currency):
-        return float(self._accounts[currency]['available'])
+        return self._fresh()[currency]['available']
+
+    def balance(self, currency):
+        return self._fresh()[currency]['balance']
+
+    def hold(self, currency):
+        return self._fresh()[currency]['hold']
+
+    def _adjust(self, currency, **deltas):
+        acct = self._accounts.get(currency)
+        if acct is None:
+            self._drifted = True
+            return
+        for k, delta in deltas.items():
+            acct[k] += delta
+
+    def on_order_placed(self, oid, product, side, price, size):
+        """
+        Moves the funds of a newly placed limit order from available to hold.
+
+        oid (str):      the order's ID, to recognize its fills.
+        product (str):  e.g. BTC-USD
+        side (str):     buy or sell
+        """
+        base, quote = product.split('-')
+        price, size = float(price), float(size)
+
+        with self._lock:
+            self._placed[oid] = size
+            if side == 'buy':
+                self._adjust(quote, available=-price * size, hold=price * size)
+            else:
+                self._adjust(base, available=-size, hold=size)
+
+    def on_order_done(self, oid):
+        """
+        Forgets an order which was cancelled (or is otherwise done); its
+        released hold is not known, so the cache is invalidated.
+        """
+        with self._lock:
+            self._placed.pop(oid, None)
+            self._drifted = True
+
+    def on_fill(self, fill):
+        """
+        Applies a fill (as returned by GDAX's /fills) of an order previously
+        passed to on_order_placed. Fills of other orders (e.g. placed
+        elsewhere or before startup) invalidate the cache instead, since
+        their hold is not known. Fills created before the last refresh are
+        skipped, and those created while it was in flight invalidate.
+        """
+        base, quote = fill['product_id'].split('-')
+        price, size = float(fill['price']), float(fill['size'])
+        fee = float(fill.get('fee', 0))
+        value = price * size
+        created = parse_time(fill['created_at'])
+
+        with self._lock:
+            oid = fill['order_id']
+            remaining = self._placed.get(oid)
+            if remaining is None:
+                self._drifted = True
+                return
+
+            # Tolerate float error in the summed fill sizes.
+            if remaining - size <= 1e-12:
+                del self._placed[oid]
+            else:
+                self._placed[oid] = remaining - size
+
+            started, finished = self._refresh_window
+            if created < started:
+                return
+            if created <= finished:
+                self._drifted = True
+                return
+
+            if fill['side'] == 'buy':
+                self._adjust(base, balance=size, available=size)
+                self._adjust(quote, balance=-value - fee, hold=-value)
+                if fee > 0:
+                    # Fees of buys are held up front at an unknown rate.
+                    self._drifted = True
+            else:
+                self._adjust(base, balance=-size, hold=-size)
+                self._adjust(quote, balance=value - fee, available=value - fee)
@@ -4,29 +4,43 @@ import json
 import hmac
 import hashlib
 import base64
+import threading
 import time
 import requests
 from requests.auth import AuthBase
-from datetime import datetime
 
 from common import log
+import httpapi
+
+# Seconds between refreshes of the cached server clock offset, and before
+# retrying a failed refresh.
+_time_sync_interval = 10 * 60
+_time_sync_retry = 30
 
 class CoinbaseExchangeAuth(AuthBase):
-    def __init__(self, api_key, secret_key, passphrase):
+    def __init__(self, api_key, secret_key, passphrase, time_url=None):
+        """
+        time_url (str):     GDAX time endpoint (e.g. api_url + 'time'). If set,
+                            timestamps are corrected by the server clock offset,
+                            refreshed every _time_sync_interval seconds.
+        """
         self.api_key = api_key
         self.secret_key = secret_key
         self.passphrase = passphrase
+        self.time_url = time_url
 
-    def __call__(self, request):
-        raw_time = time.time()
-        timestamp = str(raw_time)
+        # Decode the key once; each signature copies the pre-keyed HMAC.
+        self._hmac = hmac.new(base64.b64decode(secret_key), digestmod=hashlib.sha256)
 
-        log.info('executing AUTHENTICATED request')
-        log.info('unix timestamp: ' + timestamp)
-        log.info('UTC ISO8601: ' + datetime.utcfromtimestamp(raw_time).isoformat())
+        self._time_offset = 0.0
+        # Monotonic times of the last successful sync and of the next attempt.
+        self._time_synced = None
+        self._time_sync_due = 0.0
+        self._time_lock = threading.Lock()
 
+    def __call__(self, request):
         request.headers.update(self.auth_header(
-                timestamp,
+                self.timestamp(),
                 request.method,
                 request.path_url,
                 request.body,
@@ -34,6 +48,50 @@ class CoinbaseExchangeAuth(AuthBase):
 
         return request
 
+    def _sync_time(self):
+        """
+        Fetches the server time and updates the clock offset. The local
+        midpoint of the round trip (after any rate limit wait) is compared
+        against the server epoch.
+
+        Returns whether the offset was updated.
+        """
+        try:
+            before = time.time()
+            resp = httpapi.get(self.time_url)
+            after = time.time()
+            before += httpapi.last_wait()
+            if resp.status_code != 200:
+                raise ValueError('status code {}'.format(resp.status_code))
+            epoch = float(resp.json()['epoch'])
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            log.warn('failed to sync SERVER TIME: %s', e)
+            return False
+
+        self._time_offset = epoch - (before + after) / 2
+        log.info('server clock offset: %.3fs', self._time_offset)
+        return True
+
+    def timestamp(self):
+        """
+        Returns the current server time (local time plus the cached offset)
+        as a string for the CB-ACCESS-TIMESTAMP header.
+
+        A failed sync keeps the previous offset and is retried after
+        _time_sync_retry seconds.
+        """
+        now = time.monotonic()
+        if self.time_url is not None and now >= self._time_sync_due:
+            with self._time_lock:
+                if now >= self._time_sync_due:
+                    if self._sync_time():
+                        self._time_synced = now
+                        self._time_sync_due = now + _time_sync_interval
+                    else:
+                        self._time_sync_due = now + _time_sync_retry
+
+        return str(time.time() + self._time_offset)
+
     def auth_header(self, timestamp, method, path_url, body):
         """
         Returns the auth headers required for GDAX for a given UNIX timestamp,
@@ -43,8 +101,8 @@ class CoinbaseExchangeAuth(AuthBase):
         message = timestamp + method + path_url + (body or '')
         message = message.encode('ascii')
 
-        hmac_key = base64.b64decode(self.secret_key)
-        signature = hmac.new(hmac_key, message, hashlib.sha256)
+        signature = self._hmac.copy()
+        signature.update(message)
         signature_b64 = base64.b64encode(signature.digest()).decode('utf-8')
 
         return {
@@ -54,5 +112,3 @@ class CoinbaseExchangeAuth(AuthBase):
             'CB-ACCESS-PASSPHRASE': self.passphrase,
             'Content-Type': 'application/json'
         }
-
-
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+
+# Local benchmarks. None of these talk to GDAX; the client benchmarks run
+# against mockexchange.MockExchange.
+#
+# Usage:
+#     python bench.py [name ...]
+#
+# Runs every benchmark if no names are given.
+
+import base64
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import requests
+
+import common
+from common import log
+import accounts
+import auth
+import backtest
+from candles import Candles
+import httpapi
+import indicators
+import marketdata
+import metrics
+from mockexchange import MockExchange
+import orderbook
+import orders
+import scrape
+import sweep
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def _report(label, samples):
+    print('{:<28} n={:<6} p50={:8.3f}ms p99={:8.3f}ms mean={:8.3f}ms'.format(
+        label,
+        len(samples),
+        _percentile(samples, 50) * 1000,
+        _percentile(samples, 99) * 1000,
+        sum(samples) / len(samples) * 1000,
+        ))
+
+def _timeit(fn, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _report_rate(label, n, seconds, unit='req'):
+    print('{:<28} n={:<6} {:10.1f} {}/s'.format(label, n, n / seconds, unit))
+
+def _timed_concurrently(fn, args, n_workers):
+    """
+    Calls fn on each of args from <n_workers> threads.
+
+    Returns the per-call latencies and the wall time.
+    """
+    def timed(arg):
+        start = time.perf_counter()
+        fn(arg)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        samples = list(pool.map(timed, args))
+    return samples, time.perf_counter() - start
+
+@contextmanager
+def _mock_api(**kwargs):
+    """
+    Points common.api_url at a MockExchange (and lifts the rate limit) for
+    the duration of the block. Requests are signed with a dummy key, so no
+    secrets file is needed. The client's per-request INFO lines only go to
+    the log file, so they do not bury the results on stderr.
+    """
+    exchange = MockExchange(**kwargs)
+    api_url, api_auth = common.api_url, common.auth
+    common.api_url = exchange.start()
+    common.auth = auth.CoinbaseExchangeAuth('key', base64.b64encode(b'x' * 64).decode('ascii'), 'passphrase')
+    httpapi.configure(rate_limited=False)
+    stderr_level = log.stderr_level(logging.WARNING)
+    try:
+        yield exchange
+    finally:
+        log.stderr_level(stderr_level)
+        common.api_url, common.auth = api_url, api_auth
+        httpapi.configure(rate_limited=True)
+        exchange.stop()
+
+
+def bench_http(n=500):
+    """
+    Per-request latency of a fresh connection per request (module-level
+    requests.get, the old httpapi behaviour) against httpapi's pooled sessions.
+    """
+    with _mock_api():
+        url = common.api_url + 'time'
+        _report('requests.get (before)', _timeit(lambda: requests.get(url), n))
+        _report('httpapi.session().get', _timeit(lambda: httpapi.session().get(url), n))
+        _report('httpapi.get (after)', _timeit(lambda: httpapi.get(url), n))
+
+def bench_exchange(n=200, n_workers=8, latency=0.005):
+    """
+    End-to-end client throughput against a MockExchange answering after
+    <latency> seconds: candles, account info, order placement and
+    cancellation (sequential and through OrderManager) and fill pagination.
+    """
+    with _mock_api(latency=latency) as exchange:
+        end_dt = datetime(2017, 9, 1)
+        start_dt = end_dt - timedelta(seconds=60 * (marketdata.max_ticks - 1))
+        samples = _timeit(lambda: marketdata.get_rates('BTC-USD', start_dt, end_dt, 60, cache=False), n)
+        _report('candles', samples)
+        _report_rate('candles', n, sum(samples))
+
+        samples = _timeit(accounts.Info, n)
+        _report('accounts', samples)
+        _report_rate('accounts', n, sum(samples))
+
+        samples = _timeit(lambda: orders.Limit('buy', 'BTC-USD', 1000, 0.01).place(), n)
+        _report('place (sequential)', samples)
+        _report_rate('place (sequential)', n, sum(samples))
+
+        ladder = [orders.Limit('buy', 'BTC-USD', 1000 - i * 0.01, 0.01) for i in range(n)]
+        samples, wall = _timed_concurrently(lambda order: order.place(), ladder, n_workers)
+        _report('place ({} threads)'.format(n_workers), samples)
+        _report_rate('place ({} threads)'.format(n_workers), n, wall)
+
+        manager = orders.OrderManager(n_workers=n_workers)
+        ladder = [orders.Limit('sell', 'BTC-USD', 9000 + i * 0.01, 0.001) for i in range(n)]
+        start = time.perf_counter()
+        results = manager.place_many(ladder)
+        _report_rate('OrderManager.place_many', n, time.perf_counter() - start)
+
+        oids = [r.oid for r in results if r.oid is not None]
+        for oid in oids[:n // 2]:
+            exchange.fill(oid)
+        start = time.perf_counter()
+        manager.cancel_many(oids[n // 2:])
+        _report_rate('OrderManager.cancel_many', len(oids) - n // 2, time.perf_counter() - start)
+        manager.shutdown()
+
+        start = time.perf_counter()
+        n_fills = sum(1 for _ in orders.iter_filled('BTC-USD', limit=10))
+        _report_rate('iter_filled (10 per page)', n_fills, time.perf_counter() - start, unit='fill')
+
+def bench_backfill(days=30, granularity=60, n_workers=4, latency=0.01):
+    """
+    Candles per second backfilled by scrape.get_rates_parallel from a
+    MockExchange with <latency>, 2% candle gaps and 2% injected 429s.
+    """
+    end_dt = datetime(2017, 9, 1)
+    start_dt = end_dt - timedelta(days=days)
+
+    for workers in sorted({1, n_workers}):
+        with _mock_api(latency=latency, gap_rate=0.02, throttle_rate=0.02, retry_after=0.01) as exchange:
+            start = time.perf_counter()
+            rates = scrape.get_rates_parallel('BTC-USD', start_dt, end_dt, granularity, n_workers=workers)
+            elapsed = time.perf_counter() - start
+
+        label = 'backfill ({} workers)'.format(workers)
+        _report_rate(label, len(rates), elapsed, unit='candle')
+        _report_rate(label, exchange.n_requests, elapsed)
+
+
+def bench_logging(n=100000):
+    """
+    Caller-side cost of the log calls made on every httpapi request.
+    """
+    url = 'https://api.gdax.com/products/BTC-USD/candles'
+    params = {'granularity': 5}
+    body = b'[' + b'[1504224000, 4700.0, 4710.0, 4705.0, 4708.0, 1.5],' * 200 + b']'
+
+    _report('log.info (file only)', _timeit(lambda: log.info('GET %s params=%s', url, params, stderr=False), n))
+    _report('log.payload (40KB body)', _timeit(lambda: log.payload(body), n))
+
+def bench_metrics(n=100000):
+    """
+    Caller-side cost of the metrics httpapi records for every request.
+    """
+    timings = dict(sign=2e-5, queue=0.0, network=0.05, total=0.051)
+
+    _report('metrics.endpoint', _timeit(lambda: metrics.endpoint('/orders/7d0f7d8e-6a0e-4d9b'), n))
+    _report('metrics.record', _timeit(lambda: metrics.record('GET', '/time', 200, **timings), n))
+    _report('metrics.snapshot', _timeit(lambda: metrics.snapshot(window=3600), 100))
+    metrics.reset()
+
+def bench_auth(n=100000):
+    """
+    Signatures per second of the pre-keyed signer against decoding the key and
+    building a new HMAC per request (the old auth_header).
+    """
+    import hashlib
+    import hmac
+
+    secret = base64.b64encode(b'x' * 64).decode('ascii')
+    signer = auth.CoinbaseExchangeAuth('key', secret, 'passphrase')
+    body = json.dumps({'side': 'buy', 'type': 'limit', 'product_id': 'BTC-USD',
+        'price': '4700.00', 'size': '0.01'})
+
+    def old_sign():
+        message = (str(time.time()) + 'POST' + '/orders' + body).encode('ascii')
+        hmac_key = base64.b64decode(secret)
+        signature = hmac.new(hmac_key, message, hashlib.sha256)
+        return base64.b64encode(signature.digest()).decode('utf-8')
+
+    def new_sign():
+        return signer.auth_header(signer.timestamp(), 'POST', '/orders', body)
+
+    for label, fn in (
+            ('decode + hmac.new (before)', old_sign),
+            ('pre-keyed copy (after)', new_sign),
+            ):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        elapsed = time.perf_counter() - start
+        print('{:<28} {:>10.0f} signatures/s'.format(label, n / elapsed))
+
+def _legacy_mov_avg(rates, window):
+    # timeseries.mov_avg before indicators.
+    mas = []
+    for i, rate in enumerate(rates):
+        if i < window - 1:
+            continue
+        if len(mas) == 0:
+            mas.append(sum(rates[:window]) / window)
+            continue
+        mas.append(mas[i-window] * ( (window-1) / window ) + (rate / window))
+    return mas
+
+def _legacy_bollingers(rates, window, n_std):
+    # timeseries.bollingers before indicators.
+    import pandas as pd
+
+    mov_avg = pd.Series(rates).rolling(window=window).mean()
+    mov_std = pd.Series(rates).rolling(window=window).std()
+
+    truncate = lambda l: l[-(len(l) - window + 1):]
+    return (truncate(list(mov_avg)),
+            truncate(list(mov_avg - n_std * mov_std)),
+            truncate(list(mov_avg + n_std * mov_std)))
+
+def bench_indicators(n=10 * 1000 * 1000, window=14):
+    """
+    Old list/pandas based mov_avg and bollingers against indicators on an
+    n-point random walk.
+    """
+    import numpy as np
+
+    rates = 4000 + np.cumsum(np.random.RandomState(0).normal(0, 1, n))
+    rates_list = rates.tolist()
+
+    def run(label, fn):
+        start = time.perf_counter()
+        out = fn()
+        print('{:<28} {:8.3f}s'.format(label, time.perf_counter() - start))
+        return out
+
+    old = run('mov_avg (before)', lambda: _legacy_mov_avg(rates_list, window))
+    new = run('mov_avg (after)', lambda: indicators.mov_avg(rates, window))
+    print('{:<28} {:.3g}'.format('max abs diff', np.max(np.abs(np.array(old) - new))))
+
+    old = run('bollingers (before)', lambda: _legacy_bollingers(rates, window, 2))
+    new = run('bollingers (after)', lambda: indicators.bollingers(rates, window, 2))
+    print('{:<28} {:.3g}'.format('max abs diff', max(
+        np.max(np.abs(np.array(o) - n)) for o, n in zip(old, new))))
+
+    run('ema', lambda: indicators.ema(rates, window))
+    run('rsi', lambda: indicators.rsi(rates, window))
+
+def _random_walk_candles(n, granularity=5, seed=0):
+    """
+    Returns n Candles of a geometric random walk around 4000.
+    """
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+    close = 4000 * np.exp(np.cumsum(rng.normal(0, 2e-4, n)))
+    open_ = np.concatenate((close[:1], close[:-1]))
+    wick = np.abs(rng.normal(0, 2e-4, (2, n)))
+
+    return Candles(np.vstack([
+        np.arange(n) * float(granularity),
+        np.minimum(open_, close) * (1 - wick[0]),
+        np.maximum(open_, close) * (1 + wick[1]),
+        open_,
+        close,
+        rng.exponential(1, n),
+        ]))
+
+def bench_backtest(n=365 * 24 * 60 * 12):
+    """
+    backtest.backtest over a year of synthetic 5 second candles.
+    """
+    candles = _random_walk_candles(n)
+
+    start = time.perf_counter()
+    result = backtest.backtest(candles, window=20, n_std=2, limit_offset=1e-4)
+    elapsed = time.perf_counter() - start
+
+    print('{:<28} {:8.3f}s'.format('backtest ({} candles)'.format(n), elapsed))
+    print('{:<28} {} ({} maker)'.format('trades', result.n_trades, result.n_maker))
+
+def bench_sweep(n=30 * 24 * 60 * 12, n_products=2):
+    """
+    sweep.sweep of a 24 run grid per product over a month of synthetic 5
+    second candles, with one process and with one per core.
+    """
+    candles = {'P{}-USD'.format(i): _random_walk_candles(n, seed=i) for i in range(n_products)}
+    params = sweep.grid(window=[10, 20, 40, 80], n_std=[1.5, 2, 2.5], trend_window=[None, 720])
+
+    for n_procs in sorted({1, os.cpu_count()}):
+        start = time.perf_counter()
+        table = sweep.sweep(candles, params, n_procs=n_procs)
+        elapsed = time.perf_counter() - start
+        _report_rate('sweep ({} processes)'.format(n_procs), len(table), elapsed, unit='run')
+
+    print(table.head(5).to_string())
+
+def bench_orderbook(n=1000 * 1000, n_levels=2000):
+    """
+    Sustained update throughput of orderbook.replay over a synthetic recording
+    of one snapshot followed by n l2updates around the mid price.
+    """
+    import random
+    import tempfile
+
+    rnd = random.Random(0)
+    mid = 4000.0
+    fd, fname = tempfile.mkstemp(suffix='.jsonl')
+    with os.fdopen(fd, 'w') as f:
+        f.write(json.dumps({
+            'type': 'snapshot',
+            'product_id': 'BTC-USD',
+            'bids': [['{:.2f}'.format(mid - 0.01 * i), '1.0'] for i in range(1, n_levels)],
+            'asks': [['{:.2f}'.format(mid + 0.01 * i), '1.0'] for i in range(1, n_levels)],
+            }) + '\n')
+        for _ in range(n):
+            side = rnd.choice(('buy', 'sell'))
+            offset = 0.01 * int(rnd.expovariate(0.02) + 1)
+            price = mid - offset if side == 'buy' else mid + offset
+            size = 0 if rnd.random() < 0.3 else rnd.random()
+            f.write(json.dumps({
+                'type': 'l2update',
+                'product_id': 'BTC-USD',
+                'changes': [[side, '{:.2f}'.format(price), '{:.8f}'.format(size)]],
+                }) + '\n')
+
+    try:
+        start = time.perf_counter()
+        books, n_msgs = orderbook.replay(fname)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.remove(fname)
+
+    book = books['BTC-USD']
+    print('{:<28} {:>10.0f} msgs/s ({} msgs in {:.2f}s)'.format('replay', n_msgs / elapsed, n_msgs, elapsed))
+    print('{:<28} bid={} ask={}'.format('final book', book.best_bid(), book.best_ask()))
+
+    start = time.perf_counter()
+    for _ in range(n):
+        book.best_bid()
+        book.best_ask()
+    print('{:<28} {:>10.3f}us'.format('best bid + ask', (time.perf_counter() - start) / n * 1e6))
+
+
+_benchmarks = {
+        'auth': bench_auth,
+        'backfill': bench_backfill,
+        'backtest': bench_backtest,
+        'exchange': bench_exchange,
+        'http': bench_http,
+        'indicators': bench_indicators,
+        'orderbook': bench_orderbook,
+        'sweep': bench_sweep,
+        'logging': bench_logging,
+        'metrics': bench_metrics,
+        }
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(_benchmarks)
+    for name in names:
+        print('== ' + name)
+        _benchmarks[name]()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Builds OHLCV candles locally from the trades ('match' messages) of the GDAX
+# websocket feed, so live candles need no REST polling.
+# https://docs.gdax.com/#the-code-classprettyprintmatchescode-channel
+
+import calendar
+import queue
+import threading
+
+from common import log
+
+# Most candles StoreSink writes in one statement.
+_max_batch = 500
+
+
+def parse_time(iso):
+    """
+    Returns the unix time of a feed timestamp such as
+    '2017-09-02T17:05:49.250000Z', several times faster than strptime.
+    """
+    secs = calendar.timegm((
+        int(iso[0:4]), int(iso[5:7]), int(iso[8:10]),
+        int(iso[11:13]), int(iso[14:16]), int(iso[17:19])))
+
+    frac = iso[19:].rstrip('Z')
+    if frac:
+        return secs + float(frac)
+    return secs
+
+
+class _Bucket(object):
+    __slots__ = ('start', 'low', 'high', 'open', 'close', 'volume', 'emitted', 'partial')
+
+    def __init__(self, start, price, size, partial=False):
+        self.start = start
+        self.low = self.high = self.open = self.close = price
+        self.volume = size
+        self.emitted = False
+        # Trades before the first one seen may be missing.
+        self.partial = partial
+
+    def add(self, price, size):
+        if price < self.low:
+            self.low = price
+        elif price > self.high:
+            self.high = price
+        self.close = price
+        self.volume += size
+
+    def rate(self):
+        return [self.start, self.low, self.high, self.open, self.close, self.volume]
+
+
+class CandleAggregator(object):
+    """
+    Aggregates trades of one product into candles of one or more granularities
+    (in seconds, e.g. 1, 5, 60).
+
+    A candle is emitted through on_candle(product, granularity, rate) as soon
+    as its bucket closes: when a later trade arrives, or when flush() is called
+    past the end of the bucket (call it on a timer so quiet periods still
+    close). rate has the schema of marketdata.get_rates:
+        [unix time, low, high, open, close, volume]
+
+    Like GDAX, no candles are emitted for buckets without trades. on_candle is
+    called without holding the aggregator's lock, from the thread that added
+    the trade or called flush().
+
+    Trades of the first bucket of each granularity seen after the aggregator
+    is created or the feed (re)subscribes may be missing, so that bucket is
+    dropped rather than emitted (counted in n_partial). Only 'match' messages
+    are aggregated: the 'last_match' sent on subscribe may be old.
+
+    Example:
+        sink = StoreSink(5)
+        agg = CandleAggregator('BTC-USD', [5, 60], on_candle=sink)
+        feed = orderbook.Feed(['BTC-USD'], channels=['matches'], handlers=[agg.process],
+                on_stop=[sink.flush])
+    """
+
+    def __init__(self, product, granularities=(5,), on_candle=None):
+        self.product = product
+        self.granularities = list(granularities)
+        self.on_candle = on_candle
+
+        self.n_trades = 0
+        # Trades for buckets that were already emitted.
+        self.n_late = 0
+        # Partial buckets dropped.
+        self.n_partial = 0
+
+        self._buckets = {g: None for g in self.granularities}
+        # Granularities whose next new bucket is partial.
+        self._partial = set(self.granularities)
+        self._lock = threading.Lock()
+
+    def _emit(self, ready, granularity, bucket):
+        """
+        Closes bucket and adds its candle to ready, unless it is partial.
+        on_candle is called with the ready candles once the lock is released.
+        """
+        bucket.emitted = True
+        if bucket.partial:
+            self.n_partial += 1
+        else:
+            ready.append((granularity, bucket.rate()))
+
+    def _deliver(self, ready):
+        if self.on_candle is not None:
+            for granularity, rate in ready:
+                self.on_candle(self.product, granularity, rate)
+
+    def reset(self):
+        """
+        Drops the candles being built and the first bucket of each
+        granularity after this call, e.g. after trades were missed while the
+        feed was disconnected.
+        """
+        with self._lock:
+            for g in self.granularities:
+                bucket = self._buckets[g]
+                if bucket is not None and not bucket.emitted:
+                    bucket.partial = True
+            self._partial = set(self.granularities)
+
+    def add_trade(self, ts, price, size):
+        """
+        Adds a trade at unix time ts.
+        """
+        ready = []
+        with self._lock:
+            self.n_trades += 1
+            for g in self.granularities:
+                start = int(ts) // g * g
+                bucket = self._buckets[g]
+
+                if bucket is None or start > bucket.start:
+                    if bucket is not None and not bucket.emitted:
+                        self._emit(ready, g, bucket)
+                    self._buckets[g] = _Bucket(start, price, size, partial=g in self._partial)
+                    self._partial.discard(g)
+                elif start == bucket.start and not bucket.emitted:
+                    # A bucket open across reset() is already partial.
+                    bucket.add(price, size)
+                    self._partial.discard(g)
+                else:
+                    self.n_late += 1
+
+        self._deliver(ready)
+
+    def process(self, msg):
+        """
+        Handles a decoded feed message; anything but this product's matches and
+        the 'subscriptions' confirmation of a (re)subscribe is ignored.
+        """
+        msg_type = msg.get('type')
+        if msg_type == 'subscriptions':
+            self.reset()
+            return
+
+        if msg_type != 'match' or msg.get('product_id') != self.product:
+            return
+
+        self.add_trade(parse_time(msg['time']), float(msg['price']), float(msg['size']))
+
+    def flush(self, now):
+        """
+        Emits the candles whose bucket ended at or before unix time now.
+        """
+        ready = []
+        with self._lock:
+            for g in self.granularities:
+                bucket = self._buckets[g]
+                # The emitted bucket is kept so late trades are detected.
+                if bucket is not None and not bucket.emitted and bucket.start + g <= now:
+                    self._emit(ready, g, bucket)
+
+        self._deliver(ready)
+
+    def current(self, granularity):
+        """
+        Returns the candle still being built, or None.
+        """
+        bucket = self._buckets[granularity]
+        if bucket is None or bucket.emitted or bucket.partial:
+            return None
+        return bucket.rate()
+
+
+class StoreSink(object):
+    """
+    on_candle callback which writes candles of one granularity into hist_rates
+    with scrape.store_rates (hist_rates holds one granularity).
+
+    Candles are queued and written by a background thread, up to _max_batch
+    per statement, so the feed thread never waits for the DB. A batch that
+    fails to store is logged and dropped.
+
+    The rollups (see rollup) of the candles stored are updated once every
+    <rollup_secs> seconds of candles per product rather than for every
+    candle. Call flush(now) on a timer so the rollups of a product that went
+    quiet are updated too, and flush() when the feed stops (see
+    orderbook.Feed's on_stop).
+    """
+
+    def __init__(self, granularity, rollup_secs=300):
+        self.granularity = granularity
+        self.rollup_secs = rollup_secs
+        # product -> (first, last) timestamp stored since the last rollup update
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._writer = None
+
+    def __call__(self, product, granularity, rate):
+        if granularity != self.granularity:
+            return
+
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, daemon=True)
+                self._writer.start()
+        self._queue.put((product, rate))
+
+    def _write(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < _max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._store(batch)
+            except Exception as e:
+                log.error('failed to store {} live candles: {}'.format(len(batch), e))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _store(self, batch):
+        # Imported here so aggregating alone does not need a DB driver.
+        import rollup
+        import scrape
+
+        by_product = {}
+        for product, rate in batch:
+            by_product.setdefault(product, []).append(rate)
+
+        for product, rates in by_product.items():
+            scrape.store_rates(rates, product, rollups=False)
+
+            with self._lock:
+                first_ts, last_ts = self._pending.get(product, (rates[0][0], rates[0][0]))
+                first_ts = min(first_ts, min(rate[0] for rate in rates))
+                last_ts = max(last_ts, max(rate[0] for rate in rates))
+                if last_ts + self.granularity - first_ts >= self.rollup_secs:
+                    rollup.update(product, first_ts, last_ts)
+                    self._pending.pop(product, None)
+                else:
+                    self._pending[product] = (first_ts, last_ts)
+
+    def flush(self, now=None):
+        """
+        Waits for the queued candles to be stored, then updates the rollups of
+        the candles stored but not rolled up yet: of every product, or with
+        unix time now, of the products whose oldest such candle started at
+        least rollup_secs before now.
+        """
+        import rollup
+
+        self._queue.join()
+
+        with self._lock:
+            for product, (first_ts, last_ts) in list(self._pending.items()):
+                if now is None or now - first_ts >= self.rollup_secs:
+                    rollup.update(product, first_ts, last_ts)
+                    del self._pending[product]
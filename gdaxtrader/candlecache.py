@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# Persistent local cache of historic rates, one file per (product, granularity).
+#
+# Candles are stored column-wise as the (6, N) float64 array of a
+# candles.Candles, so each column is contiguous and the file can be
+# memory-mapped.
+# They are written in segments: <product>_<granularity>.npy plus
+# <product>_<granularity>.<n>.npy, newest n last. A put only writes its own
+# candles as a new segment, then merges the newest segments while the last is
+# at least half the size of the one before it. Each candle is thus rewritten
+# O(log N) times in all rather than on every put, and there are O(log N)
+# segments to read.
+# Alongside them a (M, 2) int64 .npy array records which time ranges have been
+# fetched, which lets callers tell "no trades in this range" apart from
+# "never fetched" and only go to the network for the gaps.
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from candles import Candles
+
+_cache_dir = 'cache'
+
+_lock = threading.Lock()
+
+# (product, granularity) -> (mtime, segments, coverage)
+_loaded = {}
+
+
+def _path(product, granularity, suffix):
+    return os.path.join(_cache_dir, '{}_{}{}.npy'.format(product, granularity, suffix))
+
+def _segment_path(product, granularity, n):
+    return _path(product, granularity, '.{}'.format(n) if n > 0 else '')
+
+def _segment_ids(product, granularity):
+    """
+    Returns the numbers of the segment files of a key in ascending order.
+    """
+    prefix = '{}_{}'.format(product, granularity)
+    ids = []
+    for fname in os.listdir(_cache_dir):
+        if fname == prefix + '.npy':
+            ids.append(0)
+        elif fname.startswith(prefix + '.') and fname.endswith('.npy'):
+            n = fname[len(prefix) + 1:-len('.npy')]
+            if n.isdigit():
+                ids.append(int(n))
+    return sorted(ids)
+
+def _save(path, arr):
+    """
+    Writes arr atomically so readers never see a partial file.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+def _load(product, granularity):
+    """
+    Returns the list of (number, memory-mapped Candles) segments and the
+    coverage of a key. They are memoized in-process until the coverage file
+    changes on disk.
+    """
+    key = (product, granularity)
+    cov_path = _path(product, granularity, '_coverage')
+
+    try:
+        mtime = os.stat(cov_path).st_mtime_ns
+    except FileNotFoundError:
+        return [], np.empty((0, 2), dtype=np.int64)
+
+    cached = _loaded.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    segments = [(n, Candles(np.load(_segment_path(product, granularity, n), mmap_mode='r')))
+            for n in _segment_ids(product, granularity)]
+    coverage = np.load(cov_path)
+    _loaded[key] = (mtime, segments, coverage)
+
+    return segments, coverage
+
+def _align(start_ts, end_ts, granularity):
+    """
+    Returns the first and last candle timestamps inside [start_ts, end_ts].
+    """
+    return -(-int(start_ts) // granularity) * granularity, int(end_ts) // granularity * granularity
+
+def last_closed(granularity, now=None):
+    """
+    Returns the timestamp of the most recent candle that can no longer change.
+    """
+    if now is None:
+        now = time.time()
+    return int(now) // granularity * granularity - granularity
+
+def missing(product, granularity, start_ts, end_ts):
+    """
+    Returns the list of (start, end) candle timestamp ranges (inclusive) within
+    [start_ts, end_ts] that are not in the cache.
+    """
+    lo, hi = _align(start_ts, end_ts, granularity)
+    _, coverage = _load(product, granularity)
+
+    # Coverage ranges are sorted and disjoint: only look at those overlapping
+    # [lo, hi].
+    first = np.searchsorted(coverage[:, 1], lo, side='left')
+    last = np.searchsorted(coverage[:, 0], hi, side='right')
+
+    gaps = []
+    for cov_lo, cov_hi in coverage[first:last].tolist():
+        if cov_lo > lo:
+            gaps.append((lo, cov_lo - granularity))
+        lo = cov_hi + granularity
+
+    if lo <= hi:
+        gaps.append((lo, hi))
+
+    return gaps
+
+def get(product, granularity, start_ts, end_ts):
+    """
+    Returns the cached candles in [start_ts, end_ts] as a Candles view (or a
+    copy if they span several segments).
+    """
+    segments, _ = _load(product, granularity)
+    parts = [candles.slice(start_ts, end_ts) for _, candles in segments]
+    parts = [part for part in parts if len(part) > 0]
+    if len(parts) == 1:
+        return parts[0]
+
+    # Newer segments win over older ones with the same timestamp.
+    merged = Candles()
+    for part in parts:
+        merged.append(part)
+    return merged
+
+def _merge_coverage(coverage, ranges, granularity):
+    merged = []
+    for lo, hi in sorted([tuple(r) for r in coverage] + list(ranges)):
+        if merged and lo <= merged[-1][1] + granularity:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+def put(product, granularity, ranges, rates):
+    """
+    Adds fetched candles to the cache and marks ranges as covered.
+
+    ranges (list):  (start_ts, end_ts) windows that were fetched. Only candles
+                    that have closed are marked as covered.
+    rates (list):   Candles or ticks with the schema
+                        [unix time, low, high, open, close, volume]
+    """
+    closed = last_closed(granularity)
+    covered = []
+    for start_ts, end_ts in ranges:
+        lo, hi = _align(start_ts, end_ts, granularity)
+        hi = min(hi, closed)
+        if lo <= hi:
+            covered.append((lo, hi))
+
+    # Do not cache candles which may still change.
+    new = Candles.from_rates(rates).slice(end_ts=closed)
+
+    with _lock:
+        if not os.path.exists(_cache_dir):
+            os.makedirs(_cache_dir)
+
+        segments, coverage = _load(product, granularity)
+
+        if len(new) > 0:
+            n = segments[-1][0] + 1 if segments else 0
+            _save(_segment_path(product, granularity, n), new.data)
+            segments = segments + [(n, new)]
+
+            while len(segments) > 1 and 2 * len(segments[-1][1]) >= len(segments[-2][1]):
+                (older_n, older), (newer_n, newer) = segments[-2:]
+                # Newly fetched candles win over cached ones with the same
+                # timestamp. append copies, so the memory map is not written.
+                merged = Candles(older.data).append(newer)
+                _save(_segment_path(product, granularity, older_n), merged.data)
+                os.remove(_segment_path(product, granularity, newer_n))
+                segments = segments[:-2] + [(older_n, merged)]
+
+        coverage = _merge_coverage(coverage, covered, granularity)
+        cov_path = _path(product, granularity, '_coverage')
+        _save(cov_path, coverage)
+
+        # Readers in this process pick up the new segments without reloading
+        # them, even if the coverage mtime did not visibly change.
+        _loaded[(product, granularity)] = (os.stat(cov_path).st_mtime_ns, segments, coverage)
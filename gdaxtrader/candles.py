@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# Compact, array-backed container for historic rates.
+#
+# Everything is float64, so a year of 5-second candles costs about 300 MB.
+# float32 would halve that but cannot represent the data: its 24-bit mantissa
+# rounds prices above $16384 to a multiple of ~0.002 (so cents are lost at
+# BTC prices) and GDAX reports volumes to 1e-8. Unix times are exact in
+# float64 until 2**53. One dtype also keeps the candles a single (6, n) array,
+# which np.save/np.load (candlecache, sweep) and the zero-copy to_df rely on.
+
+import numpy as np
+
+# Rows of the backing array: the same schema as marketdata.get_rates.
+columns = ('time', 'low', 'high', 'open', 'close', 'volume')
+n_cols = len(columns)
+
+# Column names of ratesutil.to_df.
+df_columns = ['unixTS', 'low', 'high', 'open', 'close', 'val']
+
+
+class Candles(object):
+    """
+    Candles sorted by ascending time with unique timestamps, stored as one
+    (6, capacity) float64 array so each column is contiguous: 48 bytes per
+    candle instead of a Python list of 6 objects.
+
+    Accepted anywhere a list of ticks with the schema
+        [unix time, low, high, open, close, volume]
+    is (ratesutil.to_df, visualize.hist_rates, scrape.store_rates, ...).
+
+    Example:
+        candles = Candles.from_rates(rates)
+        candles.append(more_rates)
+        day = candles.slice(start_ts, end_ts)
+        ts.bollingers(day.close)
+    """
+
+    def __init__(self, data=None):
+        """
+        data (ndarray):     (6, n) array already sorted by unique ascending
+                            time. It is used without copying.
+        """
+        if data is None:
+            data = np.empty((n_cols, 0))
+
+        assert(data.shape[0] == n_cols)
+
+        self._buf = data
+        self._n = data.shape[1]
+        # Views (e.g. from slice) must not grow into memory they share.
+        self._owns = data.flags.owndata
+
+    @classmethod
+    def from_rates(cls, rates):
+        """
+        Builds Candles from ticks in any order (e.g. the descending order
+        returned by GDAX). For duplicate timestamps the first tick wins.
+        """
+        if isinstance(rates, Candles):
+            return rates
+
+        arr = np.array(rates, dtype=np.float64).reshape(-1, n_cols).T
+        _, idx = np.unique(arr[0], return_index=True)
+        return cls(np.ascontiguousarray(arr[:, idx]))
+
+    @property
+    def data(self):
+        """
+        The (6, n) array view of the candles.
+        """
+        return self._buf[:, :self._n]
+
+    @property
+    def time(self):
+        return self._buf[0, :self._n]
+
+    @property
+    def low(self):
+        return self._buf[1, :self._n]
+
+    @property
+    def high(self):
+        return self._buf[2, :self._n]
+
+    @property
+    def open(self):
+        return self._buf[3, :self._n]
+
+    @property
+    def close(self):
+        return self._buf[4, :self._n]
+
+    @property
+    def volume(self):
+        return self._buf[5, :self._n]
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        """
+        Yields ticks as [unix time, low, high, open, close, volume] lists in
+        ascending time.
+        """
+        for rate in self.data.T.tolist():
+            rate[0] = int(rate[0])
+            yield rate
+
+    def to_rates(self):
+        """
+        Returns a list of ticks in descending time, like marketdata.get_rates.
+        """
+        rates = self.data[:, ::-1].T.tolist()
+        for rate, ts in zip(rates, self.time[::-1].astype(np.int64).tolist()):
+            rate[0] = ts
+        return rates
+
+    def to_df(self):
+        """
+        Returns a pandas DataFrame with the columns of ratesutil.to_df (without
+        the datetime column) which shares memory with the candles.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.data.T, columns=df_columns, copy=False)
+
+    def _bounds(self, start_ts, end_ts):
+        times = self.time
+        lo = 0 if start_ts is None else np.searchsorted(times, start_ts, side='left')
+        hi = self._n if end_ts is None else np.searchsorted(times, end_ts, side='right')
+        return lo, hi
+
+    def slice(self, start_ts=None, end_ts=None):
+        """
+        Returns the candles with start_ts <= time <= end_ts as a view, found by
+        binary search.
+        """
+        lo, hi = self._bounds(start_ts, end_ts)
+        return Candles(self._buf[:, lo:hi])
+
+    def _reserve(self, n):
+        if self._owns and self._buf.shape[1] >= n:
+            return
+
+        capacity = max(n, 2 * self._buf.shape[1], 1024)
+        buf = np.empty((n_cols, capacity))
+        buf[:, :self._n] = self.data
+        self._buf = buf
+        self._owns = True
+
+    def append(self, rates):
+        """
+        Merges ticks (Candles or a list of ticks) into the candles, keeping
+        them sorted. Appended ticks replace existing ones with the same
+        timestamp.
+
+        Appending newer candles at the end is amortized O(len(rates)); anything
+        else is a single O(n + len(rates)) sorted merge.
+        """
+        new = Candles.from_rates(rates).data
+        if new.shape[1] == 0:
+            return self
+
+        n = self._n
+        if n == 0 or new[0, 0] > self._buf[0, n - 1]:
+            self._reserve(n + new.shape[1])
+            self._buf[:, n:n + new.shape[1]] = new
+            self._n += new.shape[1]
+            return self
+
+        times = self.time
+        pos = np.searchsorted(times, new[0], side='left')
+        dup = pos < n
+        dup[dup] = times[pos[dup]] == new[0, dup]
+
+        merged = np.insert(self.data, pos[~dup], new[:, ~dup], axis=1)
+        # Positions of the duplicates shift by the number of inserts before them.
+        shifted = pos[dup] + np.cumsum(~dup)[dup]
+        merged[:, shifted] = new[:, dup]
+
+        self._buf = merged
+        self._n = merged.shape[1]
+        self._owns = True
+
+        return self
@@ -2,7 +2,8 @@
 
 from __init__ import __location__
 
-import yaml
+from collections.abc import Mapping
+import threading
 import time
 import os
 
@@ -12,27 +13,87 @@ def fmttime(timeobj):
 
 start_time = time.gmtime()
 
-# Logger singleton
+# Logger singleton. The log file is only created by the first log call.
 # Must come before all other custom modules that use logging (e.g. auth).
 import logger
 log = logger.Logger(start_time)
 
-import auth
-
 api_url = 'https://api.gdax.com/'
 _secrets_fname = 'secrets.yml'
 
 # api_url = 'https://api-public.sandbox.gdax.com/'
 # _secrets_fname = 'secrets-sandbox.yml'
 
-_secrets = None
-with open(os.path.join(__location__,  _secrets_fname), 'r', encoding='utf-8') as f:
-    _secrets = yaml.safe_load(f)
-
 _db_config_fname = 'database.yml'
-dbconfig = None
-with open(os.path.join(__location__,  _db_config_fname), 'r', encoding='utf-8') as f:
-    dbconfig = yaml.safe_load(f)
+
+# Secrets, the DB config and the auth object are only loaded when first used,
+# so importing a module (e.g. for a short cron job) costs no file reads and
+# no yaml/requests imports.
+
+def _load_yaml(fname):
+    import yaml
+
+    with open(os.path.join(__location__,  fname), 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+class _LazyConfig(Mapping):
+    """
+    Read-only dict of a yaml file, loaded on first access.
+    """
+
+    def __init__(self, fname):
+        self._fname = fname
+        self._config = None
+
+    def _get(self):
+        if self._config is None:
+            self._config = _load_yaml(self._fname)
+        return self._config
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+class _LazyAuth(object):
+    """
+    Stands in for the auth.CoinbaseExchangeAuth built from the secrets file,
+    which is created on first use.
+    """
+
+    def __init__(self):
+        self._auth = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._auth is None:
+            with self._lock:
+                if self._auth is None:
+                    # auth imports common, so it can only be imported here.
+                    import auth
+
+                    secrets = _load_yaml(_secrets_fname)
+                    self._auth = auth.CoinbaseExchangeAuth(
+                            secrets['publickey'],
+                            secrets['secretkey'],
+                            secrets['passphrase'],
+                            time_url=api_url + 'time',
+                            )
+        return self._auth
+
+    def __call__(self, request):
+        return self._get()(request)
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+dbconfig = _LazyConfig(_db_config_fname)
 
 # Auth object for GDAX requests
-auth = auth.CoinbaseExchangeAuth(_secrets['publickey'], _secrets['secretkey'], _secrets['passphrase'])
+auth = _LazyAuth()
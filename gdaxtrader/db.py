@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# Shared connection pool for the market data database (see database.yml).
+
+import threading
+from contextlib import contextmanager
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from common import log
+from common import dbconfig
+
+_max_conns = 4
+
+_pool = None
+_lock = threading.Lock()
+
+# Bounds the connections borrowed at once, so callers wait for a free one:
+# ThreadedConnectionPool raises PoolError instead of blocking.
+_slots = None
+
+# Names of schemas already created by this process.
+_ensured = set()
+
+
+def _get_pool():
+    global _pool, _slots
+
+    with _lock:
+        if _pool is None:
+            db_params = dict(
+                    dbname=dbconfig['db_name'],
+                    user=dbconfig['db_user'],
+                    host=dbconfig['host'],
+                    port=dbconfig['port'],
+                    )
+
+            log.info('connecting to SQL DB')
+            log.info('params: %s', db_params)
+
+            _pool = ThreadedConnectionPool(1, _max_conns, **db_params)
+            _slots = threading.BoundedSemaphore(_max_conns)
+
+            log.info('connected to DB.')
+
+            log.info('creating database {} (if necessary).'.format(dbconfig['db_name']))
+            conn = _pool.getconn()
+            conn.set_session(autocommit=True)
+            cur = conn.cursor()
+            cur.execute('CREATE DATABASE IF NOT EXISTS {}'.format(dbconfig['db_name']))
+            cur.close()
+            _pool.putconn(conn)
+
+    return _pool
+
+@contextmanager
+def connection():
+    """
+    Borrows an autocommit connection from the pool for the duration of the
+    with block, waiting while all _max_conns are borrowed. Broken connections
+    are discarded instead of returned.
+    """
+    pool = _get_pool()
+    with _slots:
+        conn = pool.getconn()
+        try:
+            if not conn.autocommit:
+                conn.set_session(autocommit=True)
+            yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+def ensure_schema(cur, name, statements):
+    """
+    Runs the CREATE ... IF NOT EXISTS statements for a schema once per process.
+
+    name (str):             key identifying the schema, e.g. the table name.
+    statements (list):      SQL statements to execute.
+    """
+    if name in _ensured:
+        return
+
+    log.info('creating {} (if necessary).'.format(name))
+    for statement in statements:
+        cur.execute(statement)
+
+    with _lock:
+        _ensured.add(name)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Streaming reads of the candles stored in hist_rates (scrape.store_rates)
+# and its rollups (rollup).
+#
+# Rows are read in chunks of consecutive timestamps with keyset pagination:
+# each chunk is an ordered range scan of the (product, timestamp) primary key
+# starting after the last timestamp of the previous chunk, so reading a
+# multi-year range never holds more than one chunk in memory. (CockroachDB
+# has no server-side cursors, which psycopg2's named cursors need.)
+
+import math
+
+import numpy as np
+
+from candles import Candles
+import db
+import marketdata
+import rollup
+
+# Rows fetched per query.
+_chunk_rows = 50000
+
+
+def _source(granularity):
+    """
+    Returns the coarsest rollup level that divides <granularity>, or None for
+    hist_rates.
+    """
+    source = None
+    if granularity is not None:
+        for level in rollup.levels:
+            if level <= granularity and granularity % level == 0:
+                source = level
+    return source
+
+def iter_rates(product, start_dt, end_dt, granularity=None, chunk_rows=_chunk_rows, as_df=False):
+    """
+    Yields the stored candles of a product between two datetimes, oldest
+    first, in chunks of up to about <chunk_rows> candles.
+
+    granularity (int):  seconds per candle. Read from the coarsest rollup
+                        level that divides it (and aggregated further if
+                        needed), or straight from hist_rates if None.
+    as_df (bool):       yield DataFrames (see ratesutil.to_df) instead of
+                        Candles.
+
+    A pooled DB connection is held until the generator is exhausted or closed.
+
+    Example:
+        for chunk in iter_rates('BTC-USD', datetime(2016, 1, 1), datetime(2018, 1, 1)):
+            total += chunk.volume.sum()
+    """
+    if as_df:
+        import ratesutil
+
+    start_ts = int(math.ceil(marketdata.to_ts(start_dt)))
+    end_ts = int(marketdata.to_ts(end_dt))
+    source = _source(granularity)
+    aggregated = granularity is not None and source != granularity
+
+    # Candles of the last, possibly incomplete, bucket when aggregating.
+    carry = None
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        db.ensure_schema(cur, rollup._rollup_tbl, rollup._rollup_schema())
+
+        lo = start_ts
+        while lo <= end_ts:
+            chunk = rollup._read(cur, product, source, lo, end_ts, limit=chunk_rows)
+            last_chunk = len(chunk) < chunk_rows
+            if len(chunk) > 0:
+                lo = int(chunk.time[-1]) + 1
+
+            if aggregated:
+                if carry is not None:
+                    chunk = Candles(np.concatenate((carry.data, chunk.data), axis=1))
+                carry = None
+
+                if not last_chunk:
+                    # The last bucket may continue in the next chunk.
+                    cutoff = chunk.time[-1] // granularity * granularity
+                    carry = chunk.slice(cutoff, None)
+                    chunk = chunk.slice(None, cutoff - 1)
+
+                chunk = rollup.aggregate(chunk, granularity)
+
+            if len(chunk) > 0:
+                yield ratesutil.to_df(chunk) if as_df else chunk
+
+            if last_chunk:
+                break
+
+        cur.close()
+
+def read_rates(product, start_dt, end_dt, granularity=None, chunk_rows=_chunk_rows, as_df=False):
+    """
+    Returns all stored candles of a product between two datetimes as one
+    Candles (or DataFrame), read chunk by chunk with iter_rates.
+    """
+    candles = Candles()
+    for chunk in iter_rates(product, start_dt, end_dt, granularity, chunk_rows):
+        candles.append(chunk)
+
+    if as_df:
+        import ratesutil
+        return ratesutil.to_df(candles)
+    return candles
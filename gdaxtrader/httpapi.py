@@ -2,45 +2,259 @@
 
 # Thin wrapper around requests so we can do logging.
 
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import metrics
+import ratelimit
 from common import log
 
 _timeout = 30
 
-def get(url, **kwargs):
-    log.info('performing GET request')
-    log.info('url: ' + url)
-    if 'params' in kwargs:
-        log.info('params:')
-        log.info(kwargs['params'])
-    else:
-        log.info('*no params*')
+# Keep-alive connections kept per host in each session's pool.
+_pool_size = 10
+
+# Retries on connection errors and 5xx responses. urllib3 only retries
+# idempotent methods by default, so POSTs (orders) are never re-sent.
+_get_retries = 3
+_retry_backoff = 0.3
+
+# Retries of rate limited (429) requests. Without a Retry-After header the
+# n-th retry waits a random time of up to
+# min(_throttle_backoff_max, _throttle_backoff * 2^n) seconds.
+_throttle_retries = 5
+_throttle_backoff = 0.5
+_throttle_backoff_max = 8
+
+# Budgets shared by every thread in the process. Public (market data) and
+# private (authenticated) endpoints are limited separately by GDAX.
+_budgets = {
+    'public': ratelimit.TokenBucket(ratelimit.public_rate, ratelimit.public_burst),
+    'private': ratelimit.TokenBucket(ratelimit.private_rate, ratelimit.private_burst),
+    }
+_public_prefixes = ('/products', '/currencies', '/time')
+_rate_limited = True
+
+# One long-lived session per thread: connections (and TLS sessions) are
+# re-used across requests instead of being re-established every call.
+_sessions = threading.local()
+_generation = 0
+
+def configure(pool_size=None, get_retries=None, retry_backoff=None, rate_limited=None):
+    """
+    Changes the connection pool size and GET retry policy. Sessions are
+    re-created on their next use.
+
+    rate_limited (bool):    whether requests wait for the rate limit budgets
+                            (e.g. off against a local test server).
+    """
+    global _pool_size, _get_retries, _retry_backoff, _generation, _rate_limited
+
+    if pool_size is not None:
+        _pool_size = pool_size
+    if get_retries is not None:
+        _get_retries = get_retries
+    if retry_backoff is not None:
+        _retry_backoff = retry_backoff
+    if rate_limited is not None:
+        _rate_limited = rate_limited
+
+    _generation += 1
+
+def _new_session():
+    retry = Retry(
+            total=_get_retries,
+            backoff_factor=_retry_backoff,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False,
+            # 429s are retried by _request, against the shared budget.
+            respect_retry_after_header=False,
+            )
+
+    session = requests.Session()
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, HTTPAdapter(
+                pool_connections=_pool_size,
+                pool_maxsize=_pool_size,
+                max_retries=retry,
+                ))
+
+    return session
+
+def session():
+    """
+    Returns the calling thread's pooled session.
+    """
+    sess = getattr(_sessions, 'session', None)
+    if sess is None or _sessions.generation != _generation:
+        if sess is not None:
+            sess.close()
+        sess = _new_session()
+        _sessions.session = sess
+        _sessions.generation = _generation
+
+    return sess
+
+def _path_budget(path):
+    if path.startswith(_public_prefixes):
+        return _budgets['public']
+    return _budgets['private']
+
+def budget(url):
+    """
+    Returns the rate limit budget (ratelimit.TokenBucket) requests to url
+    count against.
+    """
+    return _path_budget(urlsplit(url).path)
+
+def stats():
+    """
+    Returns the rate, request and wait time counters of each budget.
+    """
+    return {name: bucket.stats() for name, bucket in _budgets.items()}
+
+def _budget_gauges():
+    gauges = []
+    for name, bucket_stats in sorted(stats().items()):
+        for stat, value in sorted(bucket_stats.items()):
+            gauges.append(('ratelimit_' + stat, {'budget': name}, value))
+    return gauges
+
+metrics.add_gauges(_budget_gauges)
+
 
-    resp = requests.get(url, **kwargs, timeout=_timeout)
+class _TimedAuth(object):
+    """
+    Wraps a requests auth callable to measure the time spent signing.
+    """
+    __slots__ = ('auth', 'elapsed')
 
-    log.info('GET request completed in ' + str(resp.elapsed.total_seconds()) + 's.')
-    log.info('status code: ' + str(resp.status_code))
-    log.info('reason: ' + str(resp.reason))
-    log.info('response:', stderr=False)
-    log.info(resp.json(), stderr=False)
+    def __init__(self, auth):
+        self.auth = auth
+        self.elapsed = 0.0
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        request = self.auth(request)
+        self.elapsed += time.perf_counter() - start
+        return request
+
+def _time_json(resp, method, endpoint):
+    """
+    Makes resp.json() record its decode time.
+    """
+    decode = resp.json
+
+    def json(**kwargs):
+        start = time.perf_counter()
+        try:
+            return decode(**kwargs)
+        finally:
+            metrics.observe(method, endpoint, 'json', time.perf_counter() - start)
+
+    resp.json = json
+
+def last_wait():
+    """
+    Returns the seconds the calling thread's last request spent waiting for
+    its budget (including backoff after 429s).
+    """
+    return getattr(_sessions, 'waited', 0)
+
+def _retry_after(resp, n_retry):
+    retry_after = resp.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return max(0, float(retry_after))
+        except ValueError:
+            # HTTP-date form, fall back to our own backoff.
+            pass
+
+    return random.uniform(0, min(_throttle_backoff_max, _throttle_backoff * 2 ** n_retry))
+
+def _request(method, url, **kwargs):
+    log.info('%s %s params=%s data=%s', method, url, kwargs.get('params'), kwargs.get('data'))
+
+    start = time.perf_counter()
+    path = urlsplit(url).path
+    endpoint = metrics.endpoint(path)
+    bucket = _path_budget(path)
+
+    signer = None
+    if metrics.enabled and kwargs.get('auth') is not None:
+        signer = kwargs['auth'] = _TimedAuth(kwargs['auth'])
+
+    metrics.in_flight(method, endpoint, 1)
+    try:
+        resp, waited, sending = _send(method, url, bucket, kwargs)
+    except requests.RequestException:
+        metrics.error(method, endpoint, total=time.perf_counter() - start)
+        raise
+    finally:
+        metrics.in_flight(method, endpoint, -1)
+
+    if metrics.enabled:
+        sign = signer.elapsed if signer is not None else 0.0
+        metrics.record(method, endpoint, resp.status_code,
+                sign=sign,
+                queue=waited,
+                network=sending - sign,
+                total=time.perf_counter() - start,
+                )
+        _time_json(resp, method, endpoint)
+
+    log.info('%s request completed in %ss: %s %s',
+            method, resp.elapsed.total_seconds(), resp.status_code, resp.reason)
+    log.payload(resp.content)
 
     return resp
 
-def post(url, **kwargs):
-    log.info('performing POST request')
-    log.info('url: ' + url)
-    if 'data' in kwargs:
-        log.info('data:')
-        log.info(kwargs['data'])
+def _send(method, url, bucket, kwargs):
+    """
+    Sends a request within its budget, retrying 429s.
+
+    Returns the response, the seconds spent waiting for the budget and the
+    seconds spent sending (including signing).
+    """
+    waited = 0
+    sending = 0
+    for n_retry in range(_throttle_retries + 1):
+        if _rate_limited:
+            waited += bucket.acquire()
+
+        sent = time.perf_counter()
+        resp = session().request(method, url, **kwargs, timeout=_timeout)
+        sending += time.perf_counter() - sent
+        if resp.status_code != 429:
+            bucket.accepted()
+            break
+
+        # A 429 was not processed, so even POSTs are safe to re-send.
+        delay = _retry_after(resp, n_retry)
+        bucket.throttled(delay)
+        if n_retry < _throttle_retries:
+            log.warn('429 Too Many Requests for %s %s, retrying in %.2fs...', method, url, delay)
+            if not _rate_limited:
+                # Otherwise the paused budget makes the next acquire wait.
+                time.sleep(delay)
+                waited += delay
     else:
-        log.info('*no data/body*')
+        log.error('%s %s still rate limited after %s retries', method, url, _throttle_retries)
 
-    resp = requests.post(url, **kwargs, timeout=_timeout)
+    _sessions.waited = waited
 
-    log.info('POST request completed in ' + str(resp.elapsed.total_seconds()) + 's.')
-    log.info('status code: ' + str(resp.status_code))
-    log.info('reason: ' + str(resp.reason))
-    log.info('response:', stderr=False)
-    log.info(resp.json(), stderr=False)
+    return resp, waited, sending
 
-    return resp
+def get(url, **kwargs):
+    return _request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return _request('POST', url, **kwargs)
+
+def delete(url, **kwargs):
+    return _request('DELETE', url, **kwargs)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+# Vectorized technical indicators over contiguous float64 arrays.
+#
+# Rolling outputs start at the first full window, i.e. they are already
+# truncated the same way as timeseries.truncate_start: an input of n ticks
+# gives n - window + 1 values (n - window for RSI, which works on deltas).
+
+import numpy as np
+
+# Rolling sums are accumulated in blocks re-centred on their first value, which
+# keeps cumulative sums small enough that sum-of-squares variance stays accurate.
+_block = 1 << 12
+
+# Largest magnitude of the scaling factors used by _smooth within one block.
+_max_log_scale = np.log(1e100)
+
+
+def as_array(rates):
+    """
+    Returns rates (list, pandas Series, ndarray) as a contiguous float64 array,
+    without copying if it already is one.
+    """
+    return np.ascontiguousarray(rates, dtype=np.float64)
+
+def _rolling_moments(x, window):
+    """
+    Returns the rolling mean and rolling sum of squared deviations from the
+    mean for every full window of x.
+    """
+    n_out = len(x) - window + 1
+    mean = np.empty(n_out)
+    m2 = np.empty(n_out)
+
+    for b0 in range(0, n_out, _block):
+        b1 = min(b0 + _block, n_out)
+        seg = x[b0:b1 + window - 1]
+        shift = seg[0]
+        centred = seg - shift
+
+        sums = np.empty(len(seg) + 1)
+        sums[0] = 0
+        np.cumsum(centred, out=sums[1:])
+        sq_sums = np.empty(len(seg) + 1)
+        sq_sums[0] = 0
+        np.cumsum(centred * centred, out=sq_sums[1:])
+
+        s = sums[window:] - sums[:-window]
+        s2 = sq_sums[window:] - sq_sums[:-window]
+
+        mean[b0:b1] = s / window + shift
+        m2[b0:b1] = s2 - s * s / window
+
+    # Rounding can leave tiny negative values for constant windows.
+    np.maximum(m2, 0, out=m2)
+
+    return mean, m2
+
+def _smooth(x, alpha, seed):
+    """
+    Exponential smoothing y_t = (1 - alpha) * y_{t-1} + alpha * x_t with
+    y_{-1} = seed.
+
+    Within a block, y_j = beta^(j+1) * (seed + alpha * sum_{i<=j} beta^-(i+1) x_i)
+    with beta = 1 - alpha, so each block is two vectorized passes. Blocks are
+    sized so that beta^-j stays within float64 range.
+    """
+    out = np.empty(len(x))
+    beta = 1 - alpha
+    if beta == 0:
+        out[:] = x
+        return out
+
+    block = max(1, min(len(x), int(_max_log_scale / -np.log(beta))))
+    powers = beta ** np.arange(1, block + 1)
+    inv_powers = 1 / powers
+
+    prev = seed
+    for b0 in range(0, len(x), block):
+        seg = x[b0:b0 + block]
+        k = len(seg)
+        acc = np.cumsum(seg * inv_powers[:k])
+        acc *= alpha
+        acc += prev
+        acc *= powers[:k]
+        out[b0:b0 + k] = acc
+        prev = acc[-1]
+
+    return out
+
+def sma(rates, window=14):
+    """
+    Simple moving average: the mean of the last <window> ticks.
+    """
+    x = as_array(rates)
+    if len(x) < window:
+        return np.empty(0)
+
+    mean, _ = _rolling_moments(x, window)
+    return mean
+
+def rolling_std(rates, window=14, ddof=1):
+    """
+    Rolling standard deviation over the last <window> ticks (sample standard
+    deviation by default, like pandas: NaN if window <= ddof).
+    """
+    x = as_array(rates)
+    if len(x) < window:
+        return np.empty(0)
+
+    _, m2 = _rolling_moments(x, window)
+    if window <= ddof:
+        return np.full(len(m2), np.nan)
+    return np.sqrt(m2 / (window - ddof))
+
+def ema(rates, window=14, alpha=None):
+    """
+    Exponential moving average seeded with the simple average of the first
+    <window> ticks.
+
+    alpha (float):  smoothing factor, 2 / (window + 1) by default. With
+                    alpha = 1 / window this is Wilder's smoothing, which is
+                    what timeseries.mov_avg computes.
+    """
+    x = as_array(rates)
+    if len(x) < window:
+        return np.empty(0)
+
+    if alpha is None:
+        alpha = 2 / (window + 1)
+
+    seed = x[:window].sum() / window
+    out = np.empty(len(x) - window + 1)
+    out[0] = seed
+    out[1:] = _smooth(x[window:], alpha, seed)
+    return out
+
+def mov_avg(rates, window=14):
+    """
+    The moving average of timeseries.mov_avg:
+        mas_n = mas_{n-1} * (window - 1) / window + rate / window
+    seeded with the average of the first <window> ticks.
+    """
+    return ema(rates, window, alpha=1 / window)
+
+def bollingers(rates, window=14, n_std=2):
+    """
+    Returns the rolling mean, lower band and upper band:
+        lower = mean - n_std * std
+        upper = mean + n_std * std
+    with the sample standard deviation, from a single pass of rolling sums.
+    The bands are NaN for window=1.
+    """
+    x = as_array(rates)
+    if len(x) < window:
+        return np.empty(0), np.empty(0), np.empty(0)
+
+    mean, m2 = _rolling_moments(x, window)
+    if window == 1:
+        width = np.full(len(m2), np.nan)
+    else:
+        width = np.sqrt(m2 / (window - 1))
+    width *= n_std
+
+    return mean, mean - width, mean + width
+
+def rsi(rates, window=14):
+    """
+    Wilder's relative strength index in [0, 100]. The first value is computed
+    from the first <window> deltas, i.e. ticks 0 to window.
+    """
+    x = as_array(rates)
+    if len(x) <= window:
+        return np.empty(0)
+
+    deltas = np.diff(x)
+    gains = np.maximum(deltas, 0)
+    losses = np.maximum(-deltas, 0)
+
+    avg_gain = mov_avg(gains, window)
+    avg_loss = mov_avg(losses, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = 100 - 100 / (1 + avg_gain / avg_loss)
+
+    # No losses in the window: RSI is 100 (or 50 if the price did not move).
+    no_loss = avg_loss == 0
+    out[no_loss] = np.where(avg_gain[no_loss] > 0, 100.0, 50.0)
+
+    return out
+
+
+# Streaming indicators: one tick at a time with O(1) work per tick, for live
+# trading. Values match the batch functions above for the same ticks.
+
+# Ticks between exact recomputations of a RollingWindow's running moments.
+_resync_ticks = 1 << 14
+
+class RollingWindow(object):
+    """
+    Fixed-size ring buffer of the last <window> ticks with a running mean and
+    sum of squared deviations (Welford's algorithm, extended to remove the
+    tick that drops out of the window).
+
+    var() and std() are NaN while fewer than ddof + 1 ticks were pushed (e.g.
+    always for window=1 with the sample deviation), like rolling_std.
+    """
+    __slots__ = ('window', 'count', 'mean', '_m2', '_buf', '_pos', '_until_resync')
+
+    def __init__(self, window=14):
+        self.window = window
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._buf = [0.0] * window
+        self._pos = 0
+        self._until_resync = _resync_ticks
+
+    def push(self, rate):
+        if self.count < self.window:
+            self.count += 1
+            delta = rate - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (rate - self.mean)
+        else:
+            old = self._buf[self._pos]
+            old_mean = self.mean
+            self.mean += (rate - old) / self.window
+            self._m2 += (rate - old) * (rate - self.mean + old - old_mean)
+            if self._m2 < 0:
+                self._m2 = 0.0
+            # Rounding errors of the removals accumulate.
+            self._until_resync -= 1
+
+        self._buf[self._pos] = rate
+        self._pos += 1
+        if self._pos == self.window:
+            self._pos = 0
+
+        # Recompute exactly once in a while (amortized O(1)).
+        if self._until_resync <= 0:
+            self._until_resync = _resync_ticks
+            self.mean = sum(self._buf) / self.window
+            self._m2 = sum((x - self.mean) ** 2 for x in self._buf)
+
+    def ready(self):
+        return self.count == self.window
+
+    def var(self, ddof=1):
+        if self.count <= ddof:
+            return float('nan')
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=1):
+        return self.var(ddof) ** 0.5
+
+class MovAvg(object):
+    """
+    Streaming timeseries.mov_avg. push() returns the current moving average,
+    or None until <window> ticks have been seen.
+    """
+    __slots__ = ('window', 'value', '_sum', '_count', '_decay')
+
+    def __init__(self, window=14):
+        self.window = window
+        self.value = None
+        self._sum = 0.0
+        self._count = 0
+        self._decay = (window - 1) / window
+
+    def push(self, rate):
+        if self._count < self.window:
+            self._sum += rate
+            self._count += 1
+            if self._count == self.window:
+                self.value = self._sum / self.window
+        else:
+            self.value = self.value * self._decay + rate / self.window
+
+        return self.value
+
+class Bollingers(object):
+    """
+    Streaming timeseries.bollingers. push() returns the current
+    (moving average, lower band, upper band), or None until <window> ticks
+    have been seen.
+    """
+    __slots__ = ('n_std', '_window')
+
+    def __init__(self, window=14, n_std=2):
+        self.n_std = n_std
+        self._window = RollingWindow(window)
+
+    def push(self, rate):
+        win = self._window
+        win.push(rate)
+        if not win.ready():
+            return None
+
+        width = self.n_std * win.std()
+        return win.mean, win.mean - width, win.mean + width
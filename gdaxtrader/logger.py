@@ -1,57 +1,215 @@
 #!/usr/bin/env python
 
 # Wrapper around the default logging package.
+#
+# Records are handed to a background writer thread through a queue and are
+# only formatted there, so a log call on the request path costs a few
+# microseconds regardless of how slow the file or terminal is.
 
+import atexit
+import copy
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import sys
+import threading
 
 import common
 
 _log_dir = 'logs'
 
+# Payloads (e.g. response bodies) are truncated to this many characters.
+_payload_max_len = 2048
+
+# Payloads longer than _payload_max_len are only logged this often.
+_payload_sample_rate = 0.1
+
+# Passed as `extra` for records that should only go to the log file.
+_file_only = {'stderr': False}
+
+# Args of these types are copied when the record is enqueued, since the
+# caller may change them before the writer thread formats the record.
+_mutable_types = (dict, list, set, bytearray)
+
+
+class _StderrFilter(logging.Filter):
+    """
+    Drops records logged with stderr=False from the screen handler.
+    """
+    def filter(self, record):
+        return getattr(record, 'stderr', True)
+
+class _StderrLevel(logging.Filter):
+    """
+    Marks records below level as file-only for _StderrFilter. It runs on the
+    logger, so the level in force at the log call applies even though the
+    record is written later by the writer thread.
+    """
+    def __init__(self):
+        super().__init__()
+        self.level = logging.DEBUG
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            record.stderr = False
+        return True
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record unformatted: the message is merged
+    with its args by the writer thread rather than by the caller. Mutable
+    args (e.g. a params dict) are shallow-copied so the record shows them as
+    they were at the log call.
+    """
+    def prepare(self, record):
+        args = record.args
+        if isinstance(args, dict):
+            record.args = dict(args)
+        elif args and any(isinstance(arg, _mutable_types) for arg in args):
+            record.args = tuple(copy.copy(arg) if isinstance(arg, _mutable_types) else arg
+                    for arg in args)
+        return record
+
+class _Payload(object):
+    """
+    Defers decoding and truncating a payload until the record is written.
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __str__(self):
+        data = self._data
+        if isinstance(data, bytes):
+            data = data[:_payload_max_len].decode('utf-8', errors='replace')
+        else:
+            data = str(data)
+
+        if len(self._data) > _payload_max_len:
+            return data[:_payload_max_len] + '... ({} bytes total)'.format(len(self._data))
+        return data
 
-class Logger(object):
-    def __init__(self, start_time):
-
-        # Logging configuration
-        if not os.path.exists(_log_dir):
-            os.makedirs(_log_dir)
-
-        handler = logging.FileHandler(os.path.join(_log_dir, 'gdaxtrader.' +
-            common.fmttime(start_time) + '.log'), mode='w')
-
-        formatter = logging.Formatter(
-                fmt='%(asctime)s %(levelname)-8s %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'
-                )
-
-        handler.setFormatter(formatter)
 
-        screen_handler = logging.StreamHandler(stream=sys.stderr)
-        screen_handler.setFormatter(formatter)
-
-        self._logger = logging.getLogger('logger')
-        self._logger.setLevel(logging.DEBUG)
-        self._logger.addHandler(handler)
-        self._logger.addHandler(screen_handler)
-
-    def warn(self, message):
-        self._logger.warning(message)
+class Logger(object):
+    """
+    The log file, handlers and writer thread are set up by the first log
+    call, so importing a module that logs costs nothing until it does.
+    """
+
+    def __init__(self, start_time, background=True):
+        self._start_time = start_time
+        self._background = background
+
+        self._logger = None
+        self._listener = None
+        self._stderr_level = _StderrLevel()
+        self._setup_lock = threading.Lock()
+
+    def _setup(self):
+        with self._setup_lock:
+            if self._logger is not None:
+                return self._logger
+
+            # Logging configuration
+            if not os.path.exists(_log_dir):
+                os.makedirs(_log_dir)
+
+            handler = logging.FileHandler(os.path.join(_log_dir, 'gdaxtrader.' +
+                common.fmttime(self._start_time) + '.log'), mode='w')
+
+            formatter = logging.Formatter(
+                    fmt='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S'
+                    )
+
+            handler.setFormatter(formatter)
+
+            screen_handler = logging.StreamHandler(stream=sys.stderr)
+            screen_handler.setFormatter(formatter)
+            screen_handler.addFilter(_StderrFilter())
+
+            logger = logging.getLogger('logger')
+            logger.setLevel(logging.DEBUG)
+            logger.addFilter(self._stderr_level)
+
+            if self._background:
+                log_queue = queue.Queue()
+                logger.addHandler(_LazyQueueHandler(log_queue))
+
+                self._listener = logging.handlers.QueueListener(
+                        log_queue, handler, screen_handler, respect_handler_level=True)
+                self._listener.start()
+
+                # Flush queued records on interpreter exit.
+                atexit.register(self.stop)
+            else:
+                logger.addHandler(handler)
+                logger.addHandler(screen_handler)
+
+            self._logger = logger
+            return logger
+
+    def _get(self):
+        logger = self._logger
+        if logger is None:
+            logger = self._setup()
+        return logger
+
+    def stop(self):
+        """
+        Waits for the writer thread to drain the queue.
+        """
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def stderr_level(self, level):
+        """
+        Sets the lowest level of the records shown on stderr; the log file
+        still gets every record. E.g. logging.WARNING keeps the INFO line of
+        every request made by a benchmark off the terminal.
+
+        Returns the previous level.
+        """
+        previous, self._stderr_level.level = self._stderr_level.level, level
+        return previous
+
+    def warn(self, message, *args):
+        self._get().warning(message, *args)
+
+    def info(self, message, *args, stderr=True):
+        """
+        Logs at INFO level. Formatting with args is deferred, e.g.
+            log.info('url: %s', url)
+
+        stderr (bool):  if False, the record only goes to the log file.
+        """
+        if stderr:
+            self._get().info(message, *args)
+        else:
+            self._get().info(message, *args, extra=_file_only)
+
+    def payload(self, data, label='response'):
+        """
+        Logs a (possibly large) payload to the log file only. Payloads over
+        _payload_max_len are truncated and sampled at _payload_sample_rate.
+
+        data (str/bytes):   raw payload, e.g. resp.content.
+        """
+        logger = self._get()
+        if not logger.isEnabledFor(logging.INFO):
+            return
 
-    def info(self, message, stderr=True):
-        # Temporarily sidestep stderr stream handler.
-        if not stderr:
-            temp = self._logger.handlers
-            self._logger.handlers = [h for h in self._logger.handlers if not isinstance(h, logging.StreamHandler)]
-            self._logger.info(message)
-            self._logger.handlers = temp
+        if len(data) > _payload_max_len and random.random() >= _payload_sample_rate:
             return
 
-        self._logger.info(message)
+        logger.info('%s: %s', label, _Payload(data), extra=_file_only)
 
-    def debug(self, message):
-        self._logger.debug(message)
+    def debug(self, message, *args):
+        self._get().debug(message, *args)
 
-    def error(self, message):
-        self._logger.error(message)
+    def error(self, message, *args):
+        self._get().error(message, *args)
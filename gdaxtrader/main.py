@@ -1,5 +1,56 @@
 #!/usr/bin/env python
-import accounts
+
+# Keeps the stored candles of the given products current (see scheduler).
+#
+# Example:
+#   ./main.py BTC-USD ETH-USD LTC-USD --since 2017-01-01 --priority BTC-USD=2 --metrics-port 9108
+
+import argparse
+import time
+from datetime import datetime
+
+import metrics
+from scheduler import Job, Scheduler
+from common import log
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Continuously scrape historic rates of many products.')
+    parser.add_argument('products', nargs='+',
+            help='products to keep current, e.g. BTC-USD')
+    parser.add_argument('-g', '--granularity', type=int, default=60,
+            help='seconds per stored candle (coarser candles come from rollups)')
+    parser.add_argument('--since', type=lambda s: datetime.strptime(s, '%Y-%m-%d'),
+            help='backfill history down to this UTC date (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=8,
+            help='concurrent fetches')
+    parser.add_argument('--priority', action='append', default=[], metavar='PRODUCT=N',
+            help='priority of a product (default 1), may be repeated')
+    parser.add_argument('--metrics-port', type=int,
+            help='serve Prometheus metrics (including lag per product) on this port')
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    accounts
+    args = _parse_args()
+
+    priorities = {}
+    for spec in args.priority:
+        product, priority = spec.split('=')
+        priorities[product] = int(priority)
+
+    jobs = [Job(product, args.granularity, since=args.since, priority=priorities.get(product, 1))
+            for product in args.products]
+    scheduler = Scheduler(jobs, n_workers=args.workers)
+
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+        log.info('serving metrics on port {}'.format(args.metrics_port))
+
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        log.info('stopping SCHEDULER...')
+        scheduler.stop()
+        scheduler.join()
@@ -1,9 +1,8 @@
 #!/usr/bin/env python
 
-import requests
-import json
 from datetime import datetime, timedelta
 
+import candlecache
 import common
 from common import log
 import httpapi
@@ -12,7 +11,12 @@ import httpapi
 # In reality, this seems to be around ~400.
 max_ticks = 200
 
-def get_rates(product, start_dt=None, end_dt=None, sec_per_tick=5):
+_epoch = datetime(1970, 1, 1)
+
+def to_ts(dt):
+    return (dt - _epoch).total_seconds()
+
+def get_rates(product, start_dt=None, end_dt=None, sec_per_tick=5, cache=False):
     """
     Returns the list of ticks with the schema
         [unix time, low, high, open, close, volume]
@@ -22,6 +26,13 @@ def get_rates(product, start_dt=None, end_dt=None, sec_per_tick=5):
     By default it returns the last 1000 seconds of historic data with sec_per_tick = 5.
 
     Also returns the full response object.
+
+    cache (bool):   serve the interval from the local candle cache (see
+                    candlecache) and only fetch the sub-intervals that are
+                    missing from it, in windows of max_ticks. Any number of
+                    ticks may then be returned. The response object is that of
+                    the last fetch, or a CachedResponse if nothing had to be
+                    fetched.
     """
 
     if end_dt is None:
@@ -30,6 +41,65 @@ def get_rates(product, start_dt=None, end_dt=None, sec_per_tick=5):
     if start_dt is None:
         start_dt = end_dt - timedelta(seconds=max_ticks * sec_per_tick)
 
+    if cache:
+        return _get_rates_cached(product, start_dt, end_dt, sec_per_tick)
+
+    return _fetch_rates(product, start_dt, end_dt, sec_per_tick)
+
+class CachedResponse(object):
+    """
+    Stands in for the response object when get_rates(cache=True) was served
+    entirely from the cache.
+    """
+    status_code = 200
+    reason = 'OK (cached)'
+    headers = {}
+
+    def __init__(self, rates):
+        self._rates = rates
+
+    def json(self):
+        return self._rates
+
+def _get_rates_cached(product, start_dt, end_dt, sec_per_tick):
+    start_ts, end_ts = to_ts(start_dt), to_ts(end_dt)
+
+    resp = None
+    fetched = []
+    all_rates = []
+    for gap_start, gap_end in candlecache.missing(product, sec_per_tick, start_ts, end_ts):
+        while gap_start <= gap_end:
+            window_end = min(gap_end, gap_start + sec_per_tick * (max_ticks - 1))
+
+            rates, resp = _fetch_rates(
+                    product,
+                    datetime.utcfromtimestamp(gap_start),
+                    datetime.utcfromtimestamp(window_end),
+                    sec_per_tick)
+
+            if resp.status_code != 200:
+                candlecache.put(product, sec_per_tick, fetched, all_rates)
+                return rates, resp
+
+            fetched.append((gap_start, window_end))
+            all_rates.extend(rates)
+            gap_start = window_end + sec_per_tick
+
+    if len(fetched) > 0:
+        candlecache.put(product, sec_per_tick, fetched, all_rates)
+
+    # Candles that are still open are never cached.
+    open_start = candlecache.last_closed(sec_per_tick) + sec_per_tick
+    open_rates = [rate for rate in all_rates if start_ts <= rate[0] <= end_ts and rate[0] >= open_start]
+
+    # Descending time order like GDAX.
+    rates = open_rates + candlecache.get(product, sec_per_tick, start_ts, end_ts).to_rates()
+
+    if resp is None:
+        resp = CachedResponse(rates)
+    return rates, resp
+
+def _fetch_rates(product, start_dt, end_dt, sec_per_tick):
     params = {
             'start': start_dt.isoformat(),
             'end': end_dt.isoformat(),
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+# In-process request metrics, recorded by httpapi for every request:
+#   - counters per method, endpoint and status code, and of requests which
+#     failed without a response (e.g. connection errors),
+#   - latency histograms per method, endpoint and phase (sign, queue,
+#     network, json, total),
+#   - in-flight requests per method and endpoint.
+#
+# Endpoints are normalized paths, e.g. /orders/{id} or
+# /products/{product}/candles. Read them with snapshot() (e.g.
+# snapshot(window=3600)['POST /orders']['total']['p99']), or in the
+# Prometheus text format from prometheus(), dump() or serve().
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+phases = ('sign', 'queue', 'network', 'json', 'total')
+
+# Histogram buckets grow by _growth from _min_value seconds, so quantiles are
+# within 2.5% of the true value (like HdrHistogram with 2 significant digits).
+_min_value = 1e-6
+_growth = 1.05
+_log_growth = math.log(_growth)
+
+# Windowed quantiles are kept in slots of _slot_secs, for up to _n_slots.
+_slot_secs = 60
+_n_slots = 60
+
+_quantiles = (0.5, 0.9, 0.99, 0.999)
+
+# Path segments followed by an ID, and the placeholder replacing it.
+_id_segments = {
+    'products': '{product}',
+    'orders': '{id}',
+    'accounts': '{id}',
+    'fills': '{id}',
+    'transfers': '{id}',
+    }
+
+enabled = True
+
+
+class Histogram(object):
+    """
+    Log-bucketed latency histogram: constant time record(), sparse storage.
+    """
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        if value < _min_value:
+            bucket = 0
+        else:
+            bucket = int(math.log(value / _min_value) / _log_growth) + 1
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for bucket, n in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + n
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q-th quantile.
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.max, _min_value * _growth ** bucket)
+        return self.max
+
+    def summary(self):
+        out = {'count': self.count, 'sum': self.sum, 'max': self.max}
+        for q in _quantiles:
+            out['p{:g}'.format(q * 100)] = self.quantile(q)
+        return out
+
+class _WindowedHistogram(object):
+    """
+    A Histogram of everything recorded plus one per _slot_secs slot of the
+    last _n_slots slots.
+    """
+
+    __slots__ = ('total', 'slots')
+
+    def __init__(self):
+        self.total = Histogram()
+        self.slots = deque(maxlen=_n_slots)
+
+    def record(self, value, now):
+        slot = int(now) // _slot_secs
+        if not self.slots or self.slots[-1][0] != slot:
+            self.slots.append((slot, Histogram()))
+        self.slots[-1][1].record(value)
+        self.total.record(value)
+
+    def window(self, secs, now):
+        """
+        Returns a Histogram of (about) the last <secs> seconds, or of
+        everything if secs is None.
+        """
+        if secs is None:
+            return self.total
+
+        first = (int(now) - secs) // _slot_secs + 1
+        merged = Histogram()
+        for slot, hist in self.slots:
+            if slot >= first:
+                merged.merge(hist)
+        return merged
+
+
+_lock = threading.Lock()
+_counters = {}
+_errors = {}
+_histograms = {}
+_in_flight = {}
+# Callables returning extra (name, labels dict, value) gauges, e.g. the rate
+# limit budgets of httpapi.
+_gauge_sources = []
+
+
+def endpoint(path):
+    """
+    Normalizes a URL path, e.g. /orders/7d0f7d8e-... -> /orders/{id}.
+    """
+    parts = path.strip('/').split('/')
+    for i in range(1, len(parts)):
+        placeholder = _id_segments.get(parts[i - 1])
+        if placeholder is not None:
+            parts[i] = placeholder
+    return '/' + '/'.join(parts)
+
+def in_flight(method, ep, delta):
+    if not enabled:
+        return
+    key = (method, ep)
+    with _lock:
+        _in_flight[key] = _in_flight.get(key, 0) + delta
+
+def observe(method, ep, phase, seconds):
+    """
+    Records <seconds> spent in one phase of a request.
+    """
+    if not enabled:
+        return
+    now = time.time()
+    key = (method, ep, phase)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = _WindowedHistogram()
+        hist.record(seconds, now)
+
+def record(method, ep, status, **timings):
+    """
+    Counts a completed request and records its phase timings, e.g.
+        record('GET', '/time', 200, network=0.05, total=0.06)
+    """
+    if not enabled:
+        return
+    now = time.time()
+    with _lock:
+        key = (method, ep, status)
+        _counters[key] = _counters.get(key, 0) + 1
+        for phase, seconds in timings.items():
+            hist = _histograms.get((method, ep, phase))
+            if hist is None:
+                hist = _histograms[(method, ep, phase)] = _WindowedHistogram()
+            hist.record(seconds, now)
+
+def error(method, ep, **timings):
+    """
+    Counts a request which failed without a response (e.g. a connection
+    error or timeout) and records its phase timings.
+    """
+    if not enabled:
+        return
+    now = time.time()
+    with _lock:
+        _errors[(method, ep)] = _errors.get((method, ep), 0) + 1
+        for phase, seconds in timings.items():
+            hist = _histograms.get((method, ep, phase))
+            if hist is None:
+                hist = _histograms[(method, ep, phase)] = _WindowedHistogram()
+            hist.record(seconds, now)
+
+def add_gauges(source):
+    """
+    Registers a callable returning a list of (name, labels dict, value) to be
+    exported with every snapshot.
+    """
+    _gauge_sources.append(source)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _errors.clear()
+        _histograms.clear()
+        _in_flight.clear()
+
+def snapshot(window=None):
+    """
+    Returns the current metrics as
+        {'METHOD /endpoint': {'status': {code: count},
+                              'errors': count,
+                              'in_flight': n,
+                              phase: histogram summary, ...}}
+    plus the extra gauges under 'gauges'.
+
+    window (int):   seconds of history for the histograms (at most
+                    _slot_secs * _n_slots), all of it by default. Counters are
+                    always totals.
+    """
+    now = time.time()
+    out = {}
+    with _lock:
+        for (method, ep, status), n in _counters.items():
+            entry = out.setdefault(method + ' ' + ep, {'status': {}, 'errors': 0, 'in_flight': 0})
+            entry['status'][status] = n
+        for (method, ep), n in _in_flight.items():
+            entry = out.setdefault(method + ' ' + ep, {'status': {}, 'errors': 0, 'in_flight': 0})
+            entry['in_flight'] = n
+        for (method, ep), n in _errors.items():
+            entry = out.setdefault(method + ' ' + ep, {'status': {}, 'errors': 0, 'in_flight': 0})
+            entry['errors'] = n
+        hists = {key: hist.window(window, now) for key, hist in _histograms.items()}
+
+    for (method, ep, phase), hist in hists.items():
+        entry = out.setdefault(method + ' ' + ep, {'status': {}, 'errors': 0, 'in_flight': 0})
+        entry[phase] = hist.summary()
+
+    out['gauges'] = [gauge for source in _gauge_sources for gauge in source()]
+    return out
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in sorted(labels.items())) + '}'
+
+def prometheus(window=None):
+    """
+    Returns the metrics in the Prometheus text exposition format. Latencies
+    are summaries (quantiles over <window> seconds, see snapshot).
+    """
+    snap = snapshot(window)
+    gauges = snap.pop('gauges')
+
+    lines = [
+        '# TYPE gdaxtrader_requests_total counter',
+        '# TYPE gdaxtrader_request_errors_total counter',
+        '# TYPE gdaxtrader_requests_in_flight gauge',
+        '# TYPE gdaxtrader_request_seconds summary',
+        ]
+    for key in sorted(snap):
+        method, ep = key.split(' ', 1)
+        entry = snap[key]
+        for status, n in sorted(entry['status'].items()):
+            lines.append('gdaxtrader_requests_total{} {}'.format(
+                _labels(method=method, endpoint=ep, status=status), n))
+        lines.append('gdaxtrader_request_errors_total{} {}'.format(
+            _labels(method=method, endpoint=ep), entry['errors']))
+        lines.append('gdaxtrader_requests_in_flight{} {}'.format(
+            _labels(method=method, endpoint=ep), entry['in_flight']))
+
+        for phase in phases:
+            summary = entry.get(phase)
+            if summary is None:
+                continue
+            for q in _quantiles:
+                lines.append('gdaxtrader_request_seconds{} {:.6f}'.format(
+                    _labels(method=method, endpoint=ep, phase=phase, quantile=q),
+                    summary['p{:g}'.format(q * 100)]))
+            lines.append('gdaxtrader_request_seconds_sum{} {:.6f}'.format(
+                _labels(method=method, endpoint=ep, phase=phase), summary['sum']))
+            lines.append('gdaxtrader_request_seconds_count{} {}'.format(
+                _labels(method=method, endpoint=ep, phase=phase), summary['count']))
+
+    for name, labels, value in gauges:
+        lines.append('gdaxtrader_{}{} {}'.format(name, _labels(**labels), value))
+
+    return '\n'.join(lines) + '\n'
+
+def dump(fname, window=None):
+    """
+    Writes prometheus() to fname atomically, e.g. for node_exporter's
+    textfile collector.
+    """
+    tmp = fname + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(prometheus(window))
+    os.replace(tmp, fname)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port=9108, host='127.0.0.1'):
+    """
+    Serves prometheus() at http://<host>:<port>/metrics from a daemon thread.
+
+    Returns the server (call shutdown() to stop it).
+    """
+    server = HTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+# A local stand-in for the GDAX REST endpoints used by marketdata, scrape,
+# orders, ordersync and accounts, for benchmarks and load tests that must not
+# hit the real (rate limited) API.
+#
+# Point the client at it with:
+#     exchange = MockExchange(latency=0.02, throttle_rate=0.05)
+#     common.api_url = exchange.start()
+#
+# Authentication headers are accepted but not checked.
+
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+from candleagg import parse_time
+
+# GDAX rejects candle requests spanning more than this many candles.
+_max_candles = 300
+
+_default_balances = {'USD': 100000.0, 'BTC': 10.0, 'ETH': 100.0, 'LTC': 1000.0}
+
+
+def _iso(ts):
+    return datetime.utcfromtimestamp(ts).isoformat() + 'Z'
+
+def _noise(ts, salt):
+    """
+    Deterministic pseudo-random number in [0, 1) for a timestamp.
+    """
+    return ((int(ts) * 2654435761 + salt * 40503) % 1000003) / 1000003
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive.
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; avoid Nagle/delayed-ACK stalls.
+    disable_nagle_algorithm = True
+
+    def _dispatch(self, method):
+        exchange = self.server.exchange
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length > 0 else None
+
+        status, payload, headers = exchange.handle(method, url.path, query, body)
+
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, *args):
+        # BaseHTTPRequestHandler writes a line per request to stderr.
+        pass
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockExchange(object):
+    """
+    Serves /time, /products/<product>/candles, /accounts, /orders (place,
+    list, cancel) and /fills from memory.
+
+    latency (float):        seconds added to every response.
+    throttle_rate (float):  fraction of requests answered with a 429.
+    retry_after (float):    Retry-After header sent with 429s (None to omit).
+    gap_rate (float):       fraction of candles left out, like periods
+                            without trades on GDAX.
+    balances (dict):        currency -> starting balance.
+
+    Candles are a deterministic function of product and time, so repeated
+    runs fetch the same data. Limit orders rest until fill() or a cancel;
+    market orders fill immediately at <price>.
+
+    n_requests and n_throttled count the requests served.
+    """
+
+    def __init__(self, latency=0, throttle_rate=0, retry_after=None, gap_rate=0,
+            balances=None, price=4000.0, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.gap_rate = gap_rate
+        self.price = price
+
+        self.n_requests = 0
+        self.n_throttled = 0
+
+        if balances is None:
+            balances = _default_balances
+        self._accounts = {c: {'balance': b, 'hold': 0.0} for c, b in balances.items()}
+
+        # Orders and fills in creation order; their index + 1 is the
+        # pagination cursor.
+        self._orders = []
+        self._orders_by_id = {}
+        self._fills = []
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """
+        Starts serving on a free localhost port in a daemon thread.
+
+        Returns the base URL, e.g. to assign to common.api_url.
+        """
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.exchange = self
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self._server.server_address[1])
+
+    def handle(self, method, path, query, body):
+        """
+        Returns the status code, JSON payload and extra headers of a request.
+        """
+        with self._lock:
+            self.n_requests += 1
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self.n_throttled += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if throttled:
+            headers = {}
+            if self.retry_after is not None:
+                headers['Retry-After'] = str(self.retry_after)
+            return 429, {'message': 'Rate limit exceeded'}, headers
+
+        parts = [p for p in path.split('/') if p]
+        if method == 'GET' and parts == ['time']:
+            now = time.time()
+            return 200, {'iso': _iso(now), 'epoch': now}, {}
+        if method == 'GET' and len(parts) == 3 and parts[0] == 'products' and parts[2] == 'candles':
+            return self._candles(parts[1], query)
+        if method == 'GET' and parts == ['accounts']:
+            return self._list_accounts()
+        if parts and parts[0] == 'orders':
+            if method == 'POST' and len(parts) == 1:
+                return self._place(body)
+            if method == 'DELETE':
+                return self._cancel(parts[1] if len(parts) > 1 else None, query)
+            if method == 'GET' and len(parts) == 1:
+                return self._list_orders(query)
+        if method == 'GET' and parts == ['fills']:
+            return self._list_fills(query)
+
+        return 404, {'message': 'NotFound'}, {}
+
+    def _candles(self, product, query):
+        granularity = int(query.get('granularity', 60))
+        end_ts = parse_time(query['end']) if 'end' in query else time.time()
+        start_ts = parse_time(query['start']) if 'start' in query else end_ts - granularity * _max_candles
+
+        first = int(math.ceil(start_ts / granularity)) * granularity
+        last = int(end_ts) // granularity * granularity
+        if (last - first) // granularity + 1 > _max_candles:
+            return 400, {'message': 'granularity too small for the requested time range'}, {}
+
+        salt = sum(map(ord, product))
+        rates = []
+        for ts in range(last, first - 1, -granularity):
+            if _noise(ts, salt) < self.gap_rate:
+                continue
+
+            mid = self.price * (1 + 0.05 * math.sin(ts / 86400.0 + salt))
+            spread = mid * 0.002 * _noise(ts, salt + 1)
+            rates.append([
+                ts,
+                mid - spread,
+                mid + spread,
+                mid - spread * (2 * _noise(ts, salt + 2) - 1),
+                mid + spread * (2 * _noise(ts, salt + 3) - 1),
+                10 * _noise(ts, salt + 4),
+                ])
+
+        return 200, rates, {}
+
+    def _list_accounts(self):
+        with self._lock:
+            accounts = [{
+                'id': currency,
+                'currency': currency,
+                'balance': str(acct['balance']),
+                'hold': str(acct['hold']),
+                'available': str(acct['balance'] - acct['hold']),
+                'profile_id': 'mock',
+                } for currency, acct in self._accounts.items()]
+        return 200, accounts, {}
+
+    def _hold(self, order, sign):
+        base, quote = order['product_id'].split('-')
+        if order['side'] == 'buy':
+            self._accounts[quote]['hold'] += sign * float(order['price']) * float(order['size'])
+        else:
+            self._accounts[base]['hold'] += sign * float(order['size'])
+
+    def _place(self, body):
+        if body is None or body.get('side') not in ('buy', 'sell') or '-' not in body.get('product_id', ''):
+            return 400, {'message': 'Invalid order'}, {}
+
+        order = {
+            'id': str(uuid.uuid4()),
+            'product_id': body['product_id'],
+            'side': body['side'],
+            'type': body.get('type', 'limit'),
+            'price': str(body.get('price', self.price)),
+            'size': str(body.get('size', 0)),
+            'filled_size': '0',
+            'post_only': bool(body.get('post_only', False)),
+            'status': 'open',
+            'settled': False,
+            'created_at': _iso(time.time()),
+            }
+
+        with self._lock:
+            order['_cursor'] = len(self._orders) + 1
+            self._orders.append(order)
+            self._orders_by_id[order['id']] = order
+            self._hold(order, 1)
+
+            if order['type'] == 'market':
+                order['price'] = str(self.price)
+                self._fill(order, float(order['size']))
+
+        return 200, self._public(order), {}
+
+    def _cancel(self, oid, query):
+        with self._lock:
+            if oid is not None:
+                order = self._orders_by_id.get(oid)
+                if order is None or order['status'] != 'open':
+                    return 404, {'message': 'order not found'}, {}
+                targets = [order]
+            else:
+                product = query.get('product_id')
+                targets = [o for o in self._orders
+                        if o['status'] == 'open' and product in (None, o['product_id'])]
+
+            for order in targets:
+                remaining = float(order['size']) - float(order['filled_size'])
+                self._hold(dict(order, size=remaining), -1)
+                order['status'] = 'done'
+                order['done_reason'] = 'canceled'
+                order['done_at'] = _iso(time.time())
+
+        if oid is not None:
+            return 200, [oid], {}
+        return 200, [order['id'] for order in targets], {}
+
+    def _fill(self, order, size):
+        base, quote = order['product_id'].split('-')
+        price = float(order['price'])
+        fee = 0.0 if order['post_only'] else price * size * 0.0025
+
+        self._hold(dict(order, size=size), -1)
+        sign = 1 if order['side'] == 'buy' else -1
+        self._accounts[base]['balance'] += sign * size
+        self._accounts[quote]['balance'] -= sign * price * size + fee
+
+        order['filled_size'] = str(float(order['filled_size']) + size)
+        if float(order['filled_size']) >= float(order['size']):
+            order['status'] = 'done'
+            order['done_reason'] = 'filled'
+            order['done_at'] = _iso(time.time())
+
+        trade_id = len(self._fills) + 1
+        self._fills.append({
+            'trade_id': trade_id,
+            'product_id': order['product_id'],
+            'order_id': order['id'],
+            'side': order['side'],
+            'price': order['price'],
+            'size': str(size),
+            'fee': str(fee),
+            'liquidity': 'M' if order['post_only'] else 'T',
+            'settled': True,
+            'created_at': _iso(time.time()),
+            '_cursor': trade_id,
+            })
+
+    def fill(self, oid, size=None):
+        """
+        Fills an open order at its price, completely unless <size> is given.
+        """
+        with self._lock:
+            order = self._orders_by_id[oid]
+            if order['status'] != 'open':
+                return
+            remaining = float(order['size']) - float(order['filled_size'])
+            self._fill(order, remaining if size is None else min(size, remaining))
+
+    @staticmethod
+    def _public(entry):
+        return {k: v for k, v in entry.items() if not k.startswith('_')}
+
+    def _page(self, entries, query):
+        """
+        Paginates entries (oldest first) like GDAX: newest first, with
+        CB-BEFORE/CB-AFTER cursors of the first and last entry.
+        https://docs.gdax.com/#pagination
+        """
+        limit = min(int(query.get('limit', 100)), 100)
+
+        if 'before' in query:
+            cursor = int(query['before'])
+            page = [e for e in entries if e['_cursor'] > cursor][:limit][::-1]
+        else:
+            if 'after' in query:
+                cursor = int(query['after'])
+                entries = [e for e in entries if e['_cursor'] < cursor]
+            page = entries[::-1][:limit]
+
+        headers = {}
+        if page:
+            headers['CB-BEFORE'] = str(page[0]['_cursor'])
+            headers['CB-AFTER'] = str(page[-1]['_cursor'])
+
+        return 200, [self._public(e) for e in page], headers
+
+    def _list_orders(self, query):
+        statuses = ('open', 'pending', 'active')
+        if query.get('status') == 'all':
+            statuses = ('open', 'pending', 'active', 'done')
+        product = query.get('product_id')
+
+        with self._lock:
+            orders = [o for o in self._orders
+                    if o['status'] in statuses and product in (None, o['product_id'])]
+            return self._page(orders, query)
+
+    def _list_fills(self, query):
+        product = query.get('product_id', 'all')
+        oid = query.get('order_id')
+
+        with self._lock:
+            fills = [f for f in self._fills
+                    if product in ('all', f['product_id']) and oid in (None, f['order_id'])]
+            return self._page(fills, query)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+
+# Local level-2 order books maintained from the GDAX websocket feed.
+#
+# The feed sends a 'snapshot' of every price level per product on subscribe,
+# followed by 'l2update' messages with the new aggregated size of changed
+# levels (size 0 removes the level).
+# https://docs.gdax.com/#the-code-classprettyprintlevel2code-channel
+#
+# level2 messages carry no sequence numbers, so a live book cannot detect a
+# missed update; it relies on the connection instead, and a reconnect brings
+# a fresh snapshot. Sequence checks only apply to messages which do carry
+# one (e.g. recordings of the full channel or REST snapshots).
+
+import heapq
+import json
+import threading
+import time
+
+import common
+from common import log
+import httpapi
+
+feed_url = 'wss://ws-feed.gdax.com'
+
+# Seconds to wait before reconnecting a dropped feed.
+_reconnect_delay = 1
+
+
+class _Side(object):
+    """
+    One side of a book: a dict of price -> size plus a heap of prices with
+    lazy deletion. Updates are O(log n) and the best price is O(1) amortized.
+    """
+
+    def __init__(self, is_bid):
+        self.levels = {}
+        self._heap = []
+        # Bids are kept in a max-heap by negating prices.
+        self._sign = -1 if is_bid else 1
+
+    def clear(self):
+        self.levels = {}
+        self._heap = []
+
+    def update(self, price, size):
+        if size == 0:
+            # Its heap entry goes stale and is dropped lazily.
+            self.levels.pop(price, None)
+            return
+
+        if price not in self.levels:
+            heapq.heappush(self._heap, self._sign * price)
+        self.levels[price] = size
+
+        # Rebuild if stale entries pile up deep in the heap.
+        if len(self._heap) > 2 * len(self.levels) + 64:
+            self._heap = [self._sign * p for p in self.levels]
+            heapq.heapify(self._heap)
+
+    def best(self):
+        heap = self._heap
+        while heap and self._sign * heap[0] not in self.levels:
+            heapq.heappop(heap)
+
+        if not heap:
+            return None
+        return self._sign * heap[0]
+
+    def top(self, n):
+        """
+        Returns the best n (price, size) levels.
+        """
+        if self._sign < 0:
+            prices = heapq.nlargest(n, self.levels)
+        else:
+            prices = heapq.nsmallest(n, self.levels)
+        return [(p, self.levels[p]) for p in prices]
+
+
+def _by_price(orders):
+    """
+    Aggregates level-3 [price, size, order_id] entries into [price, size]
+    levels.
+    """
+    levels = {}
+    for order in orders:
+        price = float(order[0])
+        levels[price] = levels.get(price, 0.0) + float(order[1])
+    return list(levels.items())
+
+
+class OrderBook(object):
+    """
+    Level-2 order book for one product.
+
+    Messages carrying a 'sequence' number are checked for gaps. On a gap the
+    book is marked out of sync, updates are ignored and on_gap(book) is
+    called, which should load a new snapshot (e.g. resync). Without on_gap
+    the book waits for the next 'snapshot' message. The live level2 channel
+    sends no sequence numbers (see above), so its updates are applied as
+    they arrive.
+    """
+
+    def __init__(self, product, on_gap=None):
+        self.product = product
+        self.bids = _Side(is_bid=True)
+        self.asks = _Side(is_bid=False)
+
+        self.sequence = None
+        self.synced = False
+        self.n_updates = 0
+        self.n_gaps = 0
+
+        self._on_gap = on_gap
+
+    def load_snapshot(self, bids, asks, sequence=None):
+        """
+        Replaces the book with the given levels.
+
+        bids, asks (list):  [price, size, ...] entries (strings or numbers).
+        """
+        self.bids.clear()
+        self.asks.clear()
+        for level in bids:
+            self.bids.update(float(level[0]), float(level[1]))
+        for level in asks:
+            self.asks.update(float(level[0]), float(level[1]))
+
+        self.sequence = sequence
+        self.synced = True
+
+    def _check_sequence(self, msg):
+        """
+        Returns False if the message must be skipped.
+        """
+        sequence = msg.get('sequence')
+        if sequence is None or self.sequence is None:
+            return self.synced
+
+        # Already contained in the snapshot.
+        if sequence <= self.sequence:
+            return False
+
+        if sequence != self.sequence + 1:
+            log.warn('ORDER BOOK {} sequence gap: {} -> {}'.format(self.product, self.sequence, sequence))
+            self.n_gaps += 1
+            self.synced = False
+            self.sequence = None
+            if self._on_gap is not None:
+                self._on_gap(self)
+            return False
+
+        self.sequence = sequence
+        return self.synced
+
+    def process(self, msg):
+        """
+        Applies a decoded feed message for this product.
+        """
+        msg_type = msg.get('type')
+
+        if msg_type == 'snapshot':
+            self.load_snapshot(msg['bids'], msg['asks'], msg.get('sequence'))
+            return
+
+        if msg_type != 'l2update' or not self._check_sequence(msg):
+            return
+
+        for side, price, size in msg['changes']:
+            book_side = self.bids if side == 'buy' else self.asks
+            book_side.update(float(price), float(size))
+        self.n_updates += 1
+
+    def resync(self):
+        """
+        Loads a full snapshot over REST. REST level 2 only returns the best 50
+        levels per side, so the full level-3 book (one entry per order) is
+        fetched and aggregated by price instead.
+        """
+        log.info('resyncing ORDER BOOK {}'.format(self.product))
+        resp = httpapi.get(
+                common.api_url + 'products/' + self.product + '/book',
+                params={'level': 3},
+                auth=common.auth,
+                )
+
+        if resp.status_code != 200:
+            log.error('failed to resync ORDER BOOK {}: {} {}'.format(self.product, resp.status_code, resp.reason))
+            return
+
+        book = resp.json()
+        self.load_snapshot(_by_price(book['bids']), _by_price(book['asks']), book.get('sequence'))
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def spread(self):
+        bid, ask = self.best_bid(), self.best_ask()
+        if bid is None or ask is None:
+            return None
+        return ask - bid
+
+    def top(self, n=10):
+        """
+        Returns the best n bid and ask levels as lists of (price, size).
+        """
+        return self.bids.top(n), self.asks.top(n)
+
+
+class Feed(object):
+    """
+    Websocket client keeping an OrderBook per product up to date. Reconnects
+    (and thereby receives fresh snapshots) when the connection drops, which
+    is what keeps the books consistent: level2 messages cannot be checked
+    for gaps.
+
+    Example:
+        feed = Feed(['BTC-USD'], record='btc-l2.jsonl')
+        feed.start()
+        feed.books['BTC-USD'].best_bid()
+    """
+
+    def __init__(self, products, record=None, url=feed_url, channels=('level2',), handlers=(), on_stop=()):
+        """
+        record (str):       if set, every raw message is appended to this file
+                            for later replay.
+        channels (list):    channels to subscribe to. Books are only kept if
+                            'level2' is one of them.
+        handlers (list):    callables invoked with every decoded message, e.g.
+                            candleagg.CandleAggregator.process.
+        on_stop (list):     callables invoked without arguments when the feed
+                            stops, e.g. candleagg.StoreSink.flush.
+        """
+        self.url = url
+        self.products = list(products)
+        self.channels = list(channels)
+        self.handlers = list(handlers)
+        self.on_stop = list(on_stop)
+
+        self.books = {}
+        if 'level2' in self.channels:
+            self.books = {p: OrderBook(p, on_gap=OrderBook.resync) for p in self.products}
+
+        self._record = record
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _subscribe_msg(self):
+        return json.dumps({
+            'type': 'subscribe',
+            'product_ids': self.products,
+            'channels': self.channels,
+            })
+
+    def _dispatch(self, msg):
+        """
+        Passes a message to its book and to the handlers. A failing handler
+        (e.g. a DB error storing a candle) is logged without stopping the
+        feed or the other handlers; a book that failed waits for a snapshot.
+        """
+        book = self.books.get(msg.get('product_id'))
+        if book is not None:
+            try:
+                book.process(msg)
+            except Exception as e:
+                log.error('ORDER BOOK {} failed on {} message: {}'.format(book.product, msg.get('type'), e))
+                book.synced = False
+
+        for handler in self.handlers:
+            try:
+                handler(msg)
+            except Exception as e:
+                log.error('FEED handler {} failed on {} message: {}'.format(
+                    getattr(handler, '__qualname__', handler), msg.get('type'), e))
+
+    def run(self):
+        """
+        Runs the feed in the calling thread until stop() is called.
+        """
+        # Only needed for the live feed, replay works without it.
+        import websocket
+
+        record = open(self._record, 'a') if self._record is not None else None
+        try:
+            while not self._stop.is_set():
+                try:
+                    ws = websocket.create_connection(self.url)
+                    try:
+                        ws.send(self._subscribe_msg())
+                        log.info('subscribed to {} FEED for {}'.format(self.channels, self.products))
+
+                        while not self._stop.is_set():
+                            raw = ws.recv()
+                            if record is not None:
+                                record.write(raw + '\n')
+
+                            try:
+                                msg = json.loads(raw)
+                            except ValueError as e:
+                                log.error('FEED sent a malformed message ({}): {!r}'.format(e, raw[:200]))
+                                continue
+                            if not isinstance(msg, dict):
+                                log.error('FEED sent an unexpected message: {!r}'.format(raw[:200]))
+                                continue
+
+                            if msg.get('type') == 'error':
+                                log.error('FEED error: {}'.format(msg))
+                                continue
+
+                            self._dispatch(msg)
+                    finally:
+                        ws.close()
+                except (websocket.WebSocketException, OSError) as e:
+                    log.warn('FEED disconnected ({}), reconnecting...'.format(e))
+                    for book in self.books.values():
+                        book.synced = False
+                    time.sleep(_reconnect_delay)
+        finally:
+            if record is not None:
+                record.close()
+            for callback in self.on_stop:
+                try:
+                    callback()
+                except Exception as e:
+                    log.error('FEED on_stop callback failed: {}'.format(e))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        """
+        Waits for a started feed to stop, i.e. for its next message after
+        stop() and its on_stop callbacks.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def replay(fname, books=None):
+    """
+    Replays a file of recorded feed messages (one JSON message per line) at
+    full speed.
+
+    books (dict):   product -> OrderBook to update. Books are created for new
+                    products (without on_gap, so gaps wait for the next
+                    recorded snapshot).
+
+    Returns the books and the number of messages replayed.
+    """
+    if books is None:
+        books = {}
+
+    n_msgs = 0
+    with open(fname, 'r') as f:
+        for line in f:
+            msg = json.loads(line)
+            product = msg.get('product_id')
+            if product is None:
+                continue
+
+            book = books.get(product)
+            if book is None:
+                book = books[product] = OrderBook(product)
+            book.process(msg)
+            n_msgs += 1
+
+    return books, n_msgs
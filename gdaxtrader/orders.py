@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
 import json
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import common
 from common import log
@@ -9,6 +12,14 @@ import httpapi
 class ParamsError(BaseException):
     pass
 
+class PaginationError(Exception):
+    """
+    A page request of pages(..., strict=True) got a non-200 response (resp).
+    """
+    def __init__(self, message, resp):
+        super().__init__(message)
+        self.resp = resp
+
 class _CommonOrder(object):
     def __init__(self, side, order_type, product):
         """
@@ -34,7 +45,7 @@ class _CommonOrder(object):
 
         # Prevent multiple invocations with the same OID.
         if self.oid() is not None:
-            return self.oid()
+            return self.oid(), self.__resp
 
         # Common params across all orders
         # https://docs.gdax.com/?python#orders
@@ -54,6 +65,12 @@ class _CommonOrder(object):
 
         return self.oid(), self.__resp
 
+    def side(self):
+        return self.__side
+
+    def product(self):
+        return self.__product
+
     def oid(self):
         if self.__resp is None or 'id' not in self.__resp.json():
             return None
@@ -95,6 +112,172 @@ class Limit(_CommonOrder):
         return super().place(self._order_params)
 
 
+def cancel(oid):
+    """
+    Cancels an open order by GDAX's order ID.
+
+    Returns the full response object.
+    """
+
+    log.info('cancelling ORDER')
+
+    return httpapi.delete(
+            common.api_url + 'orders/' + oid,
+            auth=common.auth,
+            )
+
+def cancel_all(product=None):
+    """
+    Cancels all open orders, or only those of <product>.
+
+    Returns the list of cancelled order IDs and the full response object.
+    """
+
+    params = {}
+    if product is not None:
+        params['product_id'] = product
+
+    log.info('cancelling ALL ORDERS')
+
+    resp = httpapi.delete(
+            common.api_url + 'orders',
+            params=params,
+            auth=common.auth,
+            )
+
+    return resp.json(), resp
+
+
+# Result of one request of an OrderManager batch. latency is in seconds and
+# excludes time spent waiting for the rate limit (see httpapi.last_wait). If
+# the request raised (e.g. a connection error), error is the exception and
+# oid, status_code and resp are None.
+OrderResult = namedtuple('OrderResult', ['order', 'oid', 'status_code', 'latency', 'resp', 'error'])
+
+class OrderManager(object):
+    """
+    Places and cancels batches of orders concurrently within the private
+    endpoint rate limit.
+
+    Example:
+        manager = OrderManager()
+        ladder = [Limit('buy', 'BTC-USD', 4000 - i, 0.01) for i in range(50)]
+        results = manager.place_many(ladder)
+        manager.cancel_many([r.oid for r in results if r.oid is not None])
+    """
+
+    def __init__(self, n_workers=10, accounts=None):
+        """
+        accounts (accounts.Info):   if set, its cached balances are updated
+                                    as orders are placed and cancelled.
+        """
+        self._pool = ThreadPoolExecutor(max_workers=n_workers)
+        self._accounts = accounts
+
+    def _placed(self, result):
+        if self._accounts is None or result.oid is None:
+            return result
+
+        order = result.order
+        if isinstance(order, Limit):
+            self._accounts.on_order_placed(result.oid, order.product(), order.side(),
+                    order._order_params['price'], order._order_params['size'])
+        else:
+            self._accounts.invalidate()
+        return result
+
+    def _cancelled(self, result):
+        # The remaining (unfilled) size is unknown here.
+        if self._accounts is not None and result.oid is not None:
+            self._accounts.on_order_done(result.oid)
+        return result
+
+    def _timed(self, order, fn):
+        """
+        order:  an order object, or an OID for cancels.
+        fn:     sends the request and returns the response object.
+        """
+        start = time.perf_counter()
+        try:
+            resp = fn()
+            latency = time.perf_counter() - start - httpapi.last_wait()
+
+            oid = order
+            if not isinstance(order, str):
+                oid = order.oid()
+            elif resp.status_code != 200:
+                oid = None
+        except Exception as e:
+            # One failed request must not lose the results of the rest of
+            # its batch.
+            log.error('ORDER request failed: {!r}'.format(e))
+            return OrderResult(order, None, None, time.perf_counter() - start, None, e)
+
+        return OrderResult(order, oid, resp.status_code, latency, resp, None)
+
+    def place_many(self, orders):
+        """
+        Places orders (e.g. Limit) concurrently.
+
+        Returns an OrderResult per order, in the same order, even if some of
+        the requests failed.
+        """
+        log.info('placing {} ORDERS'.format(len(orders)))
+        futures = [self._pool.submit(self._timed, order, lambda order=order: order.place()[1])
+                for order in orders]
+        return [self._placed(future.result()) for future in futures]
+
+    def cancel_many(self, oids):
+        """
+        Cancels orders by OID concurrently.
+
+        Returns an OrderResult per OID (oid is None if the cancel failed), in
+        the same order.
+        """
+        log.info('cancelling {} ORDERS'.format(len(oids)))
+        futures = [self._pool.submit(self._timed, oid, lambda oid=oid: cancel(oid))
+                for oid in oids]
+        return [self._cancelled(future.result()) for future in futures]
+
+    def cancel_all(self, product=None):
+        """
+        Cancels every open order of <product> (or all products) with one
+        request.
+
+        Returns the list of cancelled order IDs and the full response object.
+        """
+        oids, resp = cancel_all(product)
+        if self._accounts is not None:
+            if resp.status_code == 200:
+                for oid in oids:
+                    self._accounts.on_order_done(oid)
+            self._accounts.invalidate()
+        return oids, resp
+
+    def cancel_replace(self, oid, order):
+        """
+        Cancels an order and, only if that succeeded, places its replacement.
+
+        Returns the OrderResults of the cancel and of the placement (None if
+        the cancel failed).
+        """
+        cancelled = self._cancelled(self._timed(oid, lambda: cancel(oid)))
+        if cancelled.oid is None:
+            log.warn('not replacing ORDER {}: cancel failed'.format(oid))
+            return cancelled, None
+
+        return cancelled, self._placed(self._timed(order, lambda: order.place()[1]))
+
+    def replace_many(self, pairs):
+        """
+        cancel_replace for many (oid, order) pairs concurrently.
+        """
+        futures = [self._pool.submit(self.cancel_replace, oid, order) for oid, order in pairs]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self._pool.shutdown()
+
 def get_open(product=None, limit=100):
     """
     Retrieves all open orders (open, pending, and active).
@@ -139,6 +322,71 @@ def get_filled(product='all', limit=100):
 
     return resp.json(), resp
 
+def pages(endpoint, params, before=None, strict=False):
+    """
+    Yields each page of a paginated GDAX endpoint (e.g. 'orders', 'fills')
+    as (list of entries, full response object), lazily.
+    https://docs.gdax.com/#pagination
+
+    Without <before>, walks from the newest entries to the oldest following
+    the CB-AFTER cursor. With <before> (a cursor such as a fill's trade_id),
+    walks the entries newer than it following the CB-BEFORE cursor, oldest
+    page first.
+
+    A non-200 response ends the walk, or with strict=True raises
+    PaginationError so callers can tell it from the last page.
+    """
+    params = dict(params)
+    if before is not None:
+        params['before'] = before
+
+    while True:
+        resp = httpapi.get(
+                common.api_url + endpoint,
+                params=params,
+                auth=common.auth,
+                )
+
+        if resp.status_code != 200:
+            message = 'non-200 status code when PAGINATING {}: {} {}'.format(endpoint, resp.status_code, resp.reason)
+            if strict:
+                raise PaginationError(message, resp)
+            log.error(message)
+            return
+
+        entries = resp.json()
+        if len(entries) == 0:
+            return
+
+        yield entries, resp
+
+        if before is not None:
+            cursor = resp.headers.get('CB-BEFORE')
+            params['before'] = cursor
+        else:
+            cursor = resp.headers.get('CB-AFTER')
+            params['after'] = cursor
+
+        if cursor is None:
+            return
+
+def iter_open(product=None, limit=100):
+    """
+    Iterates over all open orders (open, pending, and active), newest first,
+    fetching pages of <limit> lazily.
+    """
+    log.info('iterating all OPEN ORDERS')
+    for entries, _ in pages('orders', {'limit': limit, 'product_id': product}):
+        yield from entries
+
+def iter_filled(product='all', limit=100):
+    """
+    Iterates over all fills, newest first, fetching pages of <limit> lazily.
+    """
+    log.info('iterating all FILLED ORDERS')
+    for entries, _ in pages('fills', {'limit': limit, 'product_id': product}):
+        yield from entries
+
 def get_by_oid(oid):
     """
     Retrieves information on the order by GDAX's order ID.
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+# Incremental sync of fills and orders into local, indexed DB tables.
+#
+# The first sync walks every page. Later syncs only request entries newer
+# than the pagination cursor saved by the previous one, which for an account
+# with no new activity is a single request returning an empty page.
+
+from psycopg2.extras import execute_values
+
+import db
+import orders
+from common import log
+
+_fills_tbl = 'fills'
+_orders_tbl = 'orders'
+_cursors_tbl = 'sync_cursors'
+
+_page_limit = 100
+
+
+def _schema():
+    return [
+        '''CREATE TABLE IF NOT EXISTS {} (
+        product STRING,
+        trade_id INT,
+        order_id STRING,
+        side STRING,
+        price DECIMAL,
+        size DECIMAL,
+        fee DECIMAL,
+        liquidity STRING,
+        settled BOOL,
+        created_at TIMESTAMP,
+        PRIMARY KEY (product, trade_id),
+        INDEX (order_id)
+        )'''.format(_fills_tbl),
+        '''CREATE TABLE IF NOT EXISTS {} (
+        id STRING PRIMARY KEY,
+        product STRING,
+        side STRING,
+        type STRING,
+        price DECIMAL,
+        size DECIMAL,
+        filled_size DECIMAL,
+        status STRING,
+        created_at TIMESTAMP,
+        done_at TIMESTAMP,
+        INDEX (product, created_at)
+        )'''.format(_orders_tbl),
+        '''CREATE TABLE IF NOT EXISTS {} (
+        kind STRING,
+        product STRING,
+        cursor STRING,
+        PRIMARY KEY (kind, product)
+        )'''.format(_cursors_tbl),
+        ]
+
+def _fill_row(fill):
+    return (
+        fill['product_id'],
+        fill['trade_id'],
+        fill['order_id'],
+        fill['side'],
+        fill['price'],
+        fill['size'],
+        fill.get('fee'),
+        fill.get('liquidity'),
+        fill.get('settled'),
+        fill['created_at'],
+        )
+
+def _order_row(order):
+    return (
+        order['id'],
+        order['product_id'],
+        order['side'],
+        order['type'],
+        order.get('price'),
+        order.get('size'),
+        order.get('filled_size'),
+        order['status'],
+        order['created_at'],
+        order.get('done_at'),
+        )
+
+def _sync(kind, endpoint, table, to_row, params, on_new=None):
+    """
+    Fetches the entries newer than the saved cursor of (kind, product), or
+    all of them on the first sync, and upserts them into table.
+
+    on_new is called with every entry fetched incrementally (i.e. not on the
+    first sync).
+
+    The first sync walks newest first, so its cursor is only saved once every
+    page was stored; if it is cut short, the next sync starts over. Later
+    syncs walk oldest first and save the newest cursor reached even if a
+    request fails, so no entry is passed to on_new twice.
+
+    Returns the number of entries fetched.
+    """
+    product = params.get('product_id') or 'all'
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        db.ensure_schema(cur, _cursors_tbl, _schema())
+
+        cur.execute('SELECT cursor FROM {} WHERE kind = %s AND product = %s'.format(_cursors_tbl),
+                (kind, product))
+        row = cur.fetchone()
+        cursor = None if row is None else row[0]
+
+        log.info('syncing {} for {} (cursor {})'.format(kind.upper(), product, cursor))
+
+        newest = cursor
+        n_entries = 0
+        complete = False
+        try:
+            for entries, resp in orders.pages(endpoint, params, before=cursor, strict=True):
+                # Newest first without a cursor, so only the first page counts.
+                if cursor is not None or newest is None:
+                    newest = resp.headers.get('CB-BEFORE', newest)
+
+                execute_values(
+                        cur,
+                        'UPSERT INTO {} VALUES %s'.format(table),
+                        [to_row(entry) for entry in entries],
+                        )
+                n_entries += len(entries)
+
+                if on_new is not None and cursor is not None:
+                    # Pages are newest first.
+                    for entry in reversed(entries):
+                        on_new(entry)
+            complete = True
+        except orders.PaginationError as e:
+            log.error('{} sync of {} cut short: {}'.format(kind.upper(), product, e))
+        finally:
+            if newest is not None and newest != cursor and (complete or cursor is not None):
+                cur.execute('UPSERT INTO {} VALUES (%s, %s, %s)'.format(_cursors_tbl),
+                        (kind, product, newest))
+            cur.close()
+
+    log.info('synced {} new {}.'.format(n_entries, kind))
+
+    return n_entries
+
+def sync_fills(product='all', on_fill=None):
+    """
+    Brings the local fills table up to date.
+
+    on_fill:    called with each new fill, e.g. accounts.Info.on_fill.
+
+    Returns the number of new (or updated) fills.
+    """
+    return _sync('fills', 'fills', _fills_tbl, _fill_row,
+            {'limit': _page_limit, 'product_id': product}, on_new=on_fill)
+
+def sync_orders(product=None):
+    """
+    Brings the local orders table up to date with orders created since the
+    last sync (in any status). Status changes of orders synced earlier are not
+    re-fetched; their fills are recorded by sync_fills.
+
+    Returns the number of new orders.
+    """
+    return _sync('orders', 'orders', _orders_tbl, _order_row,
+            {'limit': _page_limit, 'product_id': product, 'status': 'all'})
+
+def get_fills(product=None, order_id=None):
+    """
+    Returns locally stored fills (newest first) as tuples with the columns of
+    the fills table, optionally for one product or order.
+    """
+    where, args = [], []
+    if product is not None:
+        where.append('product = %s')
+        args.append(product)
+    if order_id is not None:
+        where.append('order_id = %s')
+        args.append(order_id)
+
+    query = 'SELECT * FROM {}'.format(_fills_tbl)
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY created_at DESC'
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        db.ensure_schema(cur, _cursors_tbl, _schema())
+        cur.execute(query, args)
+        rows = cur.fetchall()
+        cur.close()
+
+    return rows
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Thread-safe request budgets shared between concurrent callers.
+
+import threading
+import time
+
+# GDAX published rate limits (requests per second, burst).
+# https://docs.gdax.com/#rate-limits
+public_rate = 3
+public_burst = 6
+
+private_rate = 5
+private_burst = 10
+
+# On a 429 the rate is multiplied by _backoff_factor (but kept above
+# rate / _min_rate_div); every accepted request then adds back
+# rate * _recover_step, up to the configured rate.
+_backoff_factor = 0.5
+_min_rate_div = 8
+_recover_step = 0.05
+
+
+class TokenBucket(object):
+    """
+    A token bucket refilled at <rate> tokens per second holding at most
+    <burst> tokens. acquire() blocks until a token is available, so any number
+    of threads sharing one bucket never exceed the budget together.
+
+    The bucket adapts to the server: throttled() lowers the current rate (and
+    can pause the bucket, e.g. for a Retry-After), accepted() raises it back
+    towards <rate>.
+
+    n_acquired, n_waited, wait_total and wait_max count the tokens taken,
+    those that had to wait, and the seconds spent waiting.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.cur_rate = self.rate
+
+        self.n_acquired = 0
+        self.n_waited = 0
+        self.n_throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.cur_rate)
+        self._last = now
+
+    def acquire(self):
+        """
+        Takes one token, sleeping for as long as necessary.
+
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    self.n_acquired += 1
+                    if waited > 0:
+                        self.n_waited += 1
+                        self.wait_total += waited
+                        self.wait_max = max(self.wait_max, waited)
+                    return waited
+                else:
+                    delay = (1 - self._tokens) / self.cur_rate
+
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self, pause=0):
+        """
+        Records a rejected (429) request: lowers the current rate, empties the
+        bucket and hands out no tokens for the next <pause> seconds.
+        """
+        with self._lock:
+            self.n_throttled += 1
+            self.cur_rate = max(self.rate / _min_rate_div, self.cur_rate * _backoff_factor)
+            self._tokens = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    def accepted(self):
+        """
+        Records an accepted request, recovering the rate after throttling.
+        """
+        if self.cur_rate < self.rate:
+            with self._lock:
+                self.cur_rate = min(self.rate, self.cur_rate + self.rate * _recover_step)
+
+    def stats(self):
+        return {
+            'rate': self.cur_rate,
+            'acquired': self.n_acquired,
+            'waited': self.n_waited,
+            'throttled': self.n_throttled,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+            }
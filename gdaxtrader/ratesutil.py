@@ -1,7 +1,22 @@
 #!/usr/bin/env python
-import pandas as pd
+
+from candles import Candles
 
 def to_df(rates):
+    """
+    rates (list or Candles):    ticks with the schema
+                                    [unix time, low, high, open, close, volume]
+
+    Candles are already sorted and are wrapped without copying.
+    """
+    # Not at module level, so importers that never build DataFrames skip it.
+    import pandas as pd
+
+    if isinstance(rates, Candles):
+        ratesdf = rates.to_df()
+        ratesdf['datetime'] = pd.to_datetime(ratesdf.unixTS, unit='s')
+        return ratesdf
+
     ratesdf = pd.DataFrame(
             rates,
             columns=['unixTS', 'low', 'high', 'open', 'close', 'val'])
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Materialized coarser candles (rollups) over the candles stored in hist_rates.
+#
+# Each level is built from the level below it (1m from hist_rates, 5m from
+# 1m, 1h from 5m, 1d from 1h), so keeping a level current after new rows land
+# only re-aggregates the few buckets those rows fall into.
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from candles import Candles
+import db
+import marketdata
+from common import log
+
+_rates_tbl = 'hist_rates'
+_rollup_tbl = 'hist_rates_rollup'
+
+# Rollup granularities in seconds, finest first. Each divides the next one.
+levels = [60, 5 * 60, 60 * 60, 24 * 60 * 60]
+
+# Seconds of hist_rates re-aggregated at a time by update().
+_build_chunk = 7 * 24 * 60 * 60
+
+
+def _rollup_schema():
+    return [
+        '''CREATE TABLE IF NOT EXISTS {} (
+        product STRING,
+        granularity INT,
+        timestamp INT,
+        low DECIMAL,
+        high DECIMAL,
+        open DECIMAL,
+        close DECIMAL,
+        volume DECIMAL,
+        PRIMARY KEY (product, granularity, timestamp)
+        )'''.format(_rollup_tbl),
+        ]
+
+def _read(cur, product, granularity, start_ts, end_ts, limit=None):
+    """
+    Reads candles with start_ts <= time <= end_ts from hist_rates
+    (granularity None) or from the given rollup level, at most <limit> of
+    them (the oldest) if set.
+    """
+    cols = 'timestamp, low::FLOAT, high::FLOAT, open::FLOAT, close::FLOAT, volume::FLOAT'
+    limit_sql = '' if limit is None else ' LIMIT {:d}'.format(limit)
+    if granularity is None:
+        cur.execute(
+                'SELECT {} FROM {} WHERE product = %s AND timestamp BETWEEN %s AND %s '
+                'ORDER BY timestamp{}'.format(cols, _rates_tbl, limit_sql),
+                (product, start_ts, end_ts))
+    else:
+        cur.execute(
+                'SELECT {} FROM {} WHERE product = %s AND granularity = %s AND timestamp BETWEEN %s AND %s '
+                'ORDER BY timestamp{}'.format(cols, _rollup_tbl, limit_sql),
+                (product, granularity, start_ts, end_ts))
+
+    rows = cur.fetchall()
+    if len(rows) == 0:
+        return Candles()
+    return Candles(np.array(rows, dtype=np.float64).T.copy())
+
+def aggregate(candles, granularity):
+    """
+    Returns candles aggregated into buckets of <granularity> seconds, in
+    vectorized passes over the sorted candles.
+    """
+    if len(candles) == 0:
+        return Candles()
+
+    buckets = candles.time // granularity * granularity
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.append(starts[1:], len(candles)) - 1
+
+    out = np.empty((6, len(starts)))
+    out[0] = buckets[starts]
+    out[1] = np.minimum.reduceat(candles.low, starts)
+    out[2] = np.maximum.reduceat(candles.high, starts)
+    out[3] = candles.open[starts]
+    out[4] = candles.close[ends]
+    out[5] = np.add.reduceat(candles.volume, starts)
+
+    return Candles(out)
+
+def _update_chunk(product, start_ts, end_ts):
+    with db.connection() as conn:
+        cur = conn.cursor()
+        db.ensure_schema(cur, _rollup_tbl, _rollup_schema())
+
+        source = None
+        for granularity in levels:
+            lo = int(start_ts) // granularity * granularity
+            hi = int(end_ts) // granularity * granularity + granularity - 1
+
+            rolled = aggregate(_read(cur, product, source, lo, hi), granularity)
+            if len(rolled) > 0:
+                execute_values(
+                        cur,
+                        'UPSERT INTO {} VALUES %s'.format(_rollup_tbl),
+                        ((product, granularity, *rate) for rate in rolled),
+                        )
+
+            source = granularity
+
+        cur.close()
+
+def update(product, start_ts, end_ts):
+    """
+    Re-aggregates every rollup bucket overlapping [start_ts, end_ts], e.g.
+    after rows in that range were stored in hist_rates. Large ranges are
+    processed _build_chunk seconds at a time.
+    """
+    # Chunks are aligned to the coarsest level so no bucket spans two chunks.
+    chunk_ts = int(start_ts) // levels[-1] * levels[-1]
+    while chunk_ts <= end_ts:
+        _update_chunk(product, max(start_ts, chunk_ts), min(end_ts, chunk_ts + _build_chunk - 1))
+        chunk_ts += _build_chunk
+
+def build(product, start_dt=None, end_dt=None):
+    """
+    (Re)builds all rollup levels of a product from hist_rates. Defaults to
+    everything stored.
+    """
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT min(timestamp), max(timestamp) FROM {} WHERE product = %s'.format(_rates_tbl),
+                (product,))
+        first_ts, last_ts = cur.fetchone()
+        cur.close()
+
+    if first_ts is None:
+        log.warn('no rates stored for {}'.format(product))
+        return
+
+    if start_dt is not None:
+        first_ts = max(first_ts, int(marketdata.to_ts(start_dt)))
+    if end_dt is not None:
+        last_ts = min(last_ts, int(marketdata.to_ts(end_dt)))
+
+    log.info('building ROLLUPS for {} from {} to {}'.format(product, first_ts, last_ts))
+    update(product, first_ts, last_ts)
+
+def get_rates(product, start_dt, end_dt, granularity):
+    """
+    Returns the stored candles of a product between two datetimes at the
+    given granularity (seconds) as Candles.
+
+    Reads the coarsest rollup level that divides <granularity> (or hist_rates
+    if none does) and aggregates further if the level is finer than asked,
+    in chunks (see history.read_rates).
+    """
+    # history imports this module.
+    import history
+    return history.read_rates(product, start_dt, end_dt, granularity)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+
+# Keeps the stored candles of many products current: follows the live edge
+# of every product and backfills history with the request budget left over.
+#
+# Each product is one job with the contiguous range it has stored (the
+# scrape_checkpoints row of scrape.scrape_rates, so progress survives
+# restarts and is shared with manual scrapes). Jobs are split into windows of
+# max_ticks candles, and a pool of workers fetches and stores one window per
+# job at a time. Every fetch goes through httpapi's shared public budget;
+# when a worker frees up, the dispatcher hands it the live window of the most
+# lagging job first, and only otherwise a backfill window.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import candlecache
+import marketdata
+import metrics
+import rollup
+import scrape
+from marketdata import max_ticks
+from common import log
+
+# Workers kept free for live windows, so backfill cannot delay the live edge
+# by more than one request.
+_live_reserve = 1
+
+# Seconds before retrying a job whose fetch failed.
+_retry_delay = 10
+
+# GDAX may publish a candle a few seconds after it closes. Live windows
+# fetched within _settle_secs of their end are only stored up to the newest
+# candle returned, and the rest is refetched after _settle_retry seconds. A
+# window with no candles yet is refetched once the next candle closes, along
+# with that candle, rather than polled.
+_settle_secs = 10
+_settle_retry = 1
+
+# Seconds between rollup (see rollup) updates of a job's newly stored candles.
+# The job's checkpoint is saved with each update, after the rollups.
+_rollup_interval = 60
+
+# Longest the dispatcher sleeps without checking for new candles.
+_max_idle = 5
+
+# Seconds between lag summaries in the log.
+_status_interval = 60
+
+
+class Job(object):
+    """
+    Keeps one product's candles of one granularity (seconds) current.
+
+    since (datetime):   backfill down to this time, or no backfill if None.
+    priority (int):     jobs with a higher priority get their windows
+                        dispatched first.
+
+    hist_rates holds one granularity per product; coarser candles come from
+    its rollups (see rollup).
+    """
+
+    def __init__(self, product, granularity=60, since=None, priority=1):
+        self.product = product
+        self.granularity = granularity
+        self.since_ts = None
+        if since is not None:
+            self.since_ts = int(marketdata.to_ts(since)) // granularity * granularity
+        self.priority = priority
+
+        # The contiguous stored range, as in scrape_checkpoints.
+        self.first_ts = None
+        self.last_ts = None
+
+        self.busy = False
+        self.retry_at = 0
+        self.dispatched_at = 0
+        self.n_stored = 0
+
+        # kind ('live' or 'backfill') -> (first, last) timestamp stored since
+        # the last rollup update. Kept apart so the stored history between
+        # them is not re-aggregated.
+        self.rollups_pending = {}
+        self.rolled_at = time.time()
+
+    def live_window(self, now):
+        """
+        Returns the (start, end) timestamps of the next closed candles to
+        fetch at the live edge, or None if they are all stored.
+        """
+        g = self.granularity
+        closed = candlecache.last_closed(g, now)
+        if self.last_ts is None:
+            return closed - g * (max_ticks - 1), closed
+        if self.last_ts >= closed:
+            return None
+        return self.last_ts + g, min(closed, self.last_ts + g * max_ticks)
+
+    def backfill_window(self):
+        """
+        Returns the (start, end) timestamps of the next window of history to
+        backfill, or None if there is none.
+        """
+        if self.since_ts is None or self.first_ts is None or self.first_ts <= self.since_ts:
+            return None
+        g = self.granularity
+        return max(self.since_ts, self.first_ts - g * max_ticks), self.first_ts - g
+
+    def lag(self, now):
+        """
+        Returns the seconds since the oldest closed candle that is not stored
+        yet closed (0 when up to date), or None before the first fetch.
+        """
+        if self.last_ts is None:
+            return None
+        return max(0, now - (self.last_ts + 2 * self.granularity))
+
+    def backfill_remaining(self):
+        """
+        Returns the seconds of history left to backfill.
+        """
+        if self.since_ts is None or self.first_ts is None:
+            return 0
+        return max(0, self.first_ts - self.since_ts)
+
+
+class Scheduler(object):
+    """
+    Runs Jobs with <n_workers> concurrent fetches.
+
+    Example:
+        scheduler = Scheduler([Job('BTC-USD', 60, since=datetime(2017, 1, 1), priority=2),
+                               Job('ETH-USD', 60)])
+        scheduler.start()
+        scheduler.lag()
+
+    Per-job lag and remaining backfill are also exported through metrics
+    (scrape_lag_seconds, scrape_backfill_remaining_seconds).
+    """
+
+    def __init__(self, jobs, n_workers=8):
+        self.jobs = list(jobs)
+        self.n_workers = max(n_workers, _live_reserve + 1)
+
+        products = [job.product for job in self.jobs]
+        for product in set(products):
+            if products.count(product) > 1:
+                log.warn('{} has several jobs, but hist_rates holds one granularity per product'.format(product))
+
+        self._cond = threading.Condition()
+        self._n_busy = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+        metrics.add_gauges(self._gauges)
+
+    def _load(self):
+        for job in self.jobs:
+            checkpoint = scrape.load_checkpoint(job.product, job.granularity)
+            if checkpoint is not None:
+                job.first_ts, job.last_ts = checkpoint
+                log.info('SCHEDULER {} ({}s): stored {} to {}'.format(
+                    job.product, job.granularity, job.first_ts, job.last_ts))
+
+    def _next_task(self, now):
+        """
+        Returns the (job, kind, window) to dispatch next, or None.
+        """
+        idle = [job for job in self.jobs if not job.busy and job.retry_at <= now]
+
+        live = [(job, job.live_window(now)) for job in idle]
+        live = [(job, window) for job, window in live if window is not None]
+        if live:
+            job, window = max(live, key=lambda task: (task[0].priority, self._lag_key(task[0], now)))
+            return job, 'live', window
+
+        if self._n_busy >= self.n_workers - _live_reserve:
+            return None
+
+        backfill = [(job, job.backfill_window()) for job in idle]
+        backfill = [(job, window) for job, window in backfill if window is not None]
+        if backfill:
+            # Round robin between jobs of the same priority.
+            job, window = max(backfill, key=lambda task: (task[0].priority, -task[0].dispatched_at))
+            return job, 'backfill', window
+
+        return None
+
+    @staticmethod
+    def _lag_key(job, now):
+        lag = job.lag(now)
+        return float('inf') if lag is None else lag
+
+    def _idle_timeout(self, now):
+        """
+        Returns the seconds until the next candle of any job closes.
+        """
+        timeout = _max_idle
+        for job in self.jobs:
+            g = job.granularity
+            timeout = min(timeout, (int(now) // g + 1) * g - now, max(0, job.retry_at - now) or _max_idle)
+        return max(timeout, 0.05)
+
+    def _run_task(self, job, kind, window):
+        start_ts, end_ts = window
+        try:
+            rates, resp = marketdata.get_rates(
+                    job.product,
+                    start_dt=datetime.utcfromtimestamp(start_ts),
+                    end_dt=datetime.utcfromtimestamp(end_ts),
+                    sec_per_tick=job.granularity,
+                    cache=False)
+
+            if resp.status_code != 200:
+                log.error('SCHEDULER {} {} window failed: {} {}'.format(job.product, kind, resp.status_code, resp.reason))
+                job.retry_at = time.time() + _retry_delay
+                return
+
+            # GDAX may over-extend windows; keep the stored range exact.
+            rates = [rate for rate in rates if start_ts <= rate[0] <= end_ts]
+            if rates:
+                job.n_stored += scrape.store_rates(rates, job.product, rollups=False)
+                lo, hi = min(rate[0] for rate in rates), max(rate[0] for rate in rates)
+                pending_lo, pending_hi = job.rollups_pending.get(kind, (lo, hi))
+                job.rollups_pending[kind] = (min(lo, pending_lo), max(hi, pending_hi))
+
+            g = job.granularity
+            now = time.time()
+            if kind == 'live' and now - (end_ts + g) < _settle_secs:
+                newest = max(rate[0] for rate in rates) if rates else start_ts - g
+                if newest < end_ts:
+                    end_ts = newest
+                    if rates:
+                        job.retry_at = now + _settle_retry
+                    else:
+                        job.retry_at = candlecache.last_closed(g, now) + 2 * g
+
+            with self._cond:
+                if kind == 'live':
+                    if end_ts < start_ts:
+                        return
+                    if job.first_ts is None:
+                        job.first_ts = start_ts
+                    job.last_ts = end_ts
+                else:
+                    job.first_ts = start_ts
+
+            if time.time() - job.rolled_at >= _rollup_interval:
+                self._update_rollups(job)
+        except Exception as e:
+            log.error('SCHEDULER {} {} window failed: {}'.format(job.product, kind, e))
+            job.retry_at = time.time() + _retry_delay
+        finally:
+            with self._cond:
+                job.busy = False
+                self._n_busy -= 1
+                self._cond.notify()
+
+    def _update_rollups(self, job):
+        """
+        Updates the rollups of the candles the job stored since the last call,
+        then checkpoints its stored range, so a checkpointed range never lacks
+        its rollups.
+        """
+        with self._cond:
+            first_ts, last_ts = job.first_ts, job.last_ts
+
+        for lo, hi in job.rollups_pending.values():
+            rollup.update(job.product, lo, hi)
+        job.rollups_pending = {}
+        job.rolled_at = time.time()
+
+        if first_ts is not None:
+            scrape.save_checkpoint(job.product, job.granularity, first_ts, last_ts)
+
+    def run(self):
+        """
+        Runs the scheduler in the calling thread until stop() is called.
+        """
+        self._load()
+        log.info('SCHEDULER running {} jobs with {} workers'.format(len(self.jobs), self.n_workers))
+
+        next_status = time.time() + _status_interval
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            with self._cond:
+                while not self._stop.is_set():
+                    now = time.time()
+                    task = None
+                    if self._n_busy < self.n_workers:
+                        task = self._next_task(now)
+
+                    if task is not None:
+                        job, kind, window = task
+                        job.busy = True
+                        job.dispatched_at = time.monotonic()
+                        self._n_busy += 1
+                        pool.submit(self._run_task, job, kind, window)
+                        continue
+
+                    if now >= next_status:
+                        self._log_status(now)
+                        next_status = now + _status_interval
+
+                    self._cond.wait(self._idle_timeout(now))
+
+        for job in self.jobs:
+            try:
+                self._update_rollups(job)
+            except Exception as e:
+                log.error('SCHEDULER {} rollup update failed: {}'.format(job.product, e))
+
+    def _log_status(self, now):
+        lags = self.lag(now)
+        behind = {key: lag for key, lag in lags.items() if lag is None or lag > 0}
+        log.info('SCHEDULER lag: {} of {} jobs behind {}'.format(len(behind), len(lags), behind))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+
+    def join(self, timeout=None):
+        """
+        Waits for a started scheduler to stop: for the windows in flight and
+        the final rollup updates and checkpoints.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def lag(self, now=None):
+        """
+        Returns {(product, granularity): seconds behind real time} (see
+        Job.lag).
+        """
+        if now is None:
+            now = time.time()
+        return {(job.product, job.granularity): job.lag(now) for job in self.jobs}
+
+    def _gauges(self):
+        now = time.time()
+        gauges = []
+        for job in self.jobs:
+            labels = {'product': job.product, 'granularity': job.granularity}
+            lag = job.lag(now)
+            if lag is not None:
+                gauges.append(('scrape_lag_seconds', labels, lag))
+            gauges.append(('scrape_backfill_remaining_seconds', labels, job.backfill_remaining()))
+        return gauges
@@ -1,26 +1,39 @@
 #!/usr/bin/env python
 
-import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import psycopg2
+from psycopg2.extras import execute_values
 
+import db
 import marketdata
+import rollup
 from marketdata import max_ticks
 from common import log
-from common import dbconfig
 
 _rates_tbl = 'hist_rates'
-_batch_sz = 500
+_checkpoints_tbl = 'scrape_checkpoints'
+_batch_sz = 2000
 
-# 800 millisecond delay to prevent rate limiters.
-_fetch_delay = 800 / 1000
+# Max number of fetched windows waiting to be stored by scrape_rates.
+_queue_sz = 16
 
-def get_rates(product, start_dt, end_dt, sec_per_tick):
+# Windows stored by scrape_rates between rollup updates (and checkpoints).
+_rollup_windows = 16
+
+def get_rates(product, start_dt, end_dt, sec_per_tick, n_workers=1):
     """
     Returns the rates with the schema
         [unix time, low, high, open, close, volume]
     for the specified product and time interval.
+
+    n_workers (int):    if > 1, the interval is split into max_ticks windows
+                        which are fetched concurrently (see get_rates_parallel).
     """
+    if n_workers > 1:
+        return get_rates_parallel(product, start_dt, end_dt, sec_per_tick, n_workers)
+
     cur_end = end_dt
 
     all_rates = []
@@ -35,15 +48,11 @@ def get_rates(product, start_dt, end_dt, sec_per_tick):
                 product,
                 start_dt=cur_start,
                 end_dt=cur_end,
-                sec_per_tick=sec_per_tick)
+                sec_per_tick=sec_per_tick,
+                cache=False)
 
+        # httpapi waits for the rate limit and retries 429s.
         if resp.status_code != 200:
-            # Rate limit, wait another fetch delay
-            if resp.status_code == 429:
-                log.warn('429 Too Many Requests, waiting for {}s to retry...'.format(_fetch_delay))
-                time.sleep(_fetch_delay)
-                continue
-
             log.error('non-200 status code when SCRAPING HISTORICAL RATES')
             log.error('status code: ' + str(resp.status_code))
             log.error('reason: ' + resp.reason)
@@ -52,54 +61,335 @@ def get_rates(product, start_dt, end_dt, sec_per_tick):
 
         all_rates.extend(rates)
 
-        # Update cur_end for the next retrieval
-        fetched_start = datetime.utcfromtimestamp(rates[-1][0])
-        cur_end = fetched_start - timedelta(seconds=sec_per_tick)
-        time.sleep(_fetch_delay)
+        # Update cur_end for the next retrieval. The window may be empty or
+        # start with a gap; GDAX may also return candles before cur_start.
+        if rates:
+            cur_start = min(cur_start, datetime.utcfromtimestamp(rates[-1][0]))
+        cur_end = cur_start - timedelta(seconds=sec_per_tick)
 
     return all_rates
 
-def store_rates(rates, product):
+def _windows(start_dt, end_dt, sec_per_tick):
     """
-    Rates must be a list of ticks with the schema
-        [unix time, low, high, open, close, volume]
+    Splits [start_dt, end_dt] into the same max_ticks windows get_rates walks
+    through sequentially, newest window first.
     """
-    if len(rates) == 0:
-        log.warn('no rates to store')
-        return
+    span = timedelta(seconds=sec_per_tick * max_ticks)
+    step = span + timedelta(seconds=sec_per_tick)
+
+    cur_end = end_dt
+    while cur_end > start_dt:
+        yield max(cur_end - span, start_dt), cur_end
+        cur_end -= step
+
+def _fetch_window(product, window, sec_per_tick):
+    """
+    Fetches a single window. Concurrent fetches share httpapi's public
+    endpoint budget.
+    """
+    cur_start, cur_end = window
+    return marketdata.get_rates(
+            product,
+            start_dt=cur_start,
+            end_dt=cur_end,
+            sec_per_tick=sec_per_tick,
+            cache=False)
+
+def get_rates_parallel(product, start_dt, end_dt, sec_per_tick, n_workers=4):
+    """
+    Same as get_rates, but the max_ticks windows are fetched by a pool of
+    <n_workers> threads sharing httpapi's public request budget.
+
+    Windows are merged newest first with duplicate timestamps removed (GDAX
+    over-extends windows past their start), so the result matches get_rates.
+    """
+    windows = list(_windows(start_dt, end_dt, sec_per_tick))
 
-    log.info('storing {} HISTORIC RATES'.format(len(rates)))
-    log.info('first rate date: ' + datetime.utcfromtimestamp(rates[-1][0]).isoformat())
-    log.info('last rate date: ' + datetime.utcfromtimestamp(rates[0][0]).isoformat())
+    log.info('fetching {} windows of HISTORIC RATES with {} workers'.format(len(windows), n_workers))
 
-    db_params = dict(
-            dbname=dbconfig['db_name'],
-            user=dbconfig['db_user'],
-            host=dbconfig['host'],
-            port=dbconfig['port'],
-            )
+    all_rates = []
+    seen = set()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_fetch_window, product, window, sec_per_tick)
+                for window in windows]
 
-    log.info('connecting to SQL DB')
-    log.info('params:')
-    log.info(db_params)
+        for i, future in enumerate(futures):
+            rates, resp = future.result()
 
-    conn = psycopg2.connect(**db_params)
+            if resp.status_code != 200:
+                log.error('non-200 status code when SCRAPING HISTORICAL RATES')
+                log.error('status code: ' + str(resp.status_code))
+                log.error('reason: ' + resp.reason)
+                log.error('message: ' + resp.text)
 
-    conn.set_session(autocommit=True)
+                # Older windows would not have been fetched sequentially.
+                for pending in futures[i+1:]:
+                    pending.cancel()
+                break
 
-    log.info('connected to DB.')
+            for rate in rates:
+                if rate[0] not in seen:
+                    seen.add(rate[0])
+                    all_rates.append(rate)
 
-    cur = conn.cursor()
+    # Over-extended windows may interleave with the next (older) window.
+    all_rates.sort(key=lambda rate: rate[0], reverse=True)
 
-    log.info('creating database {} (if necessary).'.format(dbconfig['db_name']))
+    return all_rates
 
-    cur.execute('CREATE DATABASE IF NOT EXISTS {}'.format(dbconfig['db_name']))
+def load_checkpoint(product, sec_per_tick):
+    """
+    Returns the (first, last) unix timestamps of the contiguous range of rates
+    stored by scrape_rates for a product and granularity, or None.
+    """
+    with db.connection() as conn:
+        cur = conn.cursor()
+        db.ensure_schema(cur, _checkpoints_tbl, _checkpoints_schema())
+        cur.execute(
+                'SELECT first_ts, last_ts FROM {} WHERE product = %s AND granularity = %s'.format(_checkpoints_tbl),
+                (product, sec_per_tick))
+        row = cur.fetchone()
+        cur.close()
+
+    return None if row is None else (row[0], row[1])
+
+def save_checkpoint(product, sec_per_tick, first_ts, last_ts):
+    """
+    Records that all rates of a product and granularity between first_ts and
+    last_ts (unix timestamps) are stored.
 
-    n_cols = 7
+    The checkpoint is widened to include the range if they overlap or adjoin,
+    in one statement so concurrent scrapers cannot lose each other's progress.
+    A range disjoint from the checkpoint is not recorded: the checkpoint keeps
+    the range it had.
 
-    log.info('creating table {} (if necessary).'.format(_rates_tbl))
+    Returns the checkpoint as (first, last) if it now includes the range, or
+    None if it was kept.
+    """
+    with db.connection() as conn:
+        cur = conn.cursor()
+        db.ensure_schema(cur, _checkpoints_tbl, _checkpoints_schema())
+        cur.execute(
+                '''INSERT INTO {0} VALUES (%s, %s, %s, %s)
+                ON CONFLICT (product, granularity) DO UPDATE
+                SET first_ts = LEAST({0}.first_ts, excluded.first_ts),
+                    last_ts = GREATEST({0}.last_ts, excluded.last_ts)
+                WHERE excluded.first_ts <= {0}.last_ts + %s AND excluded.last_ts >= {0}.first_ts - %s
+                RETURNING first_ts, last_ts'''.format(_checkpoints_tbl),
+                (product, sec_per_tick, first_ts, last_ts, sec_per_tick, sec_per_tick))
+        row = cur.fetchone()
+        cur.close()
+
+    return None if row is None else (row[0], row[1])
+
+def _remaining(start_ts, end_ts, sec_per_tick, checkpoint):
+    """
+    Returns the [start, end] pieces of the interval that are not covered by the
+    checkpoint, newest first. The checkpoint is ignored (None) unless the
+    interval overlaps or adjoins it.
+    """
+    if checkpoint is not None:
+        first_ts, last_ts = checkpoint
+        if start_ts > last_ts + sec_per_tick or end_ts < first_ts - sec_per_tick:
+            checkpoint = None
 
-    cur.execute('''CREATE TABLE IF NOT EXISTS {} (
+    if checkpoint is None:
+        return [(start_ts, end_ts)], None
+
+    pieces = []
+    if end_ts > last_ts:
+        pieces.append((last_ts + sec_per_tick, end_ts))
+    if start_ts < first_ts:
+        pieces.append((start_ts, min(end_ts, first_ts - sec_per_tick)))
+
+    return pieces, checkpoint
+
+def _ranges(windows, sec_per_tick):
+    """
+    Returns the (first, last) unix timestamps of each run of adjacent windows,
+    given newest first.
+    """
+    ranges = []
+    for start_dt, end_dt in windows:
+        lo, hi = int(marketdata.to_ts(start_dt)), int(marketdata.to_ts(end_dt))
+        if ranges and hi + sec_per_tick >= ranges[-1][0]:
+            ranges[-1] = (min(lo, ranges[-1][0]), ranges[-1][1])
+        else:
+            ranges.append((lo, hi))
+    return ranges
+
+def scrape_rates(product, start_dt, end_dt, sec_per_tick, n_workers=4):
+    """
+    Fetches the rates for the specified product and time interval and stores
+    them as they arrive, without holding the whole interval in memory.
+
+    <n_workers> fetcher threads feed a queue bounded by _queue_sz windows and
+    the calling thread stores each window with store_rates. The contiguous
+    range stored so far is checkpointed per product and granularity, so an
+    interrupted run resumes where it stopped; ranges already covered by the
+    checkpoint are skipped.
+
+    The rollups (see rollup) of the stored windows are updated every
+    _rollup_windows windows, each time before the checkpoint is extended over
+    them, and once more for whatever was stored when the run ends or is
+    interrupted.
+
+    If a fetcher raises, the other fetchers stop and the first exception is
+    re-raised once the windows stored so far are rolled up.
+
+    Returns the number of rates stored.
+    """
+    start_ts = int(marketdata.to_ts(start_dt))
+    end_ts = int(marketdata.to_ts(end_dt))
+
+    stored_checkpoint = load_checkpoint(product, sec_per_tick)
+    pieces, checkpoint = _remaining(start_ts, end_ts, sec_per_tick, stored_checkpoint)
+    # save_checkpoint would keep the stored checkpoint anyway.
+    disjoint = stored_checkpoint is not None and checkpoint is None
+
+    windows = [window
+            for piece_start, piece_end in pieces
+            for window in _windows(
+                datetime.utcfromtimestamp(piece_start),
+                datetime.utcfromtimestamp(piece_end),
+                sec_per_tick)]
+
+    if checkpoint is not None:
+        log.info('resuming SCRAPE from checkpoint {}'.format(checkpoint))
+    if disjoint:
+        log.warn('SCRAPE range is disjoint from checkpoint {}: it will not be checkpointed'.format(stored_checkpoint))
+    log.info('scraping {} windows of HISTORIC RATES with {} workers'.format(len(windows), n_workers))
+
+    results = queue.Queue(maxsize=_queue_sz)
+    pending = iter(enumerate(windows))
+    pending_lock = threading.Lock()
+    stop = threading.Event()
+    # Exceptions raised by the fetchers, in order.
+    errors = []
+
+    def fetch():
+        try:
+            while not stop.is_set():
+                with pending_lock:
+                    i, window = next(pending, (None, None))
+                if window is None:
+                    return
+
+                rates, resp = _fetch_window(product, window, sec_per_tick)
+                # Blocks while the writer is behind.
+                results.put((i, rates, resp))
+        except Exception as e:
+            log.error('SCRAPE fetcher failed: {}'.format(e))
+            errors.append(e)
+            stop.set()
+        finally:
+            results.put(None)
+
+    fetchers = [threading.Thread(target=fetch, daemon=True) for _ in range(n_workers)]
+    for fetcher in fetchers:
+        fetcher.start()
+
+    n_stored = 0
+    n_finished = 0
+    # Windows stored out of order, and the index of the first window which has
+    # not been stored yet.
+    stored = set()
+    frontier = 0
+    # Windows before this index have their rollups updated.
+    rolled = 0
+
+    def roll_up():
+        """
+        Updates the rollups of the contiguous windows stored since the last
+        call, then checkpoints them.
+        """
+        nonlocal rolled
+
+        for lo, hi in _ranges(windows[rolled:frontier], sec_per_tick):
+            rollup.update(product, lo, hi)
+        rolled = frontier
+
+        # Everything from the start of the last contiguous window to end_ts is
+        # stored; it is merged into the checkpoint once they touch.
+        first_ts = int(marketdata.to_ts(windows[frontier - 1][0]))
+        if disjoint or (checkpoint is not None and first_ts > checkpoint[1] + sec_per_tick):
+            return
+        save_checkpoint(product, sec_per_tick, first_ts, end_ts)
+
+    def roll_up_rest():
+        if frontier > rolled:
+            roll_up()
+        # Windows stored past a missing one are not checkpointed.
+        for lo, hi in _ranges([windows[k] for k in sorted(stored)], sec_per_tick):
+            rollup.update(product, lo, hi)
+
+    try:
+        while n_finished < len(fetchers):
+            item = results.get()
+            if item is None:
+                n_finished += 1
+                continue
+
+            # Keep draining so blocked fetchers can exit.
+            if stop.is_set():
+                continue
+
+            i, rates, resp = item
+            if resp.status_code != 200:
+                log.error('non-200 status code when SCRAPING HISTORICAL RATES')
+                log.error('status code: ' + str(resp.status_code))
+                log.error('reason: ' + resp.reason)
+                log.error('message: ' + resp.text)
+                stop.set()
+                continue
+
+            n_stored += store_rates(rates, product, rollups=False)
+
+            stored.add(i)
+            while frontier in stored:
+                stored.remove(frontier)
+                frontier += 1
+
+            if frontier - rolled >= _rollup_windows:
+                roll_up()
+    except BaseException:
+        # Keep the rollups of what was stored, e.g. on KeyboardInterrupt.
+        stop.set()
+        try:
+            roll_up_rest()
+        except Exception as e:
+            log.error('SCRAPE rollup update failed: {}'.format(e))
+        raise
+    finally:
+        # Fetchers blocked on the full queue only exit once it is drained.
+        stop.set()
+        while n_finished < len(fetchers):
+            if results.get() is None:
+                n_finished += 1
+
+    roll_up_rest()
+
+    if errors:
+        raise errors[0]
+
+    log.info('scraped {} HISTORIC RATES.'.format(n_stored))
+
+    return n_stored
+
+def _checkpoints_schema():
+    return [
+        '''CREATE TABLE IF NOT EXISTS {} (
+        product STRING,
+        granularity INT,
+        first_ts INT,
+        last_ts INT,
+        PRIMARY KEY (product, granularity)
+        )'''.format(_checkpoints_tbl),
+        ]
+
+def _rates_schema():
+    return [
+        '''CREATE TABLE IF NOT EXISTS {} (
         product STRING,
         timestamp INT,
         low DECIMAL,
@@ -108,31 +398,62 @@ def store_rates(rates, product):
         close DECIMAL,
         volume DECIMAL,
         PRIMARY KEY (product, timestamp)
-        )'''.format(_rates_tbl))
+        )'''.format(_rates_tbl),
+        ]
 
-    # List of rate values
-    rate_vals = [[product] + rate for rate in rates]
-
-    assert(len(rate_vals[0]) % 7 == 0)
+def store_rates(rates, product, rollups=True):
+    """
+    Rates must be an iterable (e.g. a list, generator or candles.Candles) of ticks
+    with the schema
+        [unix time, low, high, open, close, volume]
 
-    # [:-1] is to remove the last comma
-    sql_tuple_str = '(' + ('%s,' * n_cols)[:-1] + '),'
-    sql_batch_str = (sql_tuple_str * _batch_sz)[:-1]
+    Rows are streamed to the DB in batches of _batch_sz multi-row UPSERTs over
+    a pooled connection, without materializing rates.
 
-    log.info('inserting rates into DB...')
+    rollups (bool):     bring the rollup levels (see rollup) covering the
+                        stored rates up to date. This costs a read and an
+                        upsert per level, so callers storing many small
+                        batches (e.g. scrape_rates) pass False and call
+                        rollup.update over several batches at a time.
 
-    while len(rate_vals) > 0:
-        sql_vals_str = sql_batch_str
-        if len(rate_vals) < _batch_sz:
-            sql_vals_str = (sql_tuple_str * len(rate_vals))[:-1]
+    Returns the number of rates stored.
+    """
+    n_stored = 0
+    first_ts = last_ts = None
+
+    def rows():
+        nonlocal n_stored, first_ts, last_ts
+        for rate in rates:
+            n_stored += 1
+            if first_ts is None or rate[0] < first_ts:
+                first_ts = rate[0]
+            if last_ts is None or rate[0] > last_ts:
+                last_ts = rate[0]
+            yield (product, *rate)
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        db.ensure_schema(cur, _rates_tbl, _rates_schema())
+
+        log.info('inserting rates into DB...')
+
+        # COPY cannot upsert (re-scraped ranges overlap), so use batched
+        # multi-row statements built by psycopg2 instead.
+        execute_values(
+                cur,
+                'UPSERT INTO {} VALUES %s'.format(_rates_tbl),
+                rows(),
+                page_size=_batch_sz,
+                )
+        cur.close()
+
+    if n_stored == 0:
+        log.warn('no rates to store')
+        return 0
 
-        batch = rate_vals[:_batch_sz]
-        flatten_vals = [val for rate in batch for val in rate]
-        cur.execute('UPSERT INTO {} VALUES '.format(_rates_tbl) + sql_vals_str, flatten_vals)
-        log.info('upserted {} rates.'.format(len(batch)))
-        rate_vals = rate_vals[_batch_sz:]
+    log.info('inserting {} HISTORIC RATES complete.'.format(n_stored))
 
-    log.info('inserting {} HISTORIC RATES complete.'.format(len(rates)))
-    cur.close()
-    conn.close()
+    if rollups:
+        rollup.update(product, first_ts, last_ts)
 
+    return n_stored
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Parameter sweeps of backtest.backtest across a process pool.
+#
+# Candles are written once to .npy files which every worker memory-maps, so
+# all processes read the same pages of the OS page cache instead of
+# unpickling their own copy of each product's candles for every task.
+
+import itertools
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+
+import backtest
+from candles import Candles
+from common import log
+
+# Columns of the results table besides the swept parameters.
+_result_cols = ['pnl', 'fees', 'n_trades', 'n_maker', 'max_drawdown']
+
+# Candles of each product in a worker process, memory-mapped by _init_worker.
+_shared = {}
+
+
+def grid(**axes):
+    """
+    Returns every combination of the given parameter values as a list of
+    dicts, e.g. grid(window=[10, 20], n_std=[1.5, 2]).
+    """
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[k] for k in names))]
+
+def _init_worker(paths):
+    for product, path in paths.items():
+        _shared[product] = Candles(np.load(path, mmap_mode='r'))
+
+def _run(task):
+    product, params, sim_params = task
+    result = backtest.backtest(_shared[product], **params, **sim_params)
+    return product, params, [getattr(result, col) for col in _result_cols]
+
+def sweep(candles, params, n_procs=None, rank_by='pnl', ascending=False, chunksize=4, **sim_params):
+    """
+    Backtests every product with every parameter set.
+
+    candles (dict):     product -> Candles (or ticks), e.g. from backtest.load.
+    params (list):      keyword arguments of backtest.backtest to try, e.g.
+                        from grid().
+    n_procs (int):      worker processes, os.cpu_count() by default.
+    sim_params:         passed to every run (e.g. limit_offset, size).
+
+    Returns a pandas DataFrame with a row per run sorted by <rank_by>,
+    largest first unless <ascending> (e.g. for max_drawdown).
+    """
+    import pandas as pd
+
+    tmpdir = tempfile.mkdtemp(prefix='sweep-')
+    try:
+        paths = {}
+        for product, product_candles in candles.items():
+            paths[product] = os.path.join(tmpdir, '{}.npy'.format(product))
+            np.save(paths[product], Candles.from_rates(product_candles).data)
+
+        tasks = [(product, p, sim_params) for product in sorted(paths) for p in params]
+        log.info('sweeping {} backtests over {} products with {} processes'.format(
+            len(tasks), len(paths), n_procs or os.cpu_count()))
+
+        with Pool(n_procs, initializer=_init_worker, initargs=(paths,)) as pool:
+            rows = [dict(product=product, **p, **dict(zip(_result_cols, values)))
+                    for product, p, values in pool.imap_unordered(_run, tasks, chunksize)]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    table = pd.DataFrame(rows)
+    if len(table) == 0:
+        return table
+    return table.sort_values(rank_by, ascending=ascending).reset_index(drop=True)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import pandas as pd
+import indicators
 
 def truncate_start(timeseries, window):
     """
@@ -17,38 +17,22 @@ def truncate_start(timeseries, window):
 
 def mov_avg(rates, window=14):
     """
-    Returns the moving average with the given window size.
+    Returns the moving average with the given window size as an array.
 
     rates (iterable):   each element is a tick.
     window (int):       each moving average tick is computed as the last
                         <window> ticks including the current tick.
-    """
-    if len(rates) < window:
-        return []
-
-    mas = []
-    for i, rate in enumerate(rates):
-        if i < window - 1:
-            continue
-
-        mas_idx = i - window + 1
 
-        # First moving average value: initialize it using the last 'window' values
-        if len(mas) == 0:
-            assert(mas_idx == 0)
-            mas.append(sum(rates[:window]) / window)
-            continue
+    The first moving average value is the average of the first <window>
+    ticks, and the next ones are calculated as follows:
 
-        assert(mas_idx > 0)
-        """
-        The next moving average value is calculated as follows:
+        mas_n    = ( (window - 1) * mas_{n-1} + rate ) / window
+                = mas_{n-1} * (window - 1) / window   +   rate / window
 
-            mas_n    = ( (window - 1) * mas_{n-1} + rate ) / window
-                    = mas_{n-1} * (window - 1) / window   +   rate / window
-        """
-        mas.append(mas[mas_idx-1] * ( (window-1) / window ) + (rate / window))
-
-    return mas
+    Returned lists before indicators; arrays support len(), indexing and
+    iteration alike, and .tolist() gives the old type. See indicators.mov_avg.
+    """
+    return indicators.mov_avg(rates, window)
 
 def bollingers(rates, window=14, n_std=2):
     """
@@ -63,14 +47,8 @@ def bollingers(rates, window=14, n_std=2):
     window (int):       computes the rolling mean/std with the last <window>
                         ticks including the current tick.
 
-    Returns the moving average, lower band and upper band as lists
+    Returns the moving average, lower band and upper band as arrays (lists
+    before indicators) already truncated with truncate_start. See
+    indicators.bollingers.
     """
-    mov_avg = pd.Series(rates).rolling(window=window).mean()
-    mov_std = pd.Series(rates).rolling(window=window).std()
-
-    bb_lower = truncate_start(list(mov_avg - n_std * mov_std), window)
-    bb_upper = truncate_start(list(mov_avg + n_std * mov_std), window)
-
-    return truncate_start(list(mov_avg), window), bb_lower, bb_upper
-
-
+    return indicators.bollingers(rates, window, n_std)
@@ -1,15 +1,13 @@
 #!/usr/bin/env python
 
-import matplotlib.pyplot as plt
-import plotly
-import pandas as pd
+import numpy as np
 import time
 import os
 import copy
 
+from candles import Candles
 import common
 import timeseries as ts
-import ratesutil
 
 _plot_dir = 'plots'
 
@@ -21,14 +19,64 @@ _mov_avg_width = 1
 _bbands_col = '#ccc'
 _bbands_width = 1
 
-def hist_rates(rates, product=None, savetofile=True, movavg_windows=[], bbands_window=14, bbands_std=2):
+def _ohlc_buckets(candles, n_buckets):
+    """
+    Aggregates consecutive candles into at most n_buckets candles, keeping
+    each bucket's open, close, low, high and total volume.
+    """
+    n = len(candles)
+    size = -(-n // n_buckets)
+    starts = np.arange(0, n, size)
+    ends = np.minimum(starts + size, n) - 1
+
+    return Candles(np.vstack([
+        candles.time[starts],
+        np.minimum.reduceat(candles.low, starts),
+        np.maximum.reduceat(candles.high, starts),
+        candles.open[starts],
+        candles.close[ends],
+        np.add.reduceat(candles.volume, starts),
+        ]))
+
+def _minmax_buckets(x, y, n_buckets):
+    """
+    Downsamples a line to the minimum and maximum point of each of n_buckets
+    buckets (in their original order), which keeps its visible envelope.
+    """
+    n = len(y)
+    size = -(-n // n_buckets)
+    n_buckets = -(-n // size)
+
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+
+    idx = np.sort(np.stack([np.nanargmin(padded, axis=1), np.nanargmax(padded, axis=1)], axis=1), axis=1)
+    idx = (idx + np.arange(n_buckets)[:, None] * size).ravel()
+
+    return x[idx], y[idx]
+
+def _line(x, y, max_points):
+    if max_points is not None and len(y) > max_points:
+        x, y = _minmax_buckets(x, y, max_points // 2)
+    return _to_datetime(x), y
+
+def _to_datetime(unix_ts):
+    # pandas, plotly and matplotlib are imported on first use: they take
+    # longer to import than the rest of the package together.
+    import pandas as pd
+
+    return pd.to_datetime(unix_ts, unit='s')
+
+def hist_rates(rates, product=None, savetofile=True, movavg_windows=[], bbands_window=14, bbands_std=2,
+        max_points=None):
     """
     Takes in a list of historic rates with the following schema per element
         [unix time, low, high, open, close, volume]
     which is the same format returned by mktdata.get_rates.
 
     Params:
-        rates (iteraable):      each element is one tick.
+        rates (iteraable):      each element is one tick, or a candles.Candles.
         product (str):          name of the product used for labelling and title.
         savetofile (bool):      saves plot to plots/hist_rate_<TIME>.png if True.
         movavg_windows
@@ -36,23 +84,34 @@ def hist_rates(rates, product=None, savetofile=True, movavg_windows=[], bbands_w
         bbands_window (int):    window size used to compute Bollinger Bands.
         bbands_std (int):       number of standard deviations used to compute
                                 lower and upper Bollinger Bands.
+        max_points (int):       if set, downsample to about this many points per
+                                trace (e.g. the chart's width in pixels):
+                                candles are merged into OHLC buckets and lines
+                                keep the min/max of each bucket. Indicators are
+                                still computed on every candle.
 
     Returns the dict object that can be plotted directly with
     plotly.(offline).(i)plot.
     """
     fname_prefix = 'hist_rate'
 
-    # Sort by timestamp
-    ratesdf = ratesutil.to_df(rates)
+    # Sorted by timestamp.
+    candles = Candles.from_rates(rates)
+    close = candles.close
+
+    shown = candles
+    if max_points is not None and len(candles) > max_points:
+        shown = _ohlc_buckets(candles, max_points)
+    shown_dt = _to_datetime(shown.time)
 
     # Main candlestick plot.
     data = [dict(
                 type= 'candlestick',
-                x = ratesdf.datetime,
-                open = ratesdf.open,
-                high = ratesdf.high,
-                low = ratesdf.low,
-                close = ratesdf.close,
+                x = shown_dt,
+                open = shown.open,
+                high = shown.high,
+                low = shown.low,
+                close = shown.close,
                 yaxis = 'y2',
                 name = product,
                 increasing = dict(line=dict(color=_increase_col)),
@@ -71,17 +130,17 @@ def hist_rates(rates, product=None, savetofile=True, movavg_windows=[], bbands_w
     # Initialize figure dict.
     fig = dict(data=data, layout=layout)
 
-    # Moving averages as line plots.
+    # Moving averages as (WebGL) line plots.
     for window in movavg_windows:
-        mv_close = ts.mov_avg(ratesdf.close, window=window)
-        mv_datetime = ts.truncate_start(ratesdf.datetime, window)
+        mv_close = ts.mov_avg(close, window=window)
+        mv_datetime, mv_close = _line(ts.truncate_start(candles.time, window), mv_close, max_points)
 
         assert(len(mv_close) == len(mv_datetime))
 
         fig['data'].append(dict(
             x = mv_datetime,
             y = mv_close,
-            type = 'scatter',
+            type = 'scattergl',
             mode = 'lines',
             name = 'Moving Average (' + str(window) + ')',
             yaxis = 'y2',
@@ -93,17 +152,19 @@ def hist_rates(rates, product=None, savetofile=True, movavg_windows=[], bbands_w
         bbands_label = 'Bollinger Bands (' + str(bbands_window) + ', n_std=' + str(bbands_std) + ')'
 
         _, bb_lower, bb_upper = ts.bollingers(
-                ratesdf.close,
+                close,
                 window=bbands_window,
                 n_std=bbands_std,
                 )
 
-        bbands_dt = ts.truncate_start(ratesdf.datetime, bbands_window)
+        bbands_ts = ts.truncate_start(candles.time, bbands_window)
+        lower_dt, bb_lower = _line(bbands_ts, bb_lower, max_points)
+        upper_dt, bb_upper = _line(bbands_ts, bb_upper, max_points)
 
         lower_dict = dict(
-            x = bbands_dt,
+            x = lower_dt,
             y = bb_lower,
-            type ='scatter',
+            type ='scattergl',
             yaxis='y2',
             line = dict(width=_bbands_width),
             marker=dict(color=_bbands_col),
@@ -113,8 +174,9 @@ def hist_rates(rates, product=None, savetofile=True, movavg_windows=[], bbands_w
             )
 
         # Only need a shallow copy since we are only changing the top-level
-        # references of y and showlegend.
+        # references of x, y and showlegend.
         upper_dict = copy.copy(lower_dict)
+        upper_dict['x'] = upper_dt
         upper_dict['y'] = bb_upper
         upper_dict['showlegend'] = False
 
@@ -123,17 +185,14 @@ def hist_rates(rates, product=None, savetofile=True, movavg_windows=[], bbands_w
 
     # Volume bars.
 
-    # Generate colors based on close price delta.
-    vol_cols = []
-    for i, close in enumerate(ratesdf.close):
-        if i == 0 or close <= ratesdf.close[i-1]:
-            vol_cols.append(_decrease_col)
-            continue
-        vol_cols.append(_increase_col)
+    # Colors based on close price delta (the first bar counts as a decrease).
+    rising = np.zeros(len(shown), dtype=bool)
+    rising[1:] = shown.close[1:] > shown.close[:-1]
+    vol_cols = np.where(rising, _increase_col, _decrease_col)
 
     fig['data'].append(dict(
-        x = ratesdf.datetime,
-        y = ratesdf.vol,
+        x = shown_dt,
+        y = shown.volume,
         type = 'bar',
         marker = dict(color=vol_cols),
         showlegend = False,
@@ -154,10 +213,14 @@ def saveplot(fname_prefix, plotlydata=None):
 
     # Plotly candlestick graph
     if plotlydata is not None:
+        import plotly.offline
+
         plotly.offline.plot(plotlydata, filename=fname)
         return
 
     # Matplotlib graph
+    import matplotlib.pyplot as plt
+
     plt.savefig(fname + '.png')
 
 
@@ -0,0 +1,47 @@
+import base64
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules of gdaxtrader import each other by their bare names.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gdaxtrader'))
+
+# common must be imported before logger: logger imports common, which builds
+# its Logger at import time, so importing logger first fails on the cycle.
+import common  # noqa: F401
+import logger
+
+# Keep the log files of test runs out of the working directory.
+logger._log_dir = tempfile.mkdtemp(prefix='gdaxtrader-tests-')
+
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    """
+    Returns a function which starts a mockexchange.MockExchange with the given
+    options and points common.api_url at it (without rate limiting) for the
+    rest of the test.
+    """
+    import auth
+    import httpapi
+    from mockexchange import MockExchange
+
+    exchanges = []
+
+    def start(**kwargs):
+        exchange = MockExchange(**kwargs)
+        exchanges.append(exchange)
+        monkeypatch.setattr(common, 'api_url', exchange.start())
+        monkeypatch.setattr(common, 'auth', auth.CoinbaseExchangeAuth(
+                'key', base64.b64encode(b'x' * 64).decode('ascii'), 'passphrase'))
+        httpapi.configure(rate_limited=False)
+        return exchange
+
+    yield start
+
+    if exchanges:
+        httpapi.configure(rate_limited=True)
+    for exchange in exchanges:
+        exchange.stop()
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+import accounts
+
+
+class _Resp(object):
+    def json(self):
+        return [
+            {'currency': 'BTC', 'balance': '1', 'available': '1', 'hold': '0'},
+            {'currency': 'USD', 'balance': '1000', 'available': '1000', 'hold': '0'},
+            ]
+
+
+@pytest.fixture
+def info(monkeypatch):
+    monkeypatch.setattr(accounts.httpapi, 'get', lambda url, auth: _Resp())
+    return accounts.Info(ttl=60)
+
+def _fill(order_id, side='sell', size='0.5', age=-5):
+    """
+    A fill created <age> seconds ago (by default, after the refresh).
+    """
+    created_at = time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(time.time() - age))
+    return {'order_id': order_id, 'product_id': 'BTC-USD', 'side': side,
+            'price': '100', 'size': size, 'fee': '0', 'created_at': created_at}
+
+
+def test_fill_of_placed_order_is_applied(info):
+    info.on_order_placed('oid-1', 'BTC-USD', 'sell', 100, 0.5)
+    info.on_fill(_fill('oid-1'))
+
+    assert (info.hold('BTC'), info.balance('BTC'), info.available('USD')) == (0, 0.5, 1050)
+    assert info.misses == 0
+
+def test_fill_of_unknown_order_invalidates(info):
+    info.on_fill(_fill('placed-elsewhere'))
+
+    assert info.hold('BTC') == 0
+    assert info.misses == 1
+
+def test_fill_before_refresh_is_not_applied_again(info):
+    info.on_order_placed('oid-1', 'BTC-USD', 'sell', 100, 1)
+    info.on_fill(_fill('oid-1', age=60))
+
+    assert (info.hold('BTC'), info.balance('BTC')) == (1, 1)
+    assert info.misses == 0
+
+def test_done_orders_are_forgotten(info):
+    info.on_order_placed('oid-1', 'BTC-USD', 'sell', 100, 1)
+    info.on_order_placed('oid-2', 'BTC-USD', 'sell', 100, 0.1)
+    info.on_fill(_fill('oid-1', size='0.5'))
+    assert set(info._placed) == {'oid-1', 'oid-2'}
+
+    info.on_fill(_fill('oid-1', size='0.5'))
+    info.on_order_done('oid-2')
+    assert info._placed == {}
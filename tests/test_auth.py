@@ -0,0 +1,39 @@
+import auth
+import common
+
+
+def _signer(time_url):
+    return auth.CoinbaseExchangeAuth('key', 'eHh4eA==', 'passphrase', time_url=time_url)
+
+
+def test_timestamp_syncs_with_server_clock(mock_api):
+    exchange = mock_api()
+    signer = _signer(common.api_url + 'time')
+
+    signer.timestamp()
+    signer.timestamp()
+
+    assert signer._time_synced is not None
+    assert abs(signer._time_offset) < 1
+    assert exchange.n_requests == 1
+
+def test_failed_sync_is_retried_later(mock_api, monkeypatch):
+    exchange = mock_api()
+    # The mock answers unknown paths with a 404.
+    signer = _signer(common.api_url + 'no-time')
+    clock = [1000.0]
+    monkeypatch.setattr(auth.time, 'monotonic', lambda: clock[0])
+
+    float(signer.timestamp())
+    signer.timestamp()
+
+    assert signer._time_synced is None
+    assert signer._time_offset == 0
+    assert exchange.n_requests == 1
+
+    clock[0] += auth._time_sync_retry
+    signer.time_url = common.api_url + 'time'
+    signer.timestamp()
+
+    assert signer._time_synced == clock[0]
+    assert exchange.n_requests == 2
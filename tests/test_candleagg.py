@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+import candleagg
+import rollup
+import scrape
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    Records the candles stored and the rollup updates.
+    """
+    calls = {'stored': [], 'rollups': []}
+
+    def store_rates(rates, product, rollups=True):
+        assert not rollups
+        calls['stored'].extend(rates)
+        return len(rates)
+
+    monkeypatch.setattr(scrape, 'store_rates', store_rates)
+    monkeypatch.setattr(rollup, 'update', lambda product, lo, hi: calls['rollups'].append((product, lo, hi)))
+    return calls
+
+
+def test_store_sink_flushes_pending_rollups(db):
+    sink = candleagg.StoreSink(60, rollup_secs=300)
+    sink('BTC-USD', 60, [600, 1, 1, 1, 1, 1])
+    sink('ETH-USD', 60, [840, 1, 1, 1, 1, 1])
+    assert db['rollups'] == []
+
+    # Only BTC-USD has been quiet for rollup_secs.
+    sink.flush(now=1000)
+    assert db['rollups'] == [('BTC-USD', 600, 600)]
+
+    sink.flush()
+    assert db['rollups'] == [('BTC-USD', 600, 600), ('ETH-USD', 840, 840)]
+
+def test_store_sink_writes_batches_off_the_feed_thread(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def store_rates(rates, product, rollups=True):
+        release.wait(5)
+        calls.append((threading.current_thread(), product, [rate[0] for rate in rates]))
+        return len(rates)
+
+    monkeypatch.setattr(scrape, 'store_rates', store_rates)
+    monkeypatch.setattr(rollup, 'update', lambda product, lo, hi: None)
+
+    sink = candleagg.StoreSink(60)
+    # None of these wait for the DB, which is blocked.
+    for ts in range(0, 600, 60):
+        sink('BTC-USD', 60, [ts, 1, 1, 1, 1, 1])
+    sink('BTC-USD', 5, [0, 1, 1, 1, 1, 1])
+    assert calls == []
+
+    release.set()
+    sink.flush()
+
+    assert all(thread is not threading.current_thread() for thread, _, _ in calls)
+    assert [ts for _, _, stored in calls for ts in stored] == list(range(0, 600, 60))
+    # Candles queued while the first write was blocked are written together.
+    assert len(calls) < 10
+
+def test_store_sink_drops_failed_batches(monkeypatch):
+    def store_rates(rates, product, rollups=True):
+        raise RuntimeError('DB down')
+
+    rollups = []
+    monkeypatch.setattr(scrape, 'store_rates', store_rates)
+    monkeypatch.setattr(rollup, 'update', lambda product, lo, hi: rollups.append((product, lo, hi)))
+
+    sink = candleagg.StoreSink(60)
+    sink('BTC-USD', 60, [600, 1, 1, 1, 1, 1])
+    sink.flush()
+
+    assert rollups == []
+
+def test_on_candle_runs_outside_the_lock():
+    locked = []
+    agg = candleagg.CandleAggregator('BTC-USD', [60])
+    agg.on_candle = lambda product, g, rate: locked.append(agg._lock.locked())
+
+    agg.add_trade(10, 1, 1)
+    agg.add_trade(70, 1, 1)
+    agg.add_trade(130, 1, 1)
+    agg.flush(1000)
+
+    # The first bucket is partial.
+    assert locked == [False, False]
+
+
+def _match(ts, price, msg_type='match'):
+    return {'type': msg_type, 'product_id': 'BTC-USD', 'price': str(price), 'size': '1',
+            'time': '2017-09-01T00:{:02d}:{:02d}.000000Z'.format(ts // 60, ts % 60)}
+
+def _aggregate(msgs):
+    candles = []
+    agg = candleagg.CandleAggregator('BTC-USD', [60],
+            on_candle=lambda product, g, rate: candles.append(rate))
+    for msg in msgs:
+        agg.process(msg)
+    return agg, [int(rate[0]) % 3600 for rate in candles]
+
+
+def test_first_bucket_after_subscribe_is_dropped():
+    agg, starts = _aggregate([
+        {'type': 'subscriptions'},
+        _match(30, 1, 'last_match'),
+        _match(50, 1),
+        _match(70, 2),
+        _match(130, 3),
+        ])
+
+    assert starts == [60]
+    assert agg.n_partial == 1
+    assert agg.n_trades == 3
+
+def test_buckets_across_resubscribe_are_dropped():
+    agg, starts = _aggregate([
+        _match(10, 1),
+        _match(70, 2),
+        _match(130, 3),
+        # Reconnected within the bucket of the last trade.
+        {'type': 'subscriptions'},
+        _match(150, 4),
+        _match(190, 5),
+        # Reconnected in a later bucket; 180 was still open.
+        {'type': 'subscriptions'},
+        _match(310, 6),
+        _match(370, 7),
+        _match(430, 8),
+        ])
+
+    assert starts == [60, 360]
+    assert agg.n_partial == 4
@@ -0,0 +1,79 @@
+import os
+import random
+from datetime import datetime
+
+import pytest
+
+import candlecache
+import marketdata
+
+_g = 60
+_t0 = 1500000000 // _g * _g
+
+
+def _rates(start, end, salt=0):
+    return [[t, 1.0, 2.0, 1.5, 1.5 + salt, 10.0] for t in range(start, end + _g, _g)]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(candlecache, '_cache_dir', str(tmp_path))
+    monkeypatch.setattr(candlecache, '_loaded', {})
+    return tmp_path
+
+
+def test_put_and_get_match_reference():
+    rand = random.Random(0)
+    reference = {}
+    for salt in range(60):
+        start = _t0 + rand.randrange(0, 5000) * _g
+        end = start + rand.randrange(0, 300) * _g
+        rates = _rates(start, end, salt)
+        candlecache.put('BTC-USD', _g, [(start, end)], rates)
+        for rate in rates:
+            reference[rate[0]] = rate
+
+    expected = [reference[t] for t in sorted(reference, reverse=True)]
+    assert candlecache.get('BTC-USD', _g, _t0, _t0 + 6000 * _g).to_rates() == expected
+
+    # The same after reloading from disk.
+    candlecache._loaded.clear()
+    assert candlecache.get('BTC-USD', _g, _t0, _t0 + 6000 * _g).to_rates() == expected
+
+def test_put_writes_segments(cache_dir):
+    end = _t0
+    for i in range(64):
+        start = _t0 - (i + 1) * 100 * _g
+        candlecache.put('BTC-USD', _g, [(start, end)], _rates(start, start + 99 * _g))
+        end = start
+        # Sizes of the segments at least halve, so there are O(log n) of them.
+        assert len(candlecache._segment_ids('BTC-USD', _g)) <= 7
+
+    base = os.path.join(str(cache_dir), 'BTC-USD_60.npy')
+    inode = os.stat(base).st_ino
+    candlecache.put('BTC-USD', _g, [(_t0 + _g, _t0 + _g)], _rates(_t0 + _g, _t0 + _g))
+    assert os.stat(base).st_ino == inode
+    assert len(candlecache.get('BTC-USD', _g, 0, _t0 + _g)) == 6401
+
+def test_missing():
+    candlecache.put('BTC-USD', _g, [(_t0, _t0 + 9 * _g), (_t0 + 20 * _g, _t0 + 29 * _g)], [])
+
+    assert candlecache.missing('BTC-USD', _g, _t0, _t0 + 29 * _g) == [(_t0 + 10 * _g, _t0 + 19 * _g)]
+    assert candlecache.missing('BTC-USD', _g, _t0 - _g, _t0 + 31 * _g) == [
+            (_t0 - _g, _t0 - _g), (_t0 + 10 * _g, _t0 + 19 * _g), (_t0 + 30 * _g, _t0 + 31 * _g)]
+    assert candlecache.missing('BTC-USD', _g, _t0 + _g, _t0 + 5 * _g) == []
+
+def test_get_rates_full_hit_makes_no_request(monkeypatch):
+    rates = _rates(_t0, _t0 + 199 * _g)
+    candlecache.put('BTC-USD', _g, [(_t0, _t0 + 199 * _g)], rates)
+
+    def get(*args, **kwargs):
+        raise AssertionError('unexpected request')
+    monkeypatch.setattr(marketdata.httpapi, 'get', get)
+
+    cached, resp = marketdata.get_rates('BTC-USD', datetime.utcfromtimestamp(_t0),
+            datetime.utcfromtimestamp(_t0 + 199 * _g), _g, cache=True)
+
+    assert cached == rates[::-1]
+    assert resp.status_code == 200
+    assert resp.json() == cached
@@ -0,0 +1,77 @@
+import numpy as np
+
+from candles import Candles
+
+
+def _tick(ts, price=1.0, volume=1.0):
+    return [ts, price, price, price, price, volume]
+
+def _times(candles):
+    return candles.time.astype(np.int64).tolist()
+
+
+def test_from_rates_sorts_and_keeps_first_duplicate():
+    candles = Candles.from_rates([_tick(180), _tick(60, 1), _tick(120), _tick(60, 2)])
+
+    assert _times(candles) == [60, 120, 180]
+    assert candles.close[0] == 1
+    assert candles.to_rates()[0] == [180, 1.0, 1.0, 1.0, 1.0, 1.0]
+    assert isinstance(candles.to_rates()[0][0], int)
+
+def test_append_newer_at_tail():
+    candles = Candles.from_rates([_tick(60), _tick(120)])
+    candles.append([_tick(240), _tick(180)])
+    candles.append([])
+
+    assert _times(candles) == [60, 120, 180, 240]
+
+def test_overlapping_append_replaces_existing():
+    candles = Candles.from_rates([_tick(ts, 1) for ts in range(60, 360, 60)])
+    candles.append([_tick(240, 2), _tick(300, 2), _tick(360, 2)])
+
+    assert _times(candles) == [60, 120, 180, 240, 300, 360]
+    assert candles.close.tolist() == [1, 1, 1, 2, 2, 2]
+
+def test_out_of_order_append_merges():
+    candles = Candles.from_rates([_tick(ts, 1) for ts in (60, 180, 300)])
+    candles.append([_tick(360, 2), _tick(0, 2), _tick(240, 2), _tick(180, 2), _tick(120, 2)])
+
+    assert _times(candles) == [0, 60, 120, 180, 240, 300, 360]
+    assert candles.close.tolist() == [2, 1, 2, 2, 2, 1, 2]
+
+def test_append_matches_from_rates_of_union():
+    rng = np.random.RandomState(0)
+    old = [_tick(int(ts), 1) for ts in rng.choice(1000, 300, replace=False) * 60]
+    new = [_tick(int(ts), 2) for ts in rng.choice(1000, 300, replace=False) * 60]
+
+    candles = Candles.from_rates(old).append(new)
+
+    # Appended ticks win, so they go first in the union.
+    np.testing.assert_array_equal(candles.data, Candles.from_rates(new + old).data)
+
+def test_append_to_slice_does_not_touch_parent():
+    candles = Candles.from_rates([_tick(ts, 1) for ts in range(0, 600, 60)])
+    head = candles.slice(None, 120)
+    head.append([_tick(180, 2)])
+
+    assert _times(head) == [0, 60, 120, 180]
+    assert candles.close.tolist() == [1] * 10
+
+def test_slice_bounds():
+    candles = Candles.from_rates([_tick(ts) for ts in range(60, 360, 60)])
+
+    assert _times(candles.slice(120, 240)) == [120, 180, 240]
+    assert _times(candles.slice(90, 250)) == [120, 180, 240]
+    assert _times(candles.slice(None, 120)) == [60, 120]
+    assert _times(candles.slice(240)) == [240, 300]
+    assert _times(candles.slice()) == [60, 120, 180, 240, 300]
+    assert len(candles.slice(0, 30)) == 0
+    assert len(candles.slice(400, 500)) == 0
+    assert len(candles.slice(200, 100)) == 0
+    assert len(Candles().slice(0, 100)) == 0
+
+def test_slice_is_a_view():
+    candles = Candles.from_rates([_tick(ts) for ts in range(60, 360, 60)])
+    mid = candles.slice(120, 240)
+
+    assert np.shares_memory(mid.data, candles.data)
@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from psycopg2.pool import PoolError
+
+import db
+
+
+class _Cursor(object):
+    def execute(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+class _Conn(object):
+    autocommit = True
+    closed = 0
+
+    def set_session(self, autocommit):
+        pass
+
+    def cursor(self):
+        return _Cursor()
+
+class _Pool(object):
+    """
+    Raises PoolError when exhausted, like psycopg2's ThreadedConnectionPool.
+    """
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.maxconn = maxconn
+        self.n_used = 0
+        self.max_used = 0
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        with self._lock:
+            if self.n_used == self.maxconn:
+                raise PoolError('connection pool exhausted')
+            self.n_used += 1
+            self.max_used = max(self.max_used, self.n_used)
+        return _Conn()
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            self.n_used -= 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(db, 'ThreadedConnectionPool', _Pool)
+    monkeypatch.setattr(db, 'dbconfig', {'db_name': 'test', 'db_user': 'root', 'host': 'localhost', 'port': 26257})
+    monkeypatch.setattr(db, '_pool', None)
+    monkeypatch.setattr(db, '_slots', None)
+    return db._get_pool()
+
+
+def test_connection_waits_for_a_free_connection(pool):
+    def borrow(_):
+        with db.connection():
+            time.sleep(0.01)
+
+    with ThreadPoolExecutor(max_workers=2 * db._max_conns) as workers:
+        list(workers.map(borrow, range(8 * db._max_conns)))
+
+    assert pool.max_used == db._max_conns
+    assert pool.n_used == 0
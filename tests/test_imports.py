@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+_src_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gdaxtrader')
+
+# Libraries each module must not load on import. Config files are read with
+# yaml, and the log file is only created by the first log call (see common).
+_lazy = ['yaml', 'pandas', 'plotly', 'matplotlib']
+
+_not_imported = {
+        'common': _lazy + ['requests', 'numpy', 'psycopg2', 'auth'],
+        'httpapi': _lazy,
+        'marketdata': _lazy,
+        'orders': _lazy,
+        'accounts': _lazy,
+        'scrape': _lazy,
+        'ratesutil': _lazy,
+        'timeseries': _lazy,
+        'visualize': _lazy,
+        }
+
+def _import(module, cwd):
+    """
+    Imports module in a fresh interpreter and returns the names in
+    sys.modules afterwards.
+    """
+    out = subprocess.run(
+            [sys.executable, '-c', 'import json, sys; import {}; print(json.dumps(sorted(sys.modules)))'.format(module)],
+            cwd=str(cwd), env=dict(os.environ, PYTHONPATH=_src_dir),
+            stdout=subprocess.PIPE, check=True,
+            ).stdout.decode('utf-8')
+    return set(json.loads(out))
+
+
+@pytest.mark.parametrize('module', sorted(_not_imported))
+def test_import_is_lazy(module, tmp_path):
+    loaded = _import(module, tmp_path)
+
+    assert module in loaded
+    assert sorted(set(_not_imported[module]) & loaded) == []
+    # No log file.
+    assert os.listdir(str(tmp_path)) == []
+
+
+# Budget in microseconds for the time spent in the project's own modules
+# (excluding the libraries they import) by `import common, scrape`. It is
+# ~15ms on a laptop; the margin absorbs slow CI machines.
+_import_budget_us = 100000
+
+def _project_import_us(statement, cwd):
+    """
+    Runs statement under `python -X importtime` and returns the self time in
+    microseconds of each project module imported.
+    """
+    project = {name[:-3] for name in os.listdir(_src_dir) if name.endswith('.py')}
+    err = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', statement],
+            cwd=str(cwd), env=dict(os.environ, PYTHONPATH=_src_dir),
+            stderr=subprocess.PIPE, check=True,
+            ).stderr.decode('utf-8')
+
+    times = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name in project and self_us.strip().isdigit():
+            times[name] = int(self_us)
+    return times
+
+def test_import_time_budget(tmp_path):
+    # The first run may compile the modules.
+    _project_import_us('import common, scrape', tmp_path)
+    runs = [_project_import_us('import common, scrape', tmp_path) for _ in range(3)]
+
+    assert {'common', 'logger', 'scrape', 'marketdata'} <= set(runs[0])
+    assert min(sum(times.values()) for times in runs) < _import_budget_us, runs
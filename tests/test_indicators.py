@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+import pytest
+
+import indicators
+
+
+def _walk(n, seed=0, start=4000.0):
+    return start + np.cumsum(np.random.RandomState(seed).normal(0, 1, n))
+
+
+@pytest.mark.parametrize('window', [1, 2, 14, 50])
+def test_streaming_mov_avg_matches_batch(window):
+    rates = _walk(500)
+    stream = indicators.MovAvg(window)
+    out = [stream.push(rate) for rate in rates]
+
+    assert out[:window - 1] == [None] * (window - 1)
+    np.testing.assert_allclose(out[window - 1:], indicators.mov_avg(rates, window), rtol=1e-12)
+
+@pytest.mark.parametrize('window', [2, 14, 50])
+def test_streaming_bollingers_match_batch(window):
+    rates = _walk(500)
+    stream = indicators.Bollingers(window, n_std=2)
+    out = [stream.push(rate) for rate in rates]
+
+    assert out[:window - 1] == [None] * (window - 1)
+    for streamed, batch in zip(zip(*out[window - 1:]), indicators.bollingers(rates, window, 2)):
+        np.testing.assert_allclose(streamed, batch, rtol=1e-9)
+
+def test_rolling_window_std_matches_batch_with_resyncs(monkeypatch):
+    # Resync more often than the window is long, as with window > 16384.
+    monkeypatch.setattr(indicators, '_resync_ticks', 8)
+    window = 20
+    rates = _walk(1000, start=1e6)
+    win = indicators.RollingWindow(window)
+
+    streamed = []
+    for rate in rates:
+        win.push(rate)
+        assert 0 < win._until_resync <= 8
+        if win.ready():
+            streamed.append(win.std())
+
+    np.testing.assert_allclose(streamed, indicators.rolling_std(rates, window), rtol=1e-6)
+
+def test_rolling_window_of_one_has_no_sample_std():
+    win = indicators.RollingWindow(1)
+    win.push(3.0)
+
+    assert win.mean == 3.0
+    assert math.isnan(win.std())
+    assert win.std(ddof=0) == 0.0
+
+
+# The loop implementations of timeseries before indicators.
+
+def _loop_mov_avg(rates, window):
+    if len(rates) < window:
+        return []
+
+    mas = []
+    for i, rate in enumerate(rates):
+        if i < window - 1:
+            continue
+        if len(mas) == 0:
+            mas.append(sum(rates[:window]) / window)
+            continue
+        mas.append(mas[-1] * ((window - 1) / window) + (rate / window))
+    return mas
+
+def _loop_bollingers(rates, window, n_std):
+    mean, lower, upper = [], [], []
+    for i in range(window - 1, len(rates)):
+        seg = rates[i - window + 1:i + 1]
+        m = sum(seg) / window
+        std = math.sqrt(sum((x - m) ** 2 for x in seg) / (window - 1)) if window > 1 else float('nan')
+        mean.append(m)
+        lower.append(m - n_std * std)
+        upper.append(m + n_std * std)
+    return mean, lower, upper
+
+def _loop_rsi(rates, window):
+    deltas = [b - a for a, b in zip(rates, rates[1:])]
+    gains = _loop_mov_avg([max(d, 0) for d in deltas], window)
+    losses = _loop_mov_avg([max(-d, 0) for d in deltas], window)
+    return [100 - 100 / (1 + g / l) for g, l in zip(gains, losses)]
+
+
+@pytest.mark.parametrize('n,window', [(5, 14), (14, 14), (500, 1), (500, 14), (10000, 200)])
+def test_mov_avg_matches_loop(n, window):
+    rates = _walk(n).tolist()
+    np.testing.assert_allclose(indicators.mov_avg(rates, window), _loop_mov_avg(rates, window), rtol=1e-10)
+
+@pytest.mark.parametrize('n,window', [(5, 14), (14, 14), (500, 1), (500, 14), (10000, 200)])
+def test_bollingers_match_loop(n, window):
+    rates = _walk(n, start=1e5).tolist()
+    for batch, loop in zip(indicators.bollingers(rates, window, 2), _loop_bollingers(rates, window, 2)):
+        assert len(batch) == len(loop)
+        np.testing.assert_allclose(batch, loop, rtol=1e-9)
+
+@pytest.mark.parametrize('n,window', [(14, 14), (500, 14), (500, 1)])
+def test_sma_and_rolling_std_match_loop(n, window):
+    rates = _walk(n).tolist()
+    mean, lower, _ = _loop_bollingers(rates, window, 1)
+
+    np.testing.assert_allclose(indicators.sma(rates, window), mean, rtol=1e-10)
+    np.testing.assert_allclose(indicators.rolling_std(rates, window), np.subtract(mean, lower), rtol=1e-6)
+
+def test_rsi_matches_loop():
+    rates = _walk(500).tolist()
+    np.testing.assert_allclose(indicators.rsi(rates, 14), _loop_rsi(rates, 14), rtol=1e-9)
+    assert len(indicators.rsi(rates[:14], 14)) == 0
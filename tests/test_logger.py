@@ -0,0 +1,36 @@
+import logging
+import queue
+
+import logger
+
+
+def test_queued_record_keeps_args_as_logged():
+    log_queue = queue.Queue()
+    handler = logger._LazyQueueHandler(log_queue)
+    params = {'limit': 100, 'after': '1'}
+
+    record = logging.LogRecord('logger', logging.INFO, __file__, 1, 'GET %s params=%s',
+            ('fills', params), None)
+    handler.emit(record)
+    # As orders.pages does right after each request.
+    params['after'] = '2'
+
+    assert log_queue.get_nowait().getMessage() == "GET fills params={'limit': 100, 'after': '1'}"
+
+def _record(level):
+    return logging.LogRecord('logger', level, __file__, 1, 'message', (), None)
+
+def test_stderr_level_applies_when_logged():
+    log = logger.Logger(0)
+    screen = logger._StderrFilter()
+
+    previous = log.stderr_level(logging.WARNING)
+    info, warning = _record(logging.INFO), _record(logging.WARNING)
+    log._stderr_level.filter(info)
+    log._stderr_level.filter(warning)
+    # Restored before the writer thread gets to the records.
+    log.stderr_level(previous)
+
+    assert previous == logging.DEBUG
+    assert not screen.filter(info)
+    assert screen.filter(warning)
@@ -0,0 +1,25 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_prometheus_with_errors_and_statuses():
+    metrics.error('GET', '/time', total=0.5)
+    metrics.record('GET', '/time', 200, network=0.01, total=0.02)
+    metrics.record('GET', '/time', 429, total=0.01)
+
+    snap = metrics.snapshot()
+    assert snap['GET /time']['status'] == {200: 1, 429: 1}
+    assert snap['GET /time']['errors'] == 1
+    assert snap['GET /time']['total']['count'] == 3
+
+    text = metrics.prometheus()
+    assert 'gdaxtrader_requests_total{endpoint="/time",method="GET",status="200"} 1' in text
+    assert 'gdaxtrader_request_errors_total{endpoint="/time",method="GET"} 1' in text
@@ -0,0 +1,75 @@
+import orderbook
+
+
+def test_feed_survives_failing_handler():
+    seen = []
+
+    def failing(msg):
+        raise RuntimeError('DB down')
+
+    feed = orderbook.Feed(['BTC-USD'], handlers=[failing, seen.append])
+    snapshot = {'type': 'snapshot', 'product_id': 'BTC-USD',
+            'bids': [['99', '1']], 'asks': [['101', '1']]}
+    feed._dispatch(snapshot)
+
+    assert seen == [snapshot]
+    assert feed.books['BTC-USD'].spread() == 2
+
+def test_resync_aggregates_level3_orders(monkeypatch):
+    class Resp(object):
+        status_code = 200
+
+        def json(self):
+            return {
+                'sequence': 7,
+                'bids': [['99', '1', 'a'], ['99', '0.5', 'b'], ['50', '2', 'c']],
+                'asks': [['101', '1', 'd']],
+                }
+
+    requested = []
+    monkeypatch.setattr(orderbook.httpapi, 'get',
+            lambda url, params, auth: requested.append(params) or Resp())
+
+    book = orderbook.OrderBook('BTC-USD')
+    book.resync()
+
+    assert requested == [{'level': 3}]
+    assert book.top(5) == ([(99.0, 1.5), (50.0, 2.0)], [(101.0, 1.0)])
+    assert book.sequence == 7 and book.synced
+
+def test_feed_skips_malformed_frames_and_closes_socket(monkeypatch):
+    import json
+    import websocket
+
+    frames = ['{"type": "snap', '[1, 2]', json.dumps({'type': 'snapshot', 'product_id': 'BTC-USD',
+            'bids': [['99', '1']], 'asks': [['101', '1']]})]
+    sockets = []
+
+    class WebSocket(object):
+        closed = False
+
+        def send(self, msg):
+            pass
+
+        def recv(self):
+            if frames:
+                return frames.pop(0)
+            feed.stop()
+            raise websocket.WebSocketConnectionClosedException('closed')
+
+        def close(self):
+            self.closed = True
+
+    def create_connection(url):
+        sockets.append(WebSocket())
+        return sockets[-1]
+
+    monkeypatch.setattr(websocket, 'create_connection', create_connection)
+    monkeypatch.setattr(orderbook, '_reconnect_delay', 0)
+    stopped = []
+    feed = orderbook.Feed(['BTC-USD'], on_stop=[lambda: stopped.append(True)])
+    feed.run()
+
+    assert feed.books['BTC-USD'].best_bid() == 99
+    assert [ws.closed for ws in sockets] == [True]
+    assert stopped == [True]
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+import requests
+
+import orders
+
+
+class _Resp(object):
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    """
+    Accepts every order except those priced at 13, whose request fails.
+    """
+    placed = []
+
+    def post(url, data, auth):
+        params = json.loads(data)
+        if params['price'] == 13:
+            raise requests.ConnectionError('connection reset')
+        placed.append(params['price'])
+        return _Resp(200, {'id': 'oid-{}'.format(params['price'])})
+
+    def delete(url, auth):
+        oid = url.rsplit('/', 1)[-1]
+        if oid == 'oid-13':
+            raise requests.Timeout('timed out')
+        return _Resp(200, [oid])
+
+    monkeypatch.setattr(orders.httpapi, 'post', post)
+    monkeypatch.setattr(orders.httpapi, 'delete', delete)
+    return placed
+
+
+def test_place_many_keeps_results_of_other_orders(exchange):
+    manager = orders.OrderManager(n_workers=4)
+    ladder = [orders.Limit('buy', 'BTC-USD', price, 0.01) for price in range(10, 16)]
+
+    results = manager.place_many(ladder)
+    manager.shutdown()
+
+    assert [r.order for r in results] == ladder
+    assert [r.oid for r in results] == ['oid-10', 'oid-11', 'oid-12', None, 'oid-14', 'oid-15']
+    assert sorted(exchange) == [10, 11, 12, 14, 15]
+
+    failed = results[3]
+    assert isinstance(failed.error, requests.ConnectionError)
+    assert failed.status_code is None and failed.resp is None
+    assert all(r.error is None and r.status_code == 200 for r in results if r is not failed)
+
+def test_cancel_many_keeps_results_of_other_cancels(exchange):
+    manager = orders.OrderManager(n_workers=4)
+
+    results = manager.cancel_many(['oid-12', 'oid-13', 'oid-14'])
+    manager.shutdown()
+
+    assert [r.oid for r in results] == ['oid-12', None, 'oid-14']
+    assert isinstance(results[1].error, requests.Timeout)
+
+def test_cancel_replace_skips_placement_after_failed_cancel(exchange):
+    manager = orders.OrderManager(n_workers=2)
+
+    cancelled, placed = manager.cancel_replace('oid-13', orders.Limit('buy', 'BTC-USD', 20, 0.01))
+    manager.shutdown()
+
+    assert cancelled.oid is None and cancelled.error is not None
+    assert placed is None
+    assert exchange == []
@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+
+import pytest
+
+import ordersync
+
+
+class _Resp(object):
+    def __init__(self, status_code, entries=(), headers=None):
+        self.status_code = status_code
+        self.reason = 'OK' if status_code == 200 else 'Internal Server Error'
+        self.headers = headers or {}
+        self._entries = list(entries)
+
+    def json(self):
+        return self._entries
+
+class _Cursor(object):
+    def __init__(self, saved):
+        self.saved = saved
+
+    def execute(self, query, args=()):
+        if query.startswith('UPSERT'):
+            self.saved.append(args)
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+class _Conn(object):
+    def __init__(self, saved):
+        self.saved = saved
+
+    def cursor(self):
+        return _Cursor(self.saved)
+
+
+def _fill(trade_id):
+    return {'product_id': 'BTC-USD', 'trade_id': trade_id, 'order_id': 'oid', 'side': 'buy',
+            'price': '1', 'size': '1', 'created_at': '2017-09-01T00:00:00Z'}
+
+@pytest.fixture
+def exchange(monkeypatch):
+    """
+    Serves a first page of fills, then the responses in the returned list.
+    Returns the cursors saved.
+    """
+    saved = []
+    responses = [_Resp(200, [_fill(3), _fill(2)], {'CB-BEFORE': '3', 'CB-AFTER': '2'})]
+
+    @contextmanager
+    def connection():
+        yield _Conn(saved)
+
+    monkeypatch.setattr(ordersync.db, 'connection', connection)
+    monkeypatch.setattr(ordersync.db, 'ensure_schema', lambda cur, name, statements: None)
+    monkeypatch.setattr(ordersync, 'execute_values', lambda cur, query, rows: None)
+    monkeypatch.setattr(ordersync.orders.httpapi, 'get', lambda url, params, auth: responses.pop(0))
+    return responses, saved
+
+
+def test_first_sync_cut_short_saves_no_cursor(exchange):
+    responses, saved = exchange
+    responses.append(_Resp(500))
+
+    assert ordersync.sync_fills() == 2
+    assert saved == []
+
+def test_first_sync_saves_newest_cursor(exchange):
+    responses, saved = exchange
+    responses.append(_Resp(200, []))
+
+    assert ordersync.sync_fills() == 2
+    assert saved == [('fills', 'all', '3')]
@@ -0,0 +1,165 @@
+import time
+import types
+from datetime import datetime
+
+import pytest
+
+import candlecache
+import rollup
+import scheduler
+import scrape
+from marketdata import max_ticks
+from scheduler import Job, Scheduler
+
+# 2017-09-01T00:00:00Z, a candle close for every granularity used here.
+_now = 1504224000
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    Keeps the stored candle timestamps, checkpoints and rollup updates in
+    memory.
+    """
+    calls = {'stored': {}, 'checkpoints': {}, 'rollups': []}
+
+    def store_rates(rates, product, rollups=True):
+        assert not rollups
+        calls['stored'].setdefault(product, set()).update(rate[0] for rate in rates)
+        return len(rates)
+
+    def save_checkpoint(product, granularity, first_ts, last_ts):
+        calls['checkpoints'][(product, granularity)] = (first_ts, last_ts)
+
+    monkeypatch.setattr(scrape, 'store_rates', store_rates)
+    monkeypatch.setattr(scrape, 'load_checkpoint',
+            lambda product, granularity: calls['checkpoints'].get((product, granularity)))
+    monkeypatch.setattr(scrape, 'save_checkpoint', save_checkpoint)
+    monkeypatch.setattr(rollup, 'update', lambda product, lo, hi: calls['rollups'].append((product, lo, hi)))
+    return calls
+
+def _job(product, last_ts, priority=1, since=None):
+    job = Job(product, 60, priority=priority)
+    job.first_ts, job.last_ts = last_ts - 3600, last_ts
+    if since is not None:
+        job.since_ts = since
+    return job
+
+def _run(sched, job, kind, window):
+    job.busy = True
+    sched._n_busy += 1
+    sched._run_task(job, kind, window)
+
+
+def test_live_windows_go_first_by_priority_then_lag():
+    closed = candlecache.last_closed(60, _now)
+    near = _job('BTC-USD', _now - 600)
+    far = _job('ETH-USD', _now - 1200)
+    current = _job('LTC-USD', closed, since=_now - 86400)
+    sched = Scheduler([near, far, current], n_workers=3)
+
+    # The most lagging live window first; the up to date job has none.
+    assert sched._next_task(_now)[:2] == (far, 'live')
+    far.busy = True
+    assert sched._next_task(_now)[:2] == (near, 'live')
+    near.busy = True
+    assert sched._next_task(_now)[:2] == (current, 'backfill')
+
+    # Backfill leaves _live_reserve workers free.
+    sched._n_busy = sched.n_workers - scheduler._live_reserve
+    assert sched._next_task(_now) is None
+
+    # Priority beats lag, and jobs waiting to retry are skipped.
+    near.busy = far.busy = False
+    sched._n_busy = 0
+    near.priority = 2
+    assert sched._next_task(_now)[:2] == (near, 'live')
+    near.retry_at = _now + 1
+    assert sched._next_task(_now)[:2] == (far, 'live')
+
+def test_backfill_round_robins_within_a_priority():
+    closed = candlecache.last_closed(60, _now)
+    jobs = [_job(product, closed, since=_now - 86400) for product in ('BTC-USD', 'ETH-USD', 'LTC-USD')]
+    sched = Scheduler(jobs, n_workers=4)
+
+    order = []
+    for i in range(6):
+        job, kind, _ = sched._next_task(_now)
+        assert kind == 'backfill'
+        order.append(job.product)
+        job.dispatched_at = i + 1
+
+    assert order == ['BTC-USD', 'ETH-USD', 'LTC-USD'] * 2
+
+def test_windows_advance_against_mock_exchange(mock_api, db):
+    mock_api()
+    last_ts = _now - 60 * max_ticks * 3
+    job = _job('BTC-USD', last_ts, since=last_ts - 3600 - 60 * max_ticks)
+    sched = Scheduler([job], n_workers=2)
+
+    window = job.live_window(time.time())
+    assert window == (last_ts + 60, last_ts + 60 * max_ticks)
+    _run(sched, job, 'live', window)
+    assert job.last_ts == window[1]
+
+    window = job.backfill_window()
+    assert window == (job.since_ts, last_ts - 3600 - 60)
+    _run(sched, job, 'backfill', window)
+    assert job.first_ts == job.since_ts
+    assert job.backfill_window() is None
+
+    stored = db['stored']['BTC-USD']
+    assert set(range(last_ts + 60, last_ts + 60 * (max_ticks + 1), 60)) <= stored
+    assert set(range(job.since_ts, last_ts - 3600, 60)) <= stored
+    assert not sched._n_busy and not job.busy
+
+@pytest.mark.parametrize('gap_rate, offset, advanced, retry_at', [
+    # Published: stored.
+    (0, 3, True, 0),
+    # Not published yet: refetched with the next candle.
+    (1, 3, False, _now + 60),
+    # Still empty after settling: a period without trades.
+    (1, 30, True, 0),
+    ])
+def test_live_edge_waits_for_unpublished_candles(mock_api, db, monkeypatch, gap_rate, offset, advanced, retry_at):
+    mock_api(gap_rate=gap_rate)
+    now = _now + offset
+    monkeypatch.setattr(scheduler, 'time', types.SimpleNamespace(time=lambda: now))
+
+    closed = candlecache.last_closed(60, now)
+    job = _job('BTC-USD', closed - 60)
+    sched = Scheduler([job])
+
+    window = job.live_window(now)
+    assert window == (closed, closed)
+    _run(sched, job, 'live', window)
+
+    assert job.last_ts == (closed if advanced else closed - 60)
+    assert job.retry_at == retry_at
+
+def test_scheduler_catches_up_against_mock_exchange(mock_api, db):
+    mock_api()
+    g = 60
+    since = candlecache.last_closed(g) - g * (3 * max_ticks + 10)
+    start = datetime.utcfromtimestamp(since)
+    jobs = [Job('BTC-USD', g, since=start, priority=2), Job('ETH-USD', g, since=start)]
+    sched = Scheduler(jobs, n_workers=2)
+
+    sched.start()
+    try:
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            if all(job.backfill_remaining() == 0 and job.lag(time.time()) == 0 for job in jobs):
+                break
+            time.sleep(0.05)
+    finally:
+        sched.stop()
+        sched.join(10)
+
+    for job in jobs:
+        assert job.first_ts == since
+        stored = db['stored'][job.product]
+        assert set(range(since, job.last_ts + g, g)) <= stored
+        # Saved after the final rollup update.
+        assert db['checkpoints'][(job.product, g)] == (job.first_ts, job.last_ts)
+        assert any(product == job.product for product, _, _ in db['rollups'])
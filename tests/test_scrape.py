@@ -0,0 +1,137 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import marketdata
+import scrape
+
+
+class _Resp(object):
+    status_code = 200
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    """
+    Serves one candle per window and records the windows fetched.
+    """
+    fetched = []
+
+    def fetch_window(product, window, sec_per_tick):
+        fetched.append(window)
+        return [[int(marketdata.to_ts(window[0])), 1, 1, 1, 1, 1]], _Resp()
+
+    monkeypatch.setattr(scrape, '_fetch_window', fetch_window)
+    monkeypatch.setattr(scrape, 'load_checkpoint', lambda product, sec_per_tick: None)
+    monkeypatch.setattr(scrape, '_queue_sz', 2)
+    return fetched
+
+def _wait_for_threads(threads, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        alive = [t for t in threading.enumerate() if t not in threads]
+        if not alive:
+            return []
+        time.sleep(0.01)
+    return alive
+
+
+def test_failed_store_stops_fetchers(exchange, monkeypatch):
+    def store_rates(rates, product, **kwargs):
+        raise RuntimeError('DB down')
+
+    monkeypatch.setattr(scrape, 'store_rates', store_rates)
+
+    end_dt = datetime(2017, 9, 1)
+    start_dt = end_dt - timedelta(seconds=60 * marketdata.max_ticks * 100)
+    # The background log listener starts on the first record.
+    scrape.log.debug('starting test scrape')
+    before = threading.enumerate()
+
+    with pytest.raises(RuntimeError):
+        scrape.scrape_rates('BTC-USD', start_dt, end_dt, 60, n_workers=4)
+
+    assert _wait_for_threads(before) == []
+    # The fetchers stopped instead of walking every window.
+    assert len(exchange) < 100
+
+def test_interrupted_scrape_rolls_up_checkpointed_ranges(exchange, monkeypatch):
+    events = []
+    n_windows = 2 * scrape._rollup_windows + 5
+
+    def store_rates(rates, product, rollups=True):
+        assert not rollups
+        if sum(1 for e in events if e[0] == 'store') >= n_windows - 3:
+            raise KeyboardInterrupt
+        events.append(('store', rates[0][0]))
+        return len(rates)
+
+    monkeypatch.setattr(scrape, 'store_rates', store_rates)
+    monkeypatch.setattr(scrape.rollup, 'update', lambda product, lo, hi: events.append(('rollup', lo, hi)))
+    monkeypatch.setattr(scrape, 'save_checkpoint',
+            lambda product, g, first_ts, last_ts: events.append(('checkpoint', first_ts, last_ts)))
+
+    end_dt = datetime(2017, 9, 1)
+    start_dt = end_dt - timedelta(seconds=60 * (marketdata.max_ticks + 1) * n_windows - 60)
+
+    with pytest.raises(KeyboardInterrupt):
+        scrape.scrape_rates('BTC-USD', start_dt, end_dt, 60, n_workers=1)
+
+    stored = [e[1] for e in events if e[0] == 'store']
+    checkpoints = [i for i, e in enumerate(events) if e[0] == 'checkpoint']
+    assert checkpoints
+
+    # Every candle stored is rolled up, and before any checkpoint covering it.
+    for ts in stored:
+        rolled = [i for i, e in enumerate(events) if e[0] == 'rollup' and e[1] <= ts <= e[2]]
+        assert rolled
+        covering = [i for i in checkpoints if events[i][1] <= ts <= events[i][2]]
+        assert all(min(rolled) < i for i in covering)
+
+def test_failed_fetcher_is_raised(exchange, monkeypatch):
+    fetch_window = scrape._fetch_window
+    stored = []
+    rolled = []
+
+    def failing_fetch_window(product, window, sec_per_tick):
+        if len(exchange) == 3:
+            raise ValueError('bad response')
+        return fetch_window(product, window, sec_per_tick)
+
+    def store_rates(rates, product, rollups=True):
+        stored.append(rates[0][0])
+        return len(rates)
+
+    monkeypatch.setattr(scrape, '_fetch_window', failing_fetch_window)
+    monkeypatch.setattr(scrape, 'store_rates', store_rates)
+    monkeypatch.setattr(scrape, 'save_checkpoint', lambda *args: None)
+    monkeypatch.setattr(scrape.rollup, 'update', lambda product, lo, hi: rolled.append((lo, hi)))
+
+    end_dt = datetime(2017, 9, 1)
+    start_dt = end_dt - timedelta(seconds=60 * marketdata.max_ticks * 10)
+
+    with pytest.raises(ValueError):
+        scrape.scrape_rates('BTC-USD', start_dt, end_dt, 60, n_workers=1)
+
+    # Windows still queued when the fetcher fails may be dropped.
+    assert 1 <= len(stored) <= 3
+    # What was stored before the failure is still rolled up.
+    assert all(any(lo <= ts <= hi for lo, hi in rolled) for ts in stored)
+
+@pytest.mark.parametrize('gap_rate', [0, 0.3, 0.999])
+def test_sequential_and_parallel_rates_match(mock_api, gap_rate):
+    mock_api(gap_rate=gap_rate)
+    end_dt = datetime(2017, 9, 1)
+    start_dt = end_dt - timedelta(seconds=60 * marketdata.max_ticks * 5 + 600)
+
+    sequential = scrape.get_rates('BTC-USD', start_dt, end_dt, 60)
+    parallel = scrape.get_rates('BTC-USD', start_dt, end_dt, 60, n_workers=4)
+
+    assert sequential == parallel
+    times = [rate[0] for rate in sequential]
+    assert times == sorted(set(times), reverse=True)
+    assert all(marketdata.to_ts(start_dt) <= ts <= marketdata.to_ts(end_dt) for ts in times)
+    if gap_rate == 0:
+        assert len(sequential) == 5 * marketdata.max_ticks + 11
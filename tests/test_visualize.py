@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from candles import Candles
+import visualize
+
+
+def _candles(n, seed=0):
+    rng = np.random.RandomState(seed)
+    close = 4000 + np.cumsum(rng.normal(0, 1, n))
+    open_ = close + rng.normal(0, 1, n)
+    spread = rng.uniform(0, 2, n)
+    return Candles(np.vstack([
+        np.arange(n) * 60.0,
+        np.minimum(open_, close) - spread,
+        np.maximum(open_, close) + spread,
+        open_,
+        close,
+        rng.uniform(0, 10, n),
+        ]))
+
+def _loop_ohlc_buckets(candles, n_buckets):
+    rates = list(candles)
+    size = -(-len(rates) // n_buckets)
+    buckets = []
+    for i in range(0, len(rates), size):
+        bucket = rates[i:i + size]
+        buckets.append([
+            bucket[0][0],
+            min(rate[1] for rate in bucket),
+            max(rate[2] for rate in bucket),
+            bucket[0][3],
+            bucket[-1][4],
+            sum(rate[5] for rate in bucket),
+            ])
+    return buckets
+
+def _loop_minmax_buckets(x, y, n_buckets):
+    size = -(-len(y) // n_buckets)
+    idx = []
+    for i in range(0, len(y), size):
+        bucket = list(y[i:i + size])
+        lo = bucket.index(min(bucket))
+        hi = bucket.index(max(bucket))
+        idx.extend(i + j for j in sorted([lo, hi]))
+    return [x[i] for i in idx], [y[i] for i in idx]
+
+
+# (n, n_buckets): exact division, a short last bucket, one-candle buckets and
+# more buckets than candles.
+_shapes = [(100, 10), (103, 10), (97, 7), (10, 10), (5, 8), (1, 3)]
+
+@pytest.mark.parametrize('n, n_buckets', _shapes)
+def test_ohlc_buckets_match_loop(n, n_buckets):
+    candles = _candles(n)
+    buckets = visualize._ohlc_buckets(candles, n_buckets)
+
+    expected = _loop_ohlc_buckets(candles, n_buckets)
+    assert len(buckets) <= n_buckets
+    np.testing.assert_allclose(buckets.data.T, expected, rtol=1e-12)
+
+@pytest.mark.parametrize('n, n_buckets', _shapes)
+def test_minmax_buckets_match_loop(n, n_buckets):
+    candles = _candles(n)
+    x, y = visualize._minmax_buckets(candles.time, candles.close, n_buckets)
+
+    expected_x, expected_y = _loop_minmax_buckets(candles.time, candles.close, n_buckets)
+    assert x.tolist() == expected_x
+    assert y.tolist() == expected_y
+    # The envelope keeps the extremes in time order.
+    assert np.all(np.diff(x) >= 0)
+    assert y.min() == candles.close.min() and y.max() == candles.close.max()
+
+def test_minmax_buckets_ties_keep_first():
+    x = np.arange(6.0)
+    y = np.array([1.0, 1.0, 2.0, 3.0, 3.0, 3.0])
+
+    x_out, y_out = visualize._minmax_buckets(x, y, 2)
+
+    assert x_out.tolist() == [0, 2, 3, 3]
+    assert y_out.tolist() == [1, 2, 3, 3]